@@ -0,0 +1,72 @@
+"""
+Room-to-node affinity.
+
+Each cluster node gets a 160-bit id, sha1(node name), in the same space as
+Kademlia key digests. A room belongs to the node whose id is XOR-closest to
+sha1("room:{code}"), which is exactly where Kademlia puts the room record
+when that node's DHT id is the same. So the router and the DHT agree on
+who owns a room, and adding or removing a node only moves the rooms
+closest to it. Like Kademlia itself, the split is uneven for a handful
+of nodes (XOR ranges follow id prefixes) and evens out as nodes are added.
+
+Workers that own a room serve its dashboard sockets. A socket that lands on
+the wrong worker is told to reconnect to the owner, so one room's fan-out
+stays inside one process.
+"""
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+
+
+def digest(value):
+    return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest(), "big")
+
+
+class RoomRouter:
+    """Maps room codes to the owning cluster node."""
+
+    def __init__(self, nodes, local_name):
+        self.nodes = dict(nodes)
+        self.local_name = local_name
+        self._ids = {name: digest(name) for name in self.nodes}
+        self.owner = lru_cache(maxsize=65536)(self._owner)
+
+    @property
+    def clustered(self):
+        """True when more than one node shares the rooms."""
+        return len(self.nodes) > 1
+
+    def node_id(self, name=None):
+        """Kademlia node id (bytes) for `name`, default the local node."""
+        return hashlib.sha1((name or self.local_name).encode("utf-8")).digest()
+
+    def _owner(self, code):
+        if not self.clustered:
+            return self.local_name
+        key = digest(f"room:{code}")
+        return min(self._ids, key=lambda name: self._ids[name] ^ key)
+
+    def is_local(self, code):
+        return self.owner(code) == self.local_name
+
+    def ws_base(self, code):
+        """Websocket base URL of the room's owner, or '' if that's this node."""
+        owner = self.owner(code)
+        if owner == self.local_name:
+            return ""
+        return self.nodes[owner].get("ws_url", "")
+
+
+_router = None
+
+
+def get_router():
+    global _router
+    if _router is None:
+        nodes = getattr(settings, "NEO_CLUSTER_NODES", {}) or {}
+        local = getattr(settings, "NEO_NODE_NAME", "local")
+        if local not in nodes:
+            nodes = {**nodes, local: {}}
+        _router = RoomRouter(nodes, local)
+    return _router
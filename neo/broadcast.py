@@ -0,0 +1,91 @@
+"""
+Tick-based coalescing of group broadcasts.
+
+Sending a group message on every connect and disconnect turns a reconnect
+storm into a quadratic fan-out. A CoalescingBroadcaster collects join/leave
+notes and sends at most one group message per tick. A member's later note
+replaces their earlier one in the same tick, so that message only carries
+net changes.
+"""
+import asyncio
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingBroadcaster:
+    """
+    Per-process batcher for one group.
+
+    Notes are recorded synchronously. A flush task runs only while notes
+    are pending. Each tick it sends {"type": event_type, "joined": [...],
+    "left": [...]} to the group.
+    """
+
+    def __init__(self, group, event_type, tick=0.25):
+        self.group = group
+        self.event_type = event_type
+        self.tick = tick
+        self._pending = {}
+        self._task = None
+        self.events = 0
+        self.coalesced = 0
+        self.fanouts = 0
+        self.failures = 0
+        self.max_queue_depth = 0
+
+    def join(self, member):
+        self._note(member, "join")
+
+    def leave(self, member):
+        self._note(member, "leave")
+
+    def _note(self, member, op):
+        self.events += 1
+        if member in self._pending:
+            self.coalesced += 1
+        self._pending[member] = op
+        self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.tick)
+            await self.flush()
+
+    async def flush(self):
+        """Send everything noted so far as one group message."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        message = {
+            "type": self.event_type,
+            "joined": [member for member, op in pending.items() if op == "join"],
+            "left": [member for member, op in pending.items() if op == "leave"],
+        }
+        self.fanouts += 1
+        try:
+            await get_channel_layer().group_send(self.group, message)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Broadcast to {self.group} failed: {e}")
+
+    def stats(self):
+        return {
+            "tick": self.tick,
+            "events": self.events,
+            "coalesced": self.coalesced,
+            "fanouts": self.fanouts,
+            "failures": self.failures,
+            "queue_depth": len(self._pending),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+live_users_broadcaster = CoalescingBroadcaster(
+    "live_users", "users_delta", tick=getattr(settings, 'LIVE_USERS_BROADCAST_TICK', 0.25)
+)
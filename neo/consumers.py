@@ -1,78 +1,59 @@
 # neo/consumers.py
 import json  # Import JSON module for encoding/decoding messages
 import logging  # Import logging module for debugging and logging
-import time  # Import time module for rate limiting
-from collections import defaultdict  # Import defaultdict from collections module
 logger = logging.getLogger(__name__)  # Create a logger instance for this module
 from channels.generic.websocket import AsyncWebsocketConsumer  # Import base WebSocket consumer class
-from .models import UserProfile, Room, FileTransfer  # Import models for database interaction
-from django.utils import timezone  # Import timezone utility for timestamp handling
-from channels.db import database_sync_to_async  # Import utility to run sync DB calls asynchronously
+from .models import Room, FileTransfer  # Import models for database interaction
 from asgiref.sync import sync_to_async  # Import utility to convert sync functions to async
+from .affinity import get_router  # Import room-to-node router for consumer affinity
+from .presence import announce_present, get_presence_store, live_heartbeat, room_heartbeat, room_roster, roster_view  # Import the shared presence index
+from .broadcast import live_users_broadcaster  # Import the tick-coalesced live_users broadcaster
+from .presence_writer import presence_writer  # Import the write-behind is_online/last_seen buffer
+from .ratelimit import get_signaling_limits  # Import per-action signaling rate limits
+from .signaling import MAX_CANDIDATES_PER_MESSAGE, get_channel_registry, make_candidate_batcher  # Import signaling helpers
+from .hotlog import make_hot_log  # Import sampled, rate-capped logging for per-message paths
+from django.conf import settings  # Import settings for signaling toggles
 
 class LiveUserConsumer(AsyncWebsocketConsumer):  # Define consumer for live user tracking
-    active_users = set()  # Class-level set to track active usernames
-
     async def connect(self):  # Method called when a WebSocket connection is established
         if self.scope["user"].is_authenticated:  # Check if the user is authenticated
             self.username = self.scope["user"].username  # Store the username from the scope
             
-            # Update user profile
-            user_profile = await self.get_or_create_profile()  # Get or create the user’s profile
-            user_profile.is_online = True  # Set the user as online
-            user_profile.last_seen = timezone.now()  # Update last seen timestamp
-            await self.save_profile(user_profile)  # Save the updated profile
+            presence_writer.record(self.scope["user"].id, True)  # Buffered; flushed with other profiles in one UPDATE
             
-            LiveUserConsumer.active_users.add(self.username)  # Add username to active users set
+            became_live = await get_presence_store().live_connect(self.username, self.channel_name)  # Count this socket
+            live_heartbeat.add(self.channel_name, self.username)  # Keep it from expiring while it stays open
             await self.channel_layer.group_add("live_users", self.channel_name)  # Add channel to live_users group
             await self.accept()  # Accept the WebSocket connection
-            await self.broadcast_user_list()  # Broadcast updated user list to the group
+            await self.send(text_data=json.dumps({  # Full list to this socket only
+                "users": await get_presence_store().live_users()  # List of active usernames
+            }))
+            if became_live:  # Only the user's first socket anywhere in the cluster changes the list
+                live_users_broadcaster.join(self.username)  # Everyone else hears about it on the next tick
         else:  # If user is not authenticated
             await self.close()  # Close the connection
 
     async def disconnect(self, close_code):  # Method called when WebSocket disconnects
         if hasattr(self, 'username'):  # Check if username was set (i.e., connection was established)
-            LiveUserConsumer.active_users.discard(self.username)  # Remove username from active users
-            
-            user_profile = await self.get_or_create_profile()  # Get or create the user’s profile
-            user_profile.is_online = False  # Set the user as offline
-            user_profile.last_seen = timezone.now()  # Update last seen timestamp
-            await self.save_profile(user_profile)  # Save the updated profile
-            
+            live_heartbeat.discard(self.channel_name)  # Stop refreshing this socket
+            went_offline = await get_presence_store().live_disconnect(self.username, self.channel_name)  # Uncount it
             await self.channel_layer.group_discard("live_users", self.channel_name)  # Remove channel from group
-            await self.broadcast_user_list()  # Broadcast updated user list
-
-    async def broadcast_user_list(self):  # Method to send the active user list to the group
-        await self.channel_layer.group_send(  # Send message to the live_users group
-            "live_users",  # Group name
-            {
-                "type": "update_users",  # Message type for handler
-                "users": list(LiveUserConsumer.active_users),  # List of active usernames
-            },
-        )
-
-    async def update_users(self, event):  # Handler for update_users messages
-        await self.send(text_data=json.dumps({  # Send the user list to the client
-            "users": event["users"]  # Extract users from the event
+            if went_offline:  # Other tabs keep the user live
+                presence_writer.record(self.scope["user"].id, False)  # Buffered; flushed with other profiles in one UPDATE
+                live_users_broadcaster.leave(self.username)  # Coalesced into the next tick's delta
+
+    async def users_delta(self, event):  # Handler for the broadcaster's once-per-tick deltas
+        await self.send(text_data=json.dumps({  # Send net changes since the last tick to the client
+            "joined": event["joined"],  # Usernames that came online
+            "left": event["left"],  # Usernames that went offline
         }))
 
-    async def get_or_create_profile(self):  # Method to get or create a UserProfile
-        @database_sync_to_async  # Decorator to run sync DB code asynchronously
-        def get_profile():  # Inner sync function
-            profile, created = UserProfile.objects.get_or_create(  # Get or create profile
-                user=self.scope["user"]  # Based on the current user
-            )
-            return profile  # Return the profile object
-        return await get_profile()  # Await and return the result
-
-    async def save_profile(self, profile):  # Method to save a UserProfile
-        @database_sync_to_async  # Decorator to run sync DB code asynchronously
-        def save():  # Inner sync function
-            profile.save()  # Save the profile to the database
-        await save()  # Await the save operation
-
 class DashboardConsumer(AsyncWebsocketConsumer):  # Define consumer for dashboard updates
     async def connect(self):  # Method called when a WebSocket connection is established
+        if not self.scope["user"].is_authenticated:  # Anonymous sockets get no roster and never enter it
+            await self.close()  # Close the connection
+            return
+
         try:  # Try to get the room code from the URL
             self.room_code = self.scope["url_route"]["kwargs"]["room_code"]  # Extract room code from URL route
         except KeyError:  # If room_code is missing
@@ -83,21 +64,37 @@ class DashboardConsumer(AsyncWebsocketConsumer):  # Define consumer for dashboar
             await self.close()  # Close the connection
             return
 
+        owner_ws_base = get_router().ws_base(self.room_code)  # Empty when this node owns the room
+        if owner_ws_base:  # Room belongs to another node
+            await self.accept()  # Accept so the client can read the redirect
+            await self.send(text_data=json.dumps({  # Tell the client where the room lives
+                "type": "redirect",  # Message type for the client
+                "url": f"{owner_ws_base}{self.scope['path']}",  # Same path on the owning node
+            }))
+            await self.close(code=4001)  # Close; the client reconnects to the owner
+            return
+
         self.room_group_name = f"dashboard_{self.room_code}"  # Set group name based on room code
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)  # Add channel to group
         await self.accept()  # Accept the WebSocket connection
 
-        await self.send_users_update()  # Send initial user update
+        await self.send_roster_snapshot()  # Full roster to this socket only; the room gets deltas from then on
+        await announce_present(self.room_code, self.scope["user"])  # Back in the roster if they had dropped out
+        room_heartbeat.add(self.channel_name, self.room_code, self.scope["user"].id)  # Keep them there while this socket is open
 
     async def disconnect(self, close_code):  # Method called when WebSocket disconnects
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)  # Remove channel from group
+        if hasattr(self, 'room_group_name'):  # Only if connect() got far enough to join the group
+            room_heartbeat.discard(self.channel_name)  # Member drops out after PRESENCE_TTL unless another dashboard is open
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)  # Remove channel from group
 
     async def receive(self, text_data):  # Method to handle incoming messages
         text_data_json = json.loads(text_data)  # Parse JSON message
         message_type = text_data_json.get("type")  # Get message type
 
-        if message_type == "user_notification":  # If message is a notification
+        if message_type == "roster_sync":  # Client saw a version gap and wants a fresh snapshot
+            await self.send_roster_snapshot()  # Resend the full roster to this socket
+        elif message_type == "user_notification":  # If message is a notification
             await self.channel_layer.group_send(  # Send notification to the group
                 self.room_group_name,
                 {
@@ -112,46 +109,26 @@ class DashboardConsumer(AsyncWebsocketConsumer):  # Define consumer for dashboar
         user_id = event["user_id"]  # Extract user ID
         await self.send(text_data=json.dumps({"type": "notification", "message": message, "user_id": user_id}))  # Send to client
 
-    async def send_users_update(self):  # Method to send updated user list
-        room = await sync_to_async(Room.objects.get)(code=self.room_code)  # Get the Room object
-        room_users = await sync_to_async(list)(  # Get list of online users in the room
-            UserProfile.objects.filter(room_code=self.room_code, is_online=True).select_related('user')
-        )
-
-        admin_user = await sync_to_async(lambda: room.admin)()  # Get the room’s admin user
-
-        users_data = [  # Create list of user data dictionaries
-            {
-                'id': profile.user.id,  # User ID
-                'username': profile.google_name or profile.user.username,  # Username or Google name
-                'is_google_user': bool(profile.google_name),  # Flag for Google user
-                'join_time': profile.user.date_joined.strftime('%Y-%m-%d %H:%M:%S'),  # Join timestamp
-                'is_current_user': profile.user == self.scope["user"],  # Flag for current user
-                'is_super_user': profile.user == admin_user  # Flag for superuser (admin)
-            }
-            for profile in room_users  # Iterate over room users
-        ]
-
-        print(f"Sending users_data to {self.room_group_name}: {users_data}")  # Log the data being sent
-
-        await self.channel_layer.group_send(  # Send user update to the group
-            self.room_group_name,
-            {
-                'type': 'users_update',  # Message type for handler
-                'users': users_data  # User data list
-            }
-        )
+    async def send_roster_snapshot(self):  # Send the versioned roster to this socket
+        admin_id = await sync_to_async(  # Only the admin id is needed from the Room row
+            Room.objects.filter(code=self.room_code).values_list('admin_id', flat=True).first
+        )()
+        version, cards = await room_roster(self.room_code)  # Read the roster from the presence index
+        await self.send(text_data=json.dumps({  # Snapshot for this client only
+            "type": "roster_snapshot",  # Message type for the client
+            "version": version,  # Deltas at or below this version are already included
+            "admin_id": admin_id,  # Lets the client flag the super user on later deltas
+            "users": roster_view(cards, self.scope["user"].id, admin_id),  # Cards with per-viewer flags
+        }))
 
-    async def users_update(self, event):  # Handler for users_update messages
-        users = event["users"]  # Extract users from event
-        await self.send(text_data=json.dumps({"type": "users_update", "users": users}))  # Send to client
+    async def roster_delta(self, event):  # Handler for join/leave/update deltas published by neo.presence
+        await self.send(text_data=json.dumps(event))  # Forward as-is; the client applies it by version
 
 # neo/consumers.py
 class FileTransferConsumer(AsyncWebsocketConsumer):  # Define consumer for file transfer signaling
-    rate_limits = defaultdict(list)  # Store timestamps of messages per user
-    MAX_MESSAGES_PER_MINUTE = 10  # Maximum messages per minute
     async def connect(self):  # Method called when a WebSocket connection is established
         self.user = self.scope['user']  # Get the user from the scope
+        self.log = make_hot_log(logger)  # Per-socket logging budget for the message handlers
         if not self.user.is_authenticated:  # Check if user is authenticated
             await self.close()  # Close the connection if not
             return
@@ -159,31 +136,34 @@ class FileTransferConsumer(AsyncWebsocketConsumer):  # Define consumer for file
         self.user_id = str(self.user.id)  # Store user ID as string
         self.notification_group = f"user_{self.user_id}_notifications"  # Set group name for notifications
         await self.channel_layer.group_add(self.notification_group, self.channel_name)  # Add channel to group
+        self.ice_batcher = make_candidate_batcher(self.user_id, self.forward)  # Buffers outgoing ICE candidates per target
+        try:  # The registry is an optimization; without it this socket is reached through its group
+            await get_channel_registry().register(self.user_id, self.channel_name)  # Lets single-socket users be addressed directly
+        except Exception as e:  # Registry unavailable
+            self.log.error("registry_register_failed", user=self.user_id, error=e)  # Log and keep the socket
         await self.accept()  # Accept the WebSocket connection
-        logger.info(f"[FileTransferConsumer] User {self.user_id} connected to {self.notification_group}")  # Log connection
+        logger.info("[FileTransferConsumer] User %s connected to %s", self.user_id, self.notification_group)  # Log connection
 
     async def disconnect(self, close_code):  # Method called when WebSocket disconnects
-        await self.channel_layer.group_discard(self.notification_group, self.channel_name)  # Remove channel from group
-        logger.info(f"[FileTransferConsumer] User {self.user_id} disconnected from {self.notification_group}")  # Log disconnection
+        if hasattr(self, 'ice_batcher'):  # Only if connect() got far enough to create it
+            await self.ice_batcher.close()  # Don't drop candidates still inside the batching window
+            try:  # A stale entry only makes senders use the group, so never let it skip group_discard
+                await get_channel_registry().unregister(self.user_id, self.channel_name)  # Senders fall back to the group
+            except Exception as e:  # Registry unavailable
+                self.log.error("registry_unregister_failed", user=self.user_id, error=e)  # Log and carry on
+            await self.channel_layer.group_discard(self.notification_group, self.channel_name)  # Remove channel from group
+        logger.info("[FileTransferConsumer] User %s disconnected from %s", self.user_id, self.notification_group)  # Log disconnection
 
     async def receive(self, text_data):  # Method to handle incoming messages
-
-        # Rate limiting logic
-        current_time = time.time()
-        user_messages = self.rate_limits[self.user_id]
-        user_messages.append(current_time)
-        # Keep only messages from the last 60 seconds
-        self.rate_limits[self.user_id] = [t for t in user_messages if current_time - t < 60]
-        
-        if len(self.rate_limits[self.user_id]) > self.MAX_MESSAGES_PER_MINUTE:
-            logger.warning(f"User {self.user_id} exceeded rate limit")
+        data = json.loads(text_data)  # Parse JSON message
+        action = data.get('action')  # Get action type
+        if not await get_signaling_limits().allow(self.user_id, action):  # Token bucket per user and action
+            self.log.warning("rate_limited", user=self.user_id, action=action)
             await self.send(text_data=json.dumps({
                 "type": "error",
                 "message": "Rate limit exceeded. Please try again later."
             }))
             return
-        data = json.loads(text_data)  # Parse JSON message
-        action = data.get('action')  # Get action type
         sender_id = data.get('sender_id', self.user_id)  # Get sender ID, default to current user
 
         if action == 'file_transfer_request':  # If it’s a file transfer request
@@ -191,72 +171,83 @@ class FileTransferConsumer(AsyncWebsocketConsumer):  # Define consumer for file
             file_name = data.get('file_name')  # Get file name
             file_size = data.get('file_size')  # Get file size
             if not receiver_id or not sender_id:  # Check for required fields
-                logger.error(f"Missing receiver_id or sender_id in file_transfer_request: {data}")  # Log error
+                self.log.error("missing_ids", payload=data, user=self.user_id, action=action)  # Body only at DEBUG
                 return
-            logger.info(f"[FileTransferConsumer] Sending file_transfer_request from {sender_id} to {receiver_id}")  # Log request
-            await self.channel_layer.group_send(  # Send request to receiver’s group
-                f"user_{receiver_id}_notifications",
-                {
-                    'type': 'webrtc_message',  # Message type for handler
-                    'message': {
-                        'action': 'file_transfer_request',  # Action type
-                        'sender_id': sender_id,  # Sender ID
-                        'receiver_id': receiver_id,  # Receiver ID
-                        'file_name': file_name,  # File name
-                        'file_size': file_size  # File size
-                    }
-                }
-            )
+            self.log.info("forward", action=action, sender=sender_id, receiver=receiver_id)  # Log request
+            await self.forward(receiver_id, {  # Send request to the receiver
+                'action': 'file_transfer_request',  # Action type
+                'sender_id': sender_id,  # Sender ID
+                'receiver_id': receiver_id,  # Receiver ID
+                'file_name': file_name,  # File name
+                'file_size': file_size  # File size
+            })
 
         elif action == 'file_transfer_response':  # If it’s a response to a file transfer request
             receiver_id = data.get('receiver_id')  # Get original sender (now receiver of response)
             accepted = data.get('accepted')  # Get acceptance status
             if not sender_id or not receiver_id:  # Check for required fields
-                logger.error(f"Missing sender_id or receiver_id in file_transfer_response: {data}")  # Log error
+                self.log.error("missing_ids", payload=data, user=self.user_id, action=action)  # Body only at DEBUG
                 return
-            logger.info(f"[FileTransferConsumer] Sending file_transfer_response from {sender_id} to {receiver_id}")  # Log response
-            await self.channel_layer.group_send(  # Send response to original sender’s group
-                f"user_{receiver_id}_notifications",
-                {
-                    'type': 'webrtc_message',  # Message type for handler
-                    'message': {
-                        'action': 'file_transfer_response',  # Action type
-                        'sender_id': sender_id,  # Responder’s ID
-                        'receiver_id': receiver_id,  # Original sender’s ID
-                        'accepted': accepted  # Acceptance status
-                    }
-                }
-            )
-
-        elif action in ['webrtc_offer', 'webrtc_ice_candidate']:  # If it’s a WebRTC offer or ICE candidate
-            target_id = data.get('receiver_id') if action == 'webrtc_offer' else data.get('target_id')  # Get target ID
+            self.log.info("forward", action=action, sender=sender_id, receiver=receiver_id)  # Log response
+            await self.forward(receiver_id, {  # Send response to the original sender
+                'action': 'file_transfer_response',  # Action type
+                'sender_id': sender_id,  # Responder’s ID
+                'receiver_id': receiver_id,  # Original sender’s ID
+                'accepted': accepted  # Acceptance status
+            })
+
+        elif action == 'webrtc_offer':  # If it’s a WebRTC offer
+            target_id = data.get('receiver_id')  # Get target ID
             if not target_id:  # Check for required field
-                logger.error(f"No target_id in {action} message: {data}")  # Log error
+                self.log.error("missing_target", payload=data, user=self.user_id, action=action)  # Body only at DEBUG
                 return
-            message = {  # Build message dictionary
+            self.log.info("forward", action=action, sender=sender_id, receiver=target_id)  # SDP itself is never logged here
+            await self.forward(target_id, {  # Offers go out immediately
                 'action': action,  # Action type
                 'sender_id': sender_id,  # Sender ID
-                'receiver_id': target_id if action == 'webrtc_offer' else None,  # Receiver ID for offer
-                'target_id': target_id if action == 'webrtc_ice_candidate' else None,  # Target ID for candidate
-            }
-            if action == 'webrtc_offer':  # If it’s an offer
-                message['offer'] = data.get('offer')  # Add offer data
-                logger.info(f"[FileTransferConsumer] Sent WebRTC offer to {target_id} from {sender_id}")  # Log offer
-            else:  # If it’s an ICE candidate
-                message['candidate'] = data.get('candidate')  # Add candidate data
-                logger.info(f"[FileTransferConsumer] Sent WebRTC ICE candidate to {target_id} from {sender_id}")  # Log candidate
-            await self.channel_layer.group_send(  # Send message to target’s group
-                f"user_{target_id}_notifications",
-                {
-                    'type': 'webrtc_message',  # Message type for handler
-                    'message': message  # Message content
-                }
-            )
+                'receiver_id': target_id,  # Receiver ID for offer
+                'target_id': None,  # Only set on candidates
+                'offer': data.get('offer'),  # Offer data
+            })
+
+        elif action in ['webrtc_ice_candidate', 'webrtc_ice_candidates']:  # One candidate or an array of them
+            target_id = data.get('target_id')  # Get target ID
+            candidates = data.get('candidates') if action == 'webrtc_ice_candidates' else [data.get('candidate')]  # Normalize to a list
+            if not target_id or not isinstance(candidates, list) or len(candidates) > MAX_CANDIDATES_PER_MESSAGE:  # Validate
+                self.log.error("invalid_candidates", user=self.user_id, action=action)  # Log error
+                return
+            self.ice_batcher.add(target_id, candidates)  # Coalesced with other candidates for this target
+
+    async def forward(self, target_id, message):  # Deliver a signaling message to the target user's sockets
+        event = {'type': 'webrtc_message', 'message': message}  # Handled by webrtc_message on the receiving consumer
+        if getattr(settings, 'SIGNALING_DIRECT_SEND', True):  # Address a single socket directly when possible
+            try:  # The registry is an optimization; any failure falls back to the group
+                channels = await get_channel_registry().channels(str(target_id))  # Target's open signaling sockets
+            except Exception as e:  # Registry unavailable
+                self.log.error("registry_lookup_failed", target=target_id, error=e)  # Log and fall back
+                channels = []  # Use the group
+            if len(channels) == 1:  # Exactly one socket: skip the group lookup and fan-out
+                try:  # Direct channel send
+                    await self.channel_layer.send(channels[0], event)
+                    return
+                except Exception as e:  # E.g. the channel's queue is full; the group still reaches every socket
+                    self.log.error("direct_send_failed", target=target_id, error=e)  # Log and fall back
+                    get_channel_registry().invalidate(str(target_id))  # Don't reuse this lookup
+        await self.channel_layer.group_send(f"user_{target_id}_notifications", event)  # No socket or several tabs
 
     async def webrtc_message(self, event):  # Handler for webrtc_message events
         message = event['message']  # Extract message from event
-        logger.info(f"[FileTransferConsumer] Forwarding message to user {self.user_id}: {message}")  # Log forwarding
+        self.log.debug("deliver", payload=message, user=self.user_id, action=message.get('action'))  # Body only at DEBUG
         await self.send(text_data=json.dumps({  # Send message to client
             'type': 'webrtc_message',  # Message type
             'message': message  # Message content
-        }))
\ No newline at end of file
+        }))
+
+    async def scan_result(self, event):  # Handler for verdicts pushed by the background scan pool
+        await self.send(text_data=json.dumps({  # The client matches it to its upload by job_id
+            'type': 'scan_result',  # Message type
+            'job_id': event['job_id'],  # Id returned by the scan_file view
+            'file_name': event['file_name'],  # Scanned file name
+            'safe': event['safe'],  # Verdict
+            'message': event['message'],  # Verdict details
+        }))
@@ -0,0 +1,210 @@
+"""
+Wire formats for values stored in the Kademlia DHT.
+
+Every value written by BinaryCodec starts with a format byte so the layout
+can evolve without breaking nodes that still hold older records:
+
+    0x01  room record, struct-packed against ROOM_SCHEMA
+    0x02  any other JSON-compatible value, compact UTF-8 JSON
+    0x80  legacy pickle written by older nodes (read-only, restricted)
+"""
+import io
+import json
+import pickle
+import struct
+
+FORMAT_ROOM = 0x01
+FORMAT_JSON = 0x02
+PICKLE_PROTO_MARKER = 0x80
+
+# Field order of a room record; the struct format never stores key names.
+ROOM_SCHEMA = ("admin", "members", "created_at", "status")
+# Well-known statuses get a one-byte code, anything else is spelled out.
+ROOM_STATUSES = ("active", "inactive", "closed", "expired")
+STATUS_CUSTOM = 0xFF
+MEMBER_SEPARATOR = "\x00"
+
+_DOUBLE = struct.Struct("<d")
+
+
+class CodecError(ValueError):
+    """Raised when a DHT value can't be decoded."""
+
+
+def _write_varint(buf, value):
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data, pos):
+    shift = result = 0
+    while True:
+        if pos >= len(data):
+            raise CodecError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_str(buf, value):
+    raw = value.encode("utf-8")
+    _write_varint(buf, len(raw))
+    buf += raw
+
+
+def _read_str(data, pos):
+    length, pos = _read_varint(data, pos)
+    end = pos + length
+    if end > len(data):
+        raise CodecError("Truncated string")
+    return data[pos:end].decode("utf-8"), end
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    """Unpickler that only rebuilds plain containers and scalars.
+
+    Legacy room records are dicts of strings and lists, which never need
+    find_class(); refusing every global keeps peers from smuggling in code.
+    """
+
+    def find_class(self, module, name):
+        raise CodecError(f"Refusing to unpickle global {module}.{name}")
+
+
+class DHTCodec:
+    """Interface for DHT value codecs."""
+
+    def encode(self, value) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes):
+        raise NotImplementedError
+
+
+class PickleCodec(DHTCodec):
+    """The original format; kept for clusters still running older nodes."""
+
+    def encode(self, value) -> bytes:
+        return pickle.dumps(value)
+
+    def decode(self, data: bytes):
+        return decode_legacy_pickle(data)
+
+
+class BinaryCodec(DHTCodec):
+    """Compact, versioned codec; reads legacy pickle values too."""
+
+    def encode(self, value) -> bytes:
+        if self._is_room(value):
+            encoded = self._encode_room(value)
+            if encoded is not None:
+                return encoded
+        return bytes([FORMAT_JSON]) + json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes):
+        if not data:
+            raise CodecError("Empty value")
+        fmt = data[0]
+        if fmt == FORMAT_ROOM:
+            return self._decode_room(data)
+        if fmt == FORMAT_JSON:
+            try:
+                return json.loads(data[1:].decode("utf-8"))
+            except ValueError as e:
+                raise CodecError(f"Bad JSON value: {e}") from e
+        if fmt == PICKLE_PROTO_MARKER:
+            return decode_legacy_pickle(data)
+        raise CodecError(f"Unknown value format 0x{fmt:02x}")
+
+    @staticmethod
+    def _is_room(value):
+        return (
+            isinstance(value, dict)
+            and tuple(sorted(value)) == tuple(sorted(ROOM_SCHEMA))
+            and isinstance(value["admin"], str)
+            and isinstance(value["created_at"], str)
+            and isinstance(value["status"], str)
+            and isinstance(value["members"], list)
+        )
+
+    @staticmethod
+    def _encode_room(room):
+        """Pack a room record, or return None if it doesn't fit the schema."""
+        admin = room["admin"]
+        members = room["members"]
+        # Members go out as one NUL-separated blob (usernames can't contain
+        # NUL), so encoding and decoding is a single join/split instead of a
+        # Python loop per member. The admin is almost always a member and is
+        # stored as an empty entry.
+        if "" in members:
+            return None
+        try:
+            blob = MEMBER_SEPARATOR.join(["" if m == admin else m for m in members])
+        except TypeError:
+            return None
+        if blob.count(MEMBER_SEPARATOR) != max(len(members) - 1, 0):
+            return None
+        buf = bytearray([FORMAT_ROOM])
+        status = room["status"]
+        if status in ROOM_STATUSES:
+            buf.append(ROOM_STATUSES.index(status))
+        else:
+            buf.append(STATUS_CUSTOM)
+            _write_str(buf, status)
+        # created_at is a float rendered as str; pack it as a double when that
+        # round-trips exactly, otherwise keep the text.
+        created_at = room["created_at"]
+        try:
+            as_float = float(created_at)
+            exact = repr(as_float) == created_at
+        except ValueError:
+            exact = False
+        if exact:
+            buf.append(1)
+            buf += _DOUBLE.pack(as_float)
+        else:
+            buf.append(0)
+            _write_str(buf, created_at)
+        _write_str(buf, admin)
+        _write_varint(buf, len(members))
+        _write_str(buf, blob)
+        return bytes(buf)
+
+    @staticmethod
+    def _decode_room(data):
+        try:
+            pos = 1
+            code = data[pos]
+            pos += 1
+            if code == STATUS_CUSTOM:
+                status, pos = _read_str(data, pos)
+            else:
+                status = ROOM_STATUSES[code]
+            if data[pos] == 1:
+                created_at = repr(_DOUBLE.unpack_from(data, pos + 1)[0])
+                pos += 1 + _DOUBLE.size
+            else:
+                created_at, pos = _read_str(data, pos + 1)
+            admin, pos = _read_str(data, pos)
+            count, pos = _read_varint(data, pos)
+            blob, pos = _read_str(data, pos)
+            members = [m or admin for m in blob.split(MEMBER_SEPARATOR)] if count else []
+            if len(members) != count:
+                raise CodecError("Member count mismatch")
+        except (IndexError, struct.error, UnicodeDecodeError) as e:
+            raise CodecError(f"Bad room record: {e}") from e
+        return {"admin": admin, "members": members, "created_at": created_at, "status": status}
+
+
+def decode_legacy_pickle(data: bytes):
+    try:
+        return _RestrictedUnpickler(io.BytesIO(data)).load()
+    except CodecError:
+        raise
+    except Exception as e:
+        raise CodecError(f"Bad legacy pickle value: {e}") from e
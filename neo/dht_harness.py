@@ -0,0 +1,176 @@
+"""
+In-process multi-node DHT cluster for tests and benchmarks.
+
+Spins up N DHTManagers on loopback ports in the current event loop, so
+lookups go over real UDP through the real Kademlia code paths.
+"""
+import asyncio
+import logging
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from kademlia.crawling import SpiderCrawl
+
+from neo.dht_module import DHTManager
+
+logger = logging.getLogger(__name__)
+
+
+class LookupStats:
+    """Counts Kademlia crawl rounds (hops) and RPCs while active."""
+
+    def __init__(self):
+        self.rounds = 0
+        self.rpcs = 0
+
+    def reset(self):
+        self.rounds = self.rpcs = 0
+
+
+@contextmanager
+def count_lookups(stats):
+    """Patch SpiderCrawl._find so each crawl round and its RPCs are counted."""
+    original = SpiderCrawl._find
+
+    async def _find(crawl, rpcmethod):
+        stats.rounds += 1
+        stats.rpcs += min(crawl.alpha if crawl.nearest.get_ids() != crawl.last_ids_crawled else len(crawl.nearest),
+                          len(crawl.nearest.get_uncontacted()))
+        return await original(crawl, rpcmethod)
+
+    SpiderCrawl._find = _find
+    try:
+        yield stats
+    finally:
+        SpiderCrawl._find = original
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class DHTCluster:
+    """N loopback DHT nodes; node 0 is everyone's bootstrap peer."""
+
+    def __init__(self, size, base_port=9500, ksize=20, alpha=3, seed=None):
+        self.size = size
+        self.base_port = base_port
+        self.ksize = ksize
+        self.alpha = alpha
+        self.random = random.Random(seed)
+        self.nodes = []
+        self.rooms = []
+
+    async def start(self, ready_timeout=30):
+        for i in range(self.size):
+            # Join through a random earlier node so the routing tables aren't a star.
+            peer = self.base_port + (self.random.randrange(i) if i else 0)
+            node = DHTManager(
+                port=self.base_port + i,
+                bootstrap_nodes=[("127.0.0.1", peer)],
+                ksize=self.ksize,
+                alpha=self.alpha,
+            )
+            await node.initialize()
+            self.nodes.append(node)
+            await node.wait_ready(ready_timeout)
+        # A second bootstrap pass lets early nodes learn about later ones.
+        await asyncio.gather(*(node._server.bootstrap([("127.0.0.1", self.base_port)]) for node in self.nodes))
+        return self
+
+    async def stop(self):
+        for node in self.nodes:
+            await node.shutdown()
+        self.nodes = []
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def random_node(self):
+        return self.random.choice(self.nodes)
+
+    async def load_rooms(self, count, members=5, joins=0, concurrency=32):
+        """Store `count` rooms via store_room() from random nodes, then append `joins` joins to each."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def store(i):
+            code = f"B{i:07d}"
+            admin = f"admin{i}"
+            async with semaphore:
+                ok = await self.random_node().store_room(
+                    code, admin, members=[admin] + [f"user{i}_{m}" for m in range(members - 1)]
+                )
+                # Joins through different nodes give get_room() several writers to fold.
+                for j in range(joins if ok else 0):
+                    await self.random_node().add_member(code, f"joiner{i}_{j}")
+            if ok:
+                self.rooms.append(code)
+
+        await asyncio.gather(*(store(i) for i in range(count)))
+        return len(self.rooms)
+
+    async def measure_room_lookup(self, samples):
+        """
+        Time single room-record lookups from random nodes; returns a summary dict.
+
+        Only the room:{code} key is fetched, so the numbers isolate one
+        Kademlia lookup. measure_room_get() times what a request pays.
+        """
+
+        async def lookup(node, code):
+            key = f"room:{code}"
+            raw = await node._get_raw(key)
+            return node.decode(key, raw) if raw else None
+
+        return await self._measure(samples, lookup)
+
+    async def measure_room_get(self, samples):
+        """
+        Time full get_room() calls from random nodes with the room cache bypassed.
+
+        Includes the membership log reads (snapshot, heads, ops) on top of
+        the record lookup, so hops are summed over every key read.
+        """
+
+        async def lookup(node, code):
+            node.invalidate_room(code)
+            return await node.get_room(code)
+
+        return await self._measure(samples, lookup)
+
+    async def _measure(self, samples, lookup):
+        stats = LookupStats()
+        latencies, rounds, rpcs = [], [], []
+        misses = 0
+        with count_lookups(stats):
+            for _ in range(samples):
+                node = self.random_node()
+                code = self.random.choice(self.rooms)
+                stats.reset()
+                start = time.perf_counter()
+                room = await lookup(node, code)
+                latencies.append((time.perf_counter() - start) * 1000)
+                rounds.append(stats.rounds)
+                rpcs.append(stats.rpcs)
+                if room is None:
+                    misses += 1
+        return {
+            "nodes": self.size,
+            "rooms": len(self.rooms),
+            "samples": samples,
+            "misses": misses,
+            "p50_ms": percentile(latencies, 50),
+            "p99_ms": percentile(latencies, 99),
+            "mean_rounds": statistics.mean(rounds) if rounds else 0.0,
+            "p99_rounds": percentile(rounds, 99),
+            "mean_rpcs": statistics.mean(rpcs) if rpcs else 0.0,
+        }
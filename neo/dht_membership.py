@@ -0,0 +1,282 @@
+"""
+Room membership as an append-only log of small operations in the DHT.
+
+Every writer (one per DHT node) appends its own operations under keys
+only it writes, so joins and leaves cost a few dozen bytes and concurrent
+writers on different nodes never overwrite each other:
+
+    room:{code}:snapshot           folded state plus a watermark for every writer
+    room:{code}:head:{writer}      last sequence number that writer used
+    room:{code}:op:{writer}:{seq}  {"o": "+", "u": user} or {"o": "-", "u": user, "t": [tags]}
+
+store_room writes the first snapshot next to the room record, so a reader
+never has to look up a key that may not exist: the snapshot names every
+writer, each named writer has a head, and each head covers its ops. A
+missing key is the slowest Kademlia lookup, because the crawl only stops
+once it has run out of closer nodes.
+
+A writer id is derived from its node id, so it survives restarts and the
+number of writers is bounded by the number of nodes; a restarted writer
+resumes after its last head instead of starting over at 1.
+
+A new writer registers by adding itself to the snapshot with watermark 0.
+The DHT has no compare-and-set, so it writes the snapshot and reads it
+back until it is listed. A compactor re-reads the snapshot just before
+storing its fold and keeps writers registered in the meantime. A writer
+that still finds itself missing when it next reads the room registers
+again before its next op.
+
+Folding the ops gives an add-wins observed-remove set: each add is tagged
+"{writer}:{seq}", and a remove cancels the tags it read, so a concurrent
+join on another node survives. A remove always reads the current state
+first. The members listed in the room record itself are the initial adds
+(tag "init:{user}").
+
+Compaction folds the ops into the snapshot. Racing compactors may overwrite
+each other's snapshot, which is harmless: each one is a consistent fold,
+and the ops it covers remain readable in the DHT.
+"""
+import asyncio
+import logging
+
+from neo.retry import Deadline
+
+logger = logging.getLogger(__name__)
+
+INIT_WRITER = "init"
+
+
+class MembershipState:
+    """Folded OR-set state: user -> live add tags, pending tombstones, watermarks."""
+
+    def __init__(self, adds=None, tombstones=None, watermarks=None):
+        self.adds = adds or {}
+        self.tombstones = tombstones or set()
+        self.watermarks = watermarks or {}
+
+    @classmethod
+    def initial(cls, members):
+        return cls(adds={user: {f"{INIT_WRITER}:{user}"} for user in members})
+
+    @classmethod
+    def from_snapshot(cls, data):
+        return cls(
+            adds={user: set(tags) for user, tags in data.get("a", {}).items()},
+            tombstones=set(data.get("t", [])),
+            watermarks=dict(data.get("w", {})),
+        )
+
+    def to_snapshot(self):
+        return {
+            "a": {user: sorted(tags) for user, tags in self.adds.items()},
+            "t": sorted(self.tombstones),
+            "w": self.watermarks,
+        }
+
+    @property
+    def members(self):
+        return list(self.adds)
+
+    def apply(self, writer, seq, op):
+        """Fold one op; ops of a writer must be applied in sequence order."""
+        if seq <= self.watermarks.get(writer, 0):
+            return
+        user = op.get("u")
+        if op.get("o") == "+":
+            tag = f"{writer}:{seq}"
+            if tag in self.tombstones:
+                # The remove was folded first; the pair cancels out.
+                self.tombstones.discard(tag)
+            else:
+                self.adds.setdefault(user, set()).add(tag)
+        elif op.get("o") == "-":
+            for tag in op.get("t", []):
+                live = self.adds.get(user)
+                if live and tag in live:
+                    live.discard(tag)
+                    if not live:
+                        del self.adds[user]
+                elif not tag.startswith(f"{INIT_WRITER}:"):
+                    # Remove overtook its add; remember it until the add is folded.
+                    tag_writer, _, tag_seq = tag.rpartition(":")
+                    if tag_seq.isdigit() and int(tag_seq) > self.watermarks.get(tag_writer, 0):
+                        self.tombstones.add(tag)
+        self.watermarks[writer] = seq
+
+
+class MembershipLog:
+    """Reads and writes the per-room membership log through a DHTManager."""
+
+    def __init__(self, manager, writer_id, compact_every=32):
+        self.manager = manager
+        self.writer_id = writer_id
+        self.compact_every = compact_every
+        self._seq = {}
+        self._since_compaction = {}
+        self._registered = set()
+        self._locks = {}
+        self._background = set()
+
+    @staticmethod
+    def _key(code, *parts):
+        return ":".join(("room", code) + parts)
+
+    @staticmethod
+    def initial_snapshot(members):
+        """Snapshot stored with a new room record."""
+        return MembershipState.initial(members).to_snapshot()
+
+    def _lock(self, code):
+        lock = self._locks.get(code)
+        if lock is None:
+            lock = self._locks[code] = asyncio.Lock()
+        return lock
+
+    async def add(self, code, username, deadline=None):
+        """Record that `username` joined room `code`."""
+        return await self._append(code, {"o": "+", "u": username}, deadline)
+
+    async def remove(self, code, username, deadline=None):
+        """Record that `username` left room `code`, cancelling every add currently in the log."""
+        deadline = deadline or Deadline()
+        # Adds may have come in through other nodes; cancel what the log holds now.
+        state = await self._read_state(code, deadline)
+        if state is None:
+            return False
+        observed = state.adds.get(username)
+        if not observed:
+            return True
+        return await self._append(code, {"o": "-", "u": username, "t": sorted(observed)}, deadline)
+
+    async def members(self, code, deadline=None, record=None):
+        """Current members, or None if the log couldn't be read in time."""
+        state = await self._read_state(code, deadline or Deadline(), record)
+        return None if state is None else state.members
+
+    async def compact(self, code, deadline=None):
+        """Fold every readable op into the room snapshot."""
+        deadline = deadline or Deadline()
+        state = await self._read_state(code, deadline)
+        if state is None:
+            return False
+        snapshot_key = self._key(code, "snapshot")
+        try:
+            # Keep writers that registered while we were folding; they have no ops folded yet.
+            latest = await self._read_snapshot(code, deadline)
+            for writer, seq in (latest or {}).get("w", {}).items():
+                if seq == 0:
+                    state.watermarks.setdefault(writer, 0)
+            await self.manager._set_raw(snapshot_key, state.to_snapshot(), deadline)
+        except Exception as e:
+            logger.warning(f"Compaction of room {code} membership failed: {e!r}")
+            return False
+        self._since_compaction[code] = 0
+        logger.info(f"Compacted membership of room {code} ({len(state.adds)} members)")
+        return True
+
+    async def _append(self, code, op, deadline):
+        deadline = deadline or Deadline()
+        async with self._lock(code):
+            try:
+                await self._register(code, deadline)
+                seq = self._seq.get(code, 0) + 1
+                # The op and the head pointer are both a few bytes; write them together.
+                result = await self.manager.set_many(
+                    {self._key(code, "op", self.writer_id, str(seq)): op, self._key(code, "head", self.writer_id): seq},
+                    deadline=deadline,
+                )
+            except Exception as e:
+                logger.warning(f"Membership update for room {code} failed: {e!r}")
+                return False
+            if not result.complete:
+                logger.warning(f"Membership update for room {code} failed: {result}")
+                return False
+            self._seq[code] = seq
+            self._since_compaction[code] = self._since_compaction.get(code, 0) + 1
+        if self._since_compaction[code] >= self.compact_every:
+            self._since_compaction[code] = 0
+            task = asyncio.get_running_loop().create_task(self.compact(code))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        return True
+
+    async def _read_snapshot(self, code, deadline):
+        key = self._key(code, "snapshot")
+        raw = await self.manager._get_raw(key, deadline)
+        snapshot = self.manager.decode(key, raw) if raw else None
+        return snapshot if isinstance(snapshot, dict) else None
+
+    async def _register(self, code, deadline):
+        """List this writer in the room snapshot and resume its sequence (once per process and room)."""
+        if code in self._registered:
+            return
+        snapshot_key, record_key = self._key(code, "snapshot"), self._key(code)
+        head_key = self._key(code, "head", self.writer_id)
+        found = await self.manager.get_many([snapshot_key, head_key, record_key], deadline=deadline)
+        if not found.complete:
+            raise RuntimeError(f"Could not read the membership of room {code}: {found}")
+        # A restarted node keeps its writer id; continue after its last op instead of overwriting it.
+        self._seq[code] = max(self._seq.get(code, 0), int(found.values.get(head_key) or 0))
+        snapshot = found.values.get(snapshot_key)
+        if not isinstance(snapshot, dict):
+            # Rooms stored before snapshots were written with the record
+            snapshot = self.initial_snapshot((found.values.get(record_key) or {}).get("members", []))
+        if head_key not in found.values:
+            # Readers look up the head of every listed writer; make sure it exists first.
+            await self.manager._set_raw(head_key, self._seq[code], deadline)
+        for _ in range(3):
+            if self.writer_id in snapshot.get("w", {}):
+                self._registered.add(code)
+                return
+            snapshot = dict(snapshot, w={**snapshot.get("w", {}), self.writer_id: 0})
+            await self.manager._set_raw(snapshot_key, snapshot, deadline)
+            # Read back: another writer or a compactor may have stored its own snapshot in between.
+            snapshot = await self._read_snapshot(code, deadline) or {}
+        if self.writer_id in snapshot.get("w", {}):
+            self._registered.add(code)
+            return
+        raise RuntimeError(f"Could not register as a writer of room {code}")
+
+    async def _read_state(self, code, deadline, record=None):
+        """Fold snapshot + ops into the current state; None if the DHT can't be read."""
+        snapshot_key, record_key = self._key(code, "snapshot"), self._key(code)
+        keys = [snapshot_key] if record is not None else [snapshot_key, record_key]
+        base = await self.manager.get_many(keys, deadline=deadline)
+        if not base.complete:
+            return None
+        snapshot = base.values.get(snapshot_key)
+        if record is None:
+            record = base.values.get(record_key)
+        if isinstance(snapshot, dict):
+            state = MembershipState.from_snapshot(snapshot)
+        else:
+            state = MembershipState.initial((record or {}).get("members", []))
+        writers = set(state.watermarks) - {INIT_WRITER}
+        if self._seq.get(code) and self.writer_id not in writers:
+            # Our registration was lost to a concurrent writer; redo it on the next append.
+            self._registered.discard(code)
+            writers.add(self.writer_id)
+        if not writers:
+            return state
+
+        head_keys = {self._key(code, "head", w): w for w in writers}
+        heads = await self.manager.get_many(head_keys, deadline=deadline)
+        if not heads.complete:
+            return None
+        op_keys = {}
+        for key, head in heads.values.items():
+            writer = head_keys[key]
+            for seq in range(state.watermarks.get(writer, 0) + 1, int(head) + 1):
+                op_keys[self._key(code, "op", writer, str(seq))] = (writer, seq)
+        ops = await self.manager.get_many(op_keys, deadline=deadline)
+        if not ops.complete:
+            return None
+        for key, (writer, seq) in sorted(op_keys.items(), key=lambda item: item[1]):
+            if seq != state.watermarks.get(writer, 0) + 1:
+                continue
+            op = ops.values.get(key)
+            if not isinstance(op, dict):
+                # Not replicated yet; later ops of this writer wait for it.
+                continue
+            state.apply(writer, seq, op)
+        return state
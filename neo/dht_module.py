@@ -1,58 +1,258 @@
 import asyncio  # Import asyncio for asynchronous operations
+import hashlib  # Import hashlib to derive the stable membership writer id
 import json  # Import json module (unused in this code, likely a leftover)
 from kademlia.network import Server  # Import Server class from Kademlia library for DHT functionality
 from typing import Optional, Dict, Any  # Import typing hints for better code clarity
-import pickle  # Import pickle for serializing/deserializing Python objects
 import logging  # Import logging module for debugging and logging
+import threading  # Import threading for the cache lock (signals touch the cache from sync threads)
+import time  # Import time for monotonic cache expiry
+from collections import OrderedDict  # Import OrderedDict to keep the cache in LRU order
 from contextlib import asynccontextmanager  # Import asynccontextmanager for async context handling
+from django.conf import settings  # Import settings for cache sizing and codec selection
+from django.utils.module_loading import import_string  # Import helper to load the configured codec class
+from neo.dht_codec import CodecError  # Import the codec error raised for undecodable values
+from neo.retry import CircuitBreaker, CircuitOpenError, Deadline, RetryPolicy  # Import retry/deadline/breaker helpers
+from neo.dht_membership import MembershipLog  # Import the append-only room membership log
+from neo.affinity import get_router  # Import the room-to-node router so DHT ownership matches it
 
 logging.basicConfig(level=logging.INFO)  # Configure logging to show INFO level messages and above
 logger = logging.getLogger(__name__)  # Create a logger instance for this module
 
+def _copy_room(value: Dict) -> Dict:  # Copy a room record deep enough that callers can't change the cached one
+    return {key: list(item) if isinstance(item, list) else item for key, item in value.items()}  # Rooms only nest lists
+
+class RoomCache:  # In-process TTL/LRU cache for room metadata read from the DHT
+    """Bounded room-metadata cache with per-entry TTL and LRU eviction.
+
+    Values go in and come out as copies, so a caller editing a room it got
+    from get_room() never changes what the next request sees.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):  # Configure capacity and lifetime
+        self.maxsize = maxsize  # Maximum number of rooms kept in memory
+        self.ttl = ttl  # Seconds an entry stays valid
+        self._entries = OrderedDict()  # code -> (expires_at, value), oldest first
+        self._lock = threading.Lock()  # Protect entries from concurrent threads
+        self.hits = 0  # Lookups served from memory
+        self.misses = 0  # Lookups that fell through to the DHT
+        self.evictions = 0  # Entries dropped because the cache was full
+        self.expirations = 0  # Entries dropped because their TTL ran out
+        self.invalidations = 0  # Entries dropped explicitly (status change, delete)
+
+    def get(self, code: str) -> Optional[Dict]:  # Look up a room
+        with self._lock:  # Serialize access
+            entry = self._entries.get(code)  # Find the entry
+            if entry is None:  # Not cached
+                self.misses += 1  # Count the miss
+                return None  # Caller goes to the DHT
+            expires_at, value = entry  # Unpack the entry
+            if expires_at <= time.monotonic():  # Entry is stale
+                del self._entries[code]  # Drop it
+                self.expirations += 1  # Count the expiry
+                self.misses += 1  # And the miss
+                return None  # Caller goes to the DHT
+            self._entries.move_to_end(code)  # Mark as most recently used
+            self.hits += 1  # Count the hit
+            return _copy_room(value)  # Serve from memory
+
+    def put(self, code: str, value: Dict):  # Insert or refresh a room
+        with self._lock:  # Serialize access
+            self._entries[code] = (time.monotonic() + self.ttl, _copy_room(value))  # Store with a fresh expiry
+            self._entries.move_to_end(code)  # Mark as most recently used
+            while len(self._entries) > self.maxsize:  # Over capacity
+                self._entries.popitem(last=False)  # Evict the least recently used room
+                self.evictions += 1  # Count the eviction
+
+    def update(self, code: str, change) -> bool:  # Apply change(room) to a cached room, keeping its expiry
+        with self._lock:  # Serialize access
+            entry = self._entries.get(code)  # Find the entry
+            if entry is None:  # Not cached; the next read goes to the DHT anyway
+                return False  # Nothing to do
+            expires_at, value = entry  # Unpack the entry
+            value = _copy_room(value)  # Readers holding the old value never see a half-update
+            change(value)  # Caller edits the copy
+            self._entries[code] = (expires_at, value)  # Swap it in
+            return True  # Entry updated
+
+    def invalidate(self, code: str) -> bool:  # Drop a single room
+        with self._lock:  # Serialize access
+            if self._entries.pop(code, None) is None:  # Nothing cached
+                return False  # Nothing to do
+            self.invalidations += 1  # Count the invalidation
+            return True  # Entry removed
+
+    def clear(self):  # Drop everything
+        with self._lock:  # Serialize access
+            self._entries.clear()  # Empty the cache
+
+    def stats(self) -> Dict[str, Any]:  # Counters for sizing the cache
+        with self._lock:  # Consistent snapshot
+            lookups = self.hits + self.misses  # Total lookups
+            return {  # Build the stats dictionary
+                "size": len(self._entries),  # Rooms currently cached
+                "maxsize": self.maxsize,  # Configured capacity
+                "ttl": self.ttl,  # Configured lifetime
+                "hits": self.hits,  # Served from memory
+                "misses": self.misses,  # Went to the DHT
+                "hit_rate": self.hits / lookups if lookups else 0.0,  # Fraction served from memory
+                "evictions": self.evictions,  # Dropped for capacity
+                "expirations": self.expirations,  # Dropped for age
+                "invalidations": self.invalidations,  # Dropped explicitly
+            }
+
+class BatchResult:  # Outcome of a get_many/set_many call
+    """Per-key outcome of a batched DHT operation.
+
+    values maps keys to their value (or True for stores), missing lists keys
+    with no usable value, failed maps keys to the exception that stopped them.
+    """
+
+    def __init__(self):  # Start empty
+        self.values = {}  # key -> value
+        self.missing = []  # Keys with no value in the DHT
+        self.failed = {}  # key -> exception
+
+    @property  # Read-only attribute
+    def complete(self) -> bool:  # True when no key failed
+        return not self.failed  # Missing keys are an answer, failures are not
+
+    def __repr__(self):  # Short summary for logs
+        return f"<BatchResult values={len(self.values)} missing={len(self.missing)} failed={len(self.failed)}>"  # Counts only
+
 class DHTManager:  # Define a class to manage the DHT
     _instance = None  # Class-level variable to store the singleton instance
+    _instance_lock = None  # asyncio.Lock guarding singleton creation, created on first use
+    _instance_lock_loop = None  # Loop that owns _instance_lock
     _server = None  # Class-level variable to store the Kademlia server instance
     _initialized = False  # Flag to track whether the DHT has been initialized
+    _loop = None  # Event loop the Kademlia transport is bound to
+    _bootstrap_task = None  # Background task joining the network after listen()
+    _listen_port = 8468  # UDP port this node listens on
     _bootstrap_nodes = [  # List of bootstrap nodes for joining the DHT network
         ("127.0.0.1", 8468),  # Primary bootstrap node (localhost, port 8468)
         ("127.0.0.1", 9000)  # Backup bootstrap node (localhost, port 9000)
     ]   
+
+    def __init__(self, codec=None, port=None, bootstrap_nodes=None, ksize=None, alpha=None, node_id=None):  # Set up per-node state
+        self.node_id = node_id  # Fixed Kademlia id (bytes) or None for a random one
+        self._listen_port = port or getattr(settings, "DHT_PORT", self._listen_port)  # UDP port to listen on
+        self._bootstrap_nodes = [tuple(node) for node in (  # Peers to join through
+            bootstrap_nodes or getattr(settings, "DHT_BOOTSTRAP_NODES", self._bootstrap_nodes)
+        )]
+        self.ksize = ksize or getattr(settings, "DHT_KSIZE", 20)  # Kademlia bucket size / replication factor
+        self.alpha = alpha or getattr(settings, "DHT_ALPHA", 3)  # Kademlia lookup parallelism
+        self.retry_policy = RetryPolicy(  # Backoff/jitter/timeouts for every DHT call
+            attempts=getattr(settings, "DHT_RETRY_ATTEMPTS", 3),  # Tries per call
+            base_delay=getattr(settings, "DHT_RETRY_BASE_DELAY", 0.05),  # First backoff ceiling in seconds
+            max_delay=getattr(settings, "DHT_RETRY_MAX_DELAY", 1.0),  # Largest backoff ceiling in seconds
+            attempt_timeout=getattr(settings, "DHT_ATTEMPT_TIMEOUT", 2.0),  # Upper bound for one Kademlia call
+        )
+        self.breaker = CircuitBreaker(  # Skip the DHT entirely while it is known to be down
+            "dht",  # Name used in logs
+            failure_threshold=getattr(settings, "DHT_BREAKER_FAILURES", 5),  # Consecutive failures before opening
+            reset_timeout=getattr(settings, "DHT_BREAKER_RESET", 10.0),  # Seconds before a trial call
+        )
+        self.batch_concurrency = getattr(settings, "DHT_BATCH_CONCURRENCY", 16)  # Max lookups in flight per batch
+        self.membership = MembershipLog(  # Join/leave deltas instead of whole-record rewrites
+            self,  # Reads and writes go through this manager
+            writer_id=hashlib.sha1(  # Same id after a restart, so writers are bounded by nodes, not processes
+                self.node_id or f"{getattr(settings, 'NEO_NODE_NAME', 'local')}:{self._listen_port}".encode("utf-8")  # Node id, or name + port when unclustered
+            ).hexdigest()[:12],  # Short enough to repeat in every op key
+            compact_every=getattr(settings, "DHT_MEMBERSHIP_COMPACT_EVERY", 32),  # Ops per writer between snapshots
+        )
+        self.membership_timeout = getattr(settings, "DHT_MEMBERSHIP_TIMEOUT", 1.0)  # Budget for folding a room's membership log, on top of the record lookup
+        self.codec = codec or import_string(  # Serializer for values on the wire
+            getattr(settings, "DHT_CODEC", "neo.dht_codec.BinaryCodec")  # Pluggable via settings
+        )()
+        self.room_cache = RoomCache(  # Write-through cache in front of get_room/store_room
+            maxsize=getattr(settings, "DHT_ROOM_CACHE_SIZE", 1024),  # Capacity from settings
+            ttl=getattr(settings, "DHT_ROOM_CACHE_TTL", 300),  # Lifetime from settings
+        )
+
     @classmethod  # Decorator to define a class method
     async def get_instance(cls):  # Method to get or create the singleton instance
-        if not cls._instance:  # Check if the instance doesn’t exist
-            cls._instance = cls()  # Create a new instance of DHTManager
-            await cls._instance.initialize()  # Initialize the instance asynchronously
-        return cls._instance  # Return the singleton instance
-    
-    
-    
+        """Return the running DHTManager, starting it lazily on the current event loop."""
+        loop = asyncio.get_running_loop()  # The loop the caller (ASGI server) is running on
+        instance = cls._instance  # Read the current singleton once
+        if instance and instance._initialized and instance._loop is loop:  # Fast path: already running here
+            return instance  # Return the singleton instance
+        if cls._instance_lock is None or cls._instance_lock_loop is not loop:  # No lock for this loop yet
+            cls._instance_lock = asyncio.Lock()  # Create a lock so concurrent first calls start only one node
+            cls._instance_lock_loop = loop  # Remember which loop the lock belongs to
+        async with cls._instance_lock:  # Serialize startup
+            instance = cls._instance  # Re-read after acquiring the lock
+            if instance and instance._loop is not loop and instance._loop is not None and instance._loop.is_closed():  # Bound to a dead loop
+                await instance.shutdown()  # Release the old transport before starting again
+                instance = cls._instance = None  # Forget the stale instance
+            if not instance:  # Check if the instance doesn’t exist
+                router = get_router()  # Cluster layout
+                instance = cls._instance = cls(  # Create a new instance of DHTManager
+                    node_id=router.node_id() if router.clustered else None  # Own the same rooms in the DHT as in the router
+                )
+            await instance.initialize()  # Initialize the instance asynchronously (no-op when already running)
+        return instance  # Return the singleton instance
+
     async def initialize(self):  # Method to initialize the DHT server
+        """Start listening and join the network in the background.
+
+        Only binding the UDP socket happens inline; bootstrapping can take
+        several seconds when no peers answer, so it runs as a task on the
+        same loop and callers are never blocked by it.
+        """
         if not self._initialized:  # Check if not already initialized
             try:  # Begin try block to handle initialization errors
-                self._server = Server()  # Create a new Kademlia Server instance
-                await self._server.listen(8468)  # Start listening on port 8468
-
-                # Bootstrap with known nodes
-                # Try multiple bootstrap nodes
-                bootstrap_successful = False  # Flag to track bootstrap success
-                for node in self._bootstrap_nodes:  # Iterate over bootstrap nodes
-                    try:  # Try to bootstrap with the current node
-                        await self._server.bootstrap([node])  # Connect to the DHT network via the node
-                        bootstrap_successful = True  # Mark bootstrap as successful
-                        logger.info(f"Successfully bootstrapped with node {node}")  # Log success
-                        break  # Exit loop on success
-                    except Exception as e:  # Catch any bootstrap errors
-                        logger.warning(f"Failed to bootstrap with {node}: {e}")  # Log warning
-                
-                if not bootstrap_successful:  # If no bootstrap nodes worked
-                    # If no bootstrap nodes available, this becomes the first node
-                    logger.info("No bootstrap nodes available. Starting as initial node.")  # Log as first node
-                
+                self._server = Server(ksize=self.ksize, alpha=self.alpha, node_id=self.node_id)  # Create a new Kademlia Server instance
+                await self._server.listen(self._listen_port)  # Start listening on the configured port
+                self._loop = asyncio.get_running_loop()  # Remember the loop the transport lives on
+                self._bootstrap_task = self._loop.create_task(self._bootstrap())  # Join the network without blocking the caller
                 self._initialized = True  # Mark initialization as complete
-                logger.info("DHT Manager initialized successfully")  # Log successful initialization
+                logger.info("DHT Manager listening on port %s", self._listen_port)  # Log successful initialization
             except Exception as e:  # Catch any initialization errors
                 logger.error(f"Failed to initialize DHT Manager: {e}")  # Log error
                 raise  # Re-raise the exception
+
+    async def _bootstrap(self):  # Background task that joins the DHT network
+        """Try each bootstrap node in turn; run standalone if none answer."""
+        # Bootstrap with known nodes
+        # Try multiple bootstrap nodes
+        bootstrap_successful = False  # Flag to track bootstrap success
+        for node in self._bootstrap_nodes:  # Iterate over bootstrap nodes
+            try:  # Try to bootstrap with the current node
+                await self._server.bootstrap([node])  # Connect to the DHT network via the node
+                bootstrap_successful = True  # Mark bootstrap as successful
+                logger.info(f"Successfully bootstrapped with node {node}")  # Log success
+                break  # Exit loop on success
+            except Exception as e:  # Catch any bootstrap errors
+                logger.warning(f"Failed to bootstrap with {node}: {e}")  # Log warning
+
+        if not bootstrap_successful:  # If no bootstrap nodes worked
+            # If no bootstrap nodes available, this becomes the first node
+            logger.info("No bootstrap nodes available. Starting as initial node.")  # Log as first node
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:  # Wait for bootstrap to finish
+        """Wait until the background bootstrap finished; return False on timeout."""
+        if not self._bootstrap_task:  # Nothing started yet
+            return False  # Not ready
+        try:  # Bound the wait
+            await asyncio.wait_for(asyncio.shield(self._bootstrap_task), timeout)  # Don't cancel the task on timeout
+            return True  # Bootstrap done
+        except asyncio.TimeoutError:  # Still bootstrapping
+            return False  # Not ready yet
+
+    async def shutdown(self):  # Stop the Kademlia node
+        """Cancel bootstrapping and close the UDP transport."""
+        if self._bootstrap_task and not self._bootstrap_task.done():  # Bootstrap still running
+            self._bootstrap_task.cancel()  # Stop it
+        if self._server:  # A server was started
+            try:  # Closing can fail if its loop is already gone
+                self._server.stop()  # Close the transport and cancel refresh timers
+            except RuntimeError as e:  # Loop closed underneath us
+                logger.warning(f"Error while stopping DHT server: {e}")  # Log and carry on
+        self._server = None  # Drop the server reference
+        self._bootstrap_task = None  # Drop the task reference
+        self._initialized = False  # Allow a later restart
+        self._loop = None  # No longer bound to a loop
+        logger.info("DHT Manager stopped")  # Log shutdown
     
     @asynccontextmanager  # Decorator to define an async context manager
     async def connection(self):  # Context manager for DHT operations
@@ -65,40 +265,112 @@ class DHTManager:  # Define a class to manage the DHT
             logger.error(f"DHT connection error: {e}")  # Log error
             raise  # Re-raise the exception
     
-    async def set(self, key: str, value: Any) -> bool:  # Method to store a key-value pair in the DHT
-        """Store a key-value pair in the DHT with retry logic."""
-        max_retries = 3  # Set maximum number of retry attempts
-        for attempt in range(max_retries):  # Loop through retry attempts
-            try:  # Begin try block for storing value
-                serialized_value = pickle.dumps(value)  # Serialize the value using pickle
-                await self._server.set(key.encode(), serialized_value)  # Store the serialized value in DHT
-                logger.info(f"Successfully stored key {key} in DHT")  # Log success
-                return True  # Return success
-            except Exception as e:  # Catch any storage errors
-                if attempt == max_retries - 1:  # If this is the last attempt
-                    logger.error(f"Final attempt to store value in DHT failed: {e}")  # Log final failure
-                    return False  # Return failure
-                logger.warning(f"Attempt {attempt + 1} to store value failed: {e}")  # Log retry failure
-                await asyncio.sleep(1)  # Wait 1 second before retrying
-    
-    async def get(self, key: str) -> Optional[Any]:  # Method to retrieve a value from the DHT
-        """Retrieve a value from the DHT with retry logic."""
-        max_retries = 3  # Set maximum number of retry attempts
-        for attempt in range(max_retries):  # Loop through retry attempts
-            try:  # Begin try block for retrieval
-                result = await self._server.get(key.encode())  # Get the value from DHT
-                if result:  # If a value is found
-                    return pickle.loads(result)  # Deserialize and return the value
-                logger.info(f"No value found for key {key}")  # Log if no value exists
-                return None  # Return None if no value
-            except Exception as e:  # Catch any retrieval errors
-                if attempt == max_retries - 1:  # If this is the last attempt
-                    logger.error(f"Final attempt to retrieve value failed: {e}")  # Log final failure
-                    return None  # Return None on failure
-                logger.warning(f"Attempt {attempt + 1} to retrieve value failed: {e}")  # Log retry failure
-                await asyncio.sleep(1)  # Wait 1 second before retrying
-    
-    async def store_room(self, code: str, admin_username: str, members: Optional[list] = None) -> bool:  # Method to store room info
+    async def set(self, key: str, value: Any, timeout: Optional[float] = None) -> bool:  # Method to store a key-value pair in the DHT
+        """Store a key-value pair in the DHT with retry logic, within `timeout` seconds."""
+        try:  # Retries happen inside _set_raw
+            await self._set_raw(key, value, Deadline.after(timeout))  # Store the value
+            return True  # Return success
+        except CircuitOpenError as e:  # DHT known to be down
+            logger.warning(f"Skipping DHT store of {key}: {e}")  # Fail fast
+            return False  # Return failure
+        except Exception as e:  # All attempts failed or the deadline passed
+            logger.error(f"Final attempt to store value in DHT failed: {e!r}")  # Log final failure
+            return False  # Return failure
+
+    async def get(self, key: str, timeout: Optional[float] = None) -> Optional[Any]:  # Method to retrieve a value from the DHT
+        """Retrieve a value from the DHT with retry logic, within `timeout` seconds."""
+        try:  # Retries happen inside _get_raw
+            result = await self._get_raw(key, Deadline.after(timeout))  # Get the value from DHT
+        except CircuitOpenError as e:  # DHT known to be down
+            logger.warning(f"Skipping DHT lookup of {key}: {e}")  # Fail fast
+            return None  # Return None on failure
+        except Exception as e:  # All attempts failed or the deadline passed
+            logger.error(f"Final attempt to retrieve value failed: {e!r}")  # Log final failure
+            return None  # Return None on failure
+        if result:  # If a value is found
+            return self.decode(key, result)  # Deserialize and return the value
+        logger.info(f"No value found for key {key}")  # Log if no value exists
+        return None  # Return None if no value
+
+    async def _set_raw(self, key: str, value: Any, deadline: Optional[Deadline] = None):  # Store one value, raising after the last retry
+        serialized_value = self.codec.encode(value)  # Serialize the value with the configured codec
+        await self.retry_policy.run(  # Backoff with jitter, bounded by the caller's deadline
+            lambda: self._server.set(key.encode(), serialized_value),  # Store the serialized value in DHT
+            deadline=deadline,  # Shared time budget
+            breaker=self.breaker,  # Skip the DHT while it is down
+            description=f"DHT store of {key}",  # Used in log/exception messages
+        )
+        logger.info(f"Successfully stored key {key} in DHT")  # Log success
+
+    async def _get_raw(self, key: str, deadline: Optional[Deadline] = None) -> Optional[bytes]:  # Fetch one raw value, raising after the last retry
+        return await self.retry_policy.run(  # Backoff with jitter, bounded by the caller's deadline
+            lambda: self._server.get(key.encode()),  # Get the raw value from DHT
+            deadline=deadline,  # Shared time budget
+            breaker=self.breaker,  # Skip the DHT while it is down
+            description=f"DHT lookup of {key}",  # Used in log/exception messages
+        )
+
+    async def get_many(self, keys, concurrency: Optional[int] = None, timeout: Optional[float] = None, deadline: Optional[Deadline] = None) -> "BatchResult":  # Fetch several keys at once
+        """Look up several keys concurrently, at most `concurrency` in flight.
+
+        Lookups run side by side instead of one after another, so N keys cost
+        roughly one lookup's latency. Each key ends up in exactly one of
+        result.values, result.missing or result.failed; all lookups share
+        one `timeout` budget.
+        """
+        deadline = deadline or Deadline.after(timeout)  # One budget for the whole batch (or the caller's)
+        result = BatchResult()  # Collects per-key outcomes
+        keys = list(dict.fromkeys(keys))  # Drop duplicates, keep order
+        if not keys:  # Nothing to do
+            return result  # Empty result
+        semaphore = asyncio.Semaphore(concurrency or self.batch_concurrency)  # Bound concurrent Kademlia lookups
+
+        async def fetch(key):  # Fetch a single key under the semaphore
+            async with semaphore:  # Wait for a free slot
+                try:  # Record instead of raising so one bad key can't sink the batch
+                    raw = await self._get_raw(key, deadline)  # Raw bytes or None
+                except Exception as e:  # Lookup failed after retries
+                    result.failed[key] = e  # Report the failure
+                    return  # Done with this key
+            value = self.decode(key, raw) if raw else None  # Decode outside the semaphore
+            if value is None:  # Not found or undecodable
+                result.missing.append(key)  # Report as missing
+            else:  # Found
+                result.values[key] = value  # Report the value
+
+        async with self.connection():  # Use the connection context manager
+            await asyncio.gather(*(fetch(key) for key in keys))  # Run the lookups concurrently
+        return result  # Partial results are fine; callers check result.complete
+
+    async def set_many(self, items: Dict[str, Any], concurrency: Optional[int] = None, timeout: Optional[float] = None, deadline: Optional[Deadline] = None) -> "BatchResult":  # Store several keys at once
+        """Store several key/value pairs concurrently; stored keys map to True in result.values."""
+        deadline = deadline or Deadline.after(timeout)  # One budget for the whole batch (or the caller's)
+        result = BatchResult()  # Collects per-key outcomes
+        if not items:  # Nothing to do
+            return result  # Empty result
+        semaphore = asyncio.Semaphore(concurrency or self.batch_concurrency)  # Bound concurrent Kademlia stores
+
+        async def store(key, value):  # Store a single key under the semaphore
+            async with semaphore:  # Wait for a free slot
+                try:  # Record instead of raising so one bad key can't sink the batch
+                    await self._set_raw(key, value, deadline)  # Store the value
+                    result.values[key] = True  # Report success
+                except Exception as e:  # Store failed after retries
+                    result.failed[key] = e  # Report the failure
+
+        async with self.connection():  # Use the connection context manager
+            await asyncio.gather(*(store(key, value) for key, value in items.items()))  # Run the stores concurrently
+        return result  # Partial results are fine; callers check result.complete
+
+    def decode(self, key: str, raw: Any) -> Optional[Any]:  # Decode a raw DHT value
+        """Decode a value read from the DHT; undecodable values read as missing."""
+        try:  # Values come from untrusted peers
+            return self.codec.decode(raw)  # Deserialize with the configured codec
+        except CodecError as e:  # Corrupt, foreign or unsafe value
+            logger.warning(f"Discarding undecodable value for key {key}: {e}")  # Log and drop it
+            return None  # Retrying won't help, so treat it as absent
+
+    async def store_room(self, code: str, admin_username: str, members: Optional[list] = None, timeout: Optional[float] = None) -> bool:  # Method to store room info
         """Store room information in DHT with additional metadata."""
         key = f"room:{code}"  # Create a unique key for the room
         value = {  # Define the room data structure
@@ -108,21 +380,120 @@ class DHTManager:  # Define a class to manage the DHT
             "status": "active"  # Room status
         }
         
+        snapshot_key = f"room:{code}:snapshot"  # Membership log snapshot; readers start from it
         async with self.connection():  # Use the connection context manager
-            success = await self.set(key, value)  # Store the room data
+            result = await self.set_many(  # Record and first snapshot in one concurrent batch
+                {key: value, snapshot_key: self.membership.initial_snapshot(value["members"])},  # Readers never look up a missing snapshot
+                timeout=timeout,  # Caller's budget
+            )
+            success = key in result.values  # The room exists once its record is stored
+            if snapshot_key in result.failed:  # Readers fall back to the record's member list
+                logger.warning(f"Room {code} stored without a membership snapshot: {result.failed[snapshot_key]!r}")  # Log it
             if success:  # If storage succeeds
+                self.room_cache.put(code, value)  # Write through so the next read is served from memory
                 logger.info(f"Room {code} created successfully")  # Log success
             return success  # Return success status
     
-    async def get_room(self, code: str) -> Optional[Dict]:  # Method to retrieve room info
-        """Retrieve room information from DHT with validation."""
+    async def get_room(self, code: str, timeout: Optional[float] = None) -> Optional[Dict]:  # Method to retrieve room info
+        """Retrieve room information from DHT with validation.
+
+        The record's member list is the room's initial membership; the current
+        one is folded from the membership log, which has its own budget
+        (DHT_MEMBERSHIP_TIMEOUT). A record whose log couldn't be read is
+        returned with its initial members but not cached.
+        """
+        cached = self.room_cache.get(code)  # Hot rooms are served from memory
+        if cached is not None:  # Cache hit
+            return cached  # Skip the Kademlia lookup entirely
         key = f"room:{code}"  # Create the key for the room
         async with self.connection():  # Use the connection context manager
-            data = await self.get(key)  # Retrieve the room data
+            data = await self.get(key, timeout=timeout)  # Retrieve the room data
             if data and isinstance(data, dict) and data.get("status") == "active":  # Validate the data
+                if await self._apply_membership(code, data, Deadline.after(self.membership_timeout)):  # Bring members up to date
+                    self.room_cache.put(code, data)  # Remember it for the next request
                 return data  # Return the room data if valid
             return None  # Return None if invalid or not found
 
+    async def _apply_membership(self, code: str, data: Dict, deadline: Deadline) -> bool:  # Overlay the membership log on a room record
+        members = await self.membership.members(code, deadline=deadline, record=data)  # Fold snapshot + deltas
+        if members is not None:  # Log readable in time
+            data["members"] = members  # Current membership
+            return True  # Safe to cache
+        logger.warning(f"Serving initial member list for room {code}: membership log unavailable")  # Older view, not worth caching
+        return False  # Caller must not cache the fallback
+
+    async def add_member(self, code: str, username: str, timeout: Optional[float] = None) -> bool:  # Record a join
+        """Append a join to the room's membership log (a few bytes on the wire)."""
+        success = await self.membership.add(code, username, deadline=Deadline.after(timeout))  # Append the delta
+        if success:  # Write through
+
+            def add(room):  # Applied to the cached copy
+                if username not in room["members"]:  # Already listed after a rejoin
+                    room["members"].append(username)  # Add the member
+
+            self.room_cache.update(code, add)  # No-op if the room isn't cached
+        return success  # Return success status
+
+    async def remove_member(self, code: str, username: str, timeout: Optional[float] = None) -> bool:  # Record a leave
+        """Append a leave to the room's membership log (a few bytes on the wire)."""
+        success = await self.membership.remove(code, username, deadline=Deadline.after(timeout))  # Append the delta
+        if success:  # Write through
+
+            def remove(room):  # Applied to the cached copy
+                room["members"] = [m for m in room["members"] if m != username]  # Drop the member
+
+            self.room_cache.update(code, remove)  # No-op if the room isn't cached
+        return success  # Return success status
+
+    async def get_rooms(self, codes, concurrency: Optional[int] = None, timeout: Optional[float] = None) -> "BatchResult":  # Fetch several rooms at once
+        """Hydrate several rooms: cached ones from memory, the rest in one concurrent batch.
+
+        The result is keyed by room code, not DHT key.
+        """
+        result = BatchResult()  # Collects per-room outcomes
+        to_fetch = {}  # DHT key -> room code for cache misses
+        for code in dict.fromkeys(codes):  # Each code once, in order
+            cached = self.room_cache.get(code)  # Try memory first
+            if cached is not None:  # Cache hit
+                result.values[code] = cached  # Served without a lookup
+            else:  # Cache miss
+                to_fetch[f"room:{code}"] = code  # Needs a DHT lookup
+        fetched = await self.get_many(to_fetch, concurrency=concurrency, timeout=timeout)  # One round-trip window for all misses
+        found = {}  # code -> active room record
+        for key, data in fetched.values.items():  # Found in the DHT
+            code = to_fetch[key]  # Map back to the room code
+            if isinstance(data, dict) and data.get("status") == "active":  # Same validation as get_room
+                found[code] = data  # Keep it
+            else:  # Inactive or malformed
+                result.missing.append(code)  # Report as missing
+        deadline = Deadline.after(self.membership_timeout)  # Membership logs get their own shared budget
+        folded = await asyncio.gather(*(self._apply_membership(code, data, deadline) for code, data in found.items()))  # Overlay members concurrently
+        for (code, data), current in zip(found.items(), folded):  # Cache and report
+            if current:  # Fallback lists are served but not cached
+                self.room_cache.put(code, data)  # Remember it for the next request
+            result.values[code] = data  # Report the room
+        result.missing.extend(to_fetch[key] for key in fetched.missing)  # Not in the DHT
+        result.failed.update((to_fetch[key], e) for key, e in fetched.failed.items())  # Lookup errors
+        return result  # Return the combined result
+
+    @classmethod  # Decorator to define a class method
+    def breaker_stats(cls) -> Dict[str, Any]:  # Circuit breaker state for the running node
+        """State and counters of the running node's circuit breaker."""
+        if not cls._instance:  # DHT not started in this process
+            return {}  # Nothing to report
+        return cls._instance.breaker.stats()  # Delegate to the breaker
+
+    def invalidate_room(self, code: str) -> bool:  # Drop a room from the local cache
+        """Forget the cached copy of a room (safe to call from sync code)."""
+        return self.room_cache.invalidate(code)  # Delegate to the cache
+
+    @classmethod  # Decorator to define a class method
+    def cache_stats(cls) -> Dict[str, Any]:  # Room cache counters for the running node
+        """Hit/miss/eviction counters of the running node's room cache."""
+        if not cls._instance:  # DHT not started in this process
+            return {}  # Nothing to report
+        return cls._instance.room_cache.stats()  # Delegate to the cache
+
 # Singleton instance initialization
 async def initialize_dht():  # Function to initialize the DHT singleton
     try:  # Begin try block for initialization
@@ -133,17 +504,8 @@ async def initialize_dht():  # Function to initialize the DHT singleton
         logger.error(f"Failed to initialize DHT server: {e}")  # Log error
         raise  # Re-raise the exception
 
-# Initialization should be done within an async context
-def get_dht_instance():  # Synchronous wrapper to get DHT instance
-    loop = asyncio.get_event_loop()  # Get the current event loop
-    return loop.run_until_complete(initialize_dht())  # Run the async initialization and return result
-
-async def run():
-    node = Server()
-    await node.listen(5678)
-    await node.bootstrap([("123.123.123.123", 5678)])
-    await node.set("my-key", "my awesome value")
-    result = await node.get("my-key")
-    print(result)
-
-asyncio.run(run())
\ No newline at end of file
+async def shutdown_dht():  # Function to stop the DHT singleton
+    instance = DHTManager._instance  # Current singleton, if any
+    if instance:  # Only stop what was started
+        await instance.shutdown()  # Close the node
+        DHTManager._instance = None  # Next get_instance() starts a fresh node
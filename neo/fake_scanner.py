@@ -0,0 +1,141 @@
+"""
+An offline stand-in for the MetaDefender Cloud v4 endpoints NeoShare uses.
+
+FakeMetaDefender serves POST /file, GET /file/{data_id} and
+GET /hash/{sha256} over plain HTTP from a background thread. An upload's
+report stays at 50% progress for `scan_seconds`, then completes. A file is
+reported infected by three engines if its bytes contain the EICAR test
+string, and clean otherwise. Completed files become known to /hash.
+
+Set METADEFENDER_API_URL to its url to run the scan pipeline and
+benchmarks without network access or an API key.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EICAR = b"X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*"
+ENGINES = ("FakeAV", "FakeScan", "FakeGuard")
+CHUNK_SIZE = 1024 * 1024
+
+
+class FakeMetaDefender:
+    def __init__(self, host="127.0.0.1", port=0, scan_seconds=0.5):
+        self.scan_seconds = scan_seconds
+        self._lock = threading.Lock()
+        self._uploads = {}  # data_id -> (sha256, ready_at, infected)
+        self._known = {}  # sha256 -> data_id of a completed upload
+        self.calls = {"upload": 0, "report": 0, "hash": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v4"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-metadefender", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def upload(self, stream, length):
+        """Hash and check the body one chunk at a time, so large uploads use constant memory."""
+        file_hash, infected, tail = hashlib.sha256(), False, b""
+        while length > 0:
+            chunk = stream.read(min(length, CHUNK_SIZE))
+            if not chunk:
+                break
+            length -= len(chunk)
+            file_hash.update(chunk)
+            infected = infected or EICAR in tail + chunk
+            tail = chunk[-len(EICAR):]
+        data_id = uuid.uuid4().hex
+        with self._lock:
+            self.calls["upload"] += 1
+            self._uploads[data_id] = (file_hash.hexdigest(), time.monotonic() + self.scan_seconds, infected)
+        return {"data_id": data_id}
+
+    def report(self, data_id):
+        with self._lock:
+            self.calls["report"] += 1
+            upload = self._uploads.get(data_id)
+            if upload is None:
+                return None
+            file_hash, ready_at, infected = upload
+            done = time.monotonic() >= ready_at
+            if done:
+                self._known[file_hash] = data_id
+        return self._report(data_id, done, infected)
+
+    def lookup(self, file_hash):
+        with self._lock:
+            self.calls["hash"] += 1
+            data_id = self._known.get(file_hash)
+            if data_id is None:
+                return None
+            infected = self._uploads[data_id][2]
+        return self._report(data_id, True, infected)
+
+    def _report(self, data_id, done, infected):
+        details = {
+            engine: {"threat_found": "EICAR-Test-File" if infected else "", "scan_result_i": 1 if infected else 0}
+            for engine in ENGINES
+        }
+        return {
+            "data_id": data_id,
+            "scan_results": {"progress_percentage": 100 if done else 50, "scan_details": details if done else {}},
+        }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/v4/file":
+                    return self._reply(404, {"error": "Not found"})
+                self._reply(200, fake.upload(self.rfile, int(self.headers.get("Content-Length", 0))))
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                if len(parts) == 3 and parts[:2] == ["v4", "file"]:
+                    body = fake.report(parts[2])
+                elif len(parts) == 3 and parts[:2] == ["v4", "hash"]:
+                    body = fake.lookup(parts[2].lower())
+                else:
+                    body = None
+                if body is None:
+                    return self._reply(404, {"error": "Not found"})
+                self._reply(200, body)
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
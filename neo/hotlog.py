@@ -0,0 +1,99 @@
+"""
+Budgeted logging for per-message consumer paths.
+
+Signaling forwards SDP offers of several kilobytes, and logging each one
+with an f-string costs more than routing it. A HotPathLog does the cheap
+checks first: level enabled, sample, then the per-consumer rate cap. Only
+a record that passes all three is built, and its fields are formatted
+lazily by the handler. Payload bodies are attached only when the logger
+is enabled for DEBUG.
+"""
+import logging
+import random
+import time
+
+from django.conf import settings
+
+_totals = {"emitted": 0, "sampled_out": 0, "rate_capped": 0}
+
+
+class _Fields:
+    """key=value rendering, deferred until a handler formats the record."""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join(f"{key}={value}" for key, value in self.fields.items())
+
+
+class HotPathLog:
+    """
+    One per consumer instance.
+
+    Records below WARNING are kept with probability `sample_rate`. Every
+    record then spends a token from a bucket of `max_per_second` tokens
+    refilled at that rate. The number dropped by the cap is reported on the
+    next record that gets through, as suppressed=N.
+    """
+
+    def __init__(self, logger, sample_rate=1.0, max_per_second=20):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self._tokens = float(max_per_second)
+        self._updated = time.monotonic()
+        self._suppressed = 0
+
+    def debug(self, event, payload=None, **fields):
+        self._log(logging.DEBUG, event, payload, fields)
+
+    def info(self, event, payload=None, **fields):
+        self._log(logging.INFO, event, payload, fields)
+
+    def warning(self, event, payload=None, **fields):
+        self._log(logging.WARNING, event, payload, fields)
+
+    def error(self, event, payload=None, **fields):
+        self._log(logging.ERROR, event, payload, fields)
+
+    def _take(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_per_second, self._tokens + (now - self._updated) * self.max_per_second)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _log(self, level, event, payload, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            _totals["sampled_out"] += 1
+            return
+        if not self._take():
+            self._suppressed += 1
+            _totals["rate_capped"] += 1
+            return
+        if self._suppressed:
+            fields["suppressed"] = self._suppressed
+            self._suppressed = 0
+        if payload is not None and self.logger.isEnabledFor(logging.DEBUG):
+            fields["payload"] = payload
+        _totals["emitted"] += 1
+        self.logger.log(level, "%s %s", event, _Fields(fields), extra={"event": event, "fields": fields}, stacklevel=3)
+
+
+def make_hot_log(logger):
+    return HotPathLog(
+        logger,
+        sample_rate=getattr(settings, 'CONSUMER_LOG_SAMPLE_RATE', 1.0),
+        max_per_second=getattr(settings, 'CONSUMER_LOG_MAX_PER_SECOND', 20),
+    )
+
+
+def stats():
+    return dict(_totals)
@@ -0,0 +1,129 @@
+"""
+Shared outbound HTTP clients.
+
+Bare requests.get/post calls open a new TCP+TLS connection every time and
+wait forever by default. HttpClient holds a single requests.Session for
+the process. Its adapter keeps up to OUTBOUND_HTTP_MAX_PER_HOST keep-alive
+connections per host and blocks past that limit instead of opening more.
+Every call gets OUTBOUND_HTTP_TIMEOUT unless it passes its own timeout.
+
+AsyncHttpClient runs the same pooled session on a dedicated thread pool
+of OUTBOUND_HTTP_MAX_WORKERS threads. Coroutines share its connections
+and can never hold more threads than that.
+
+Each call is timed into a latency histogram under its `endpoint` name,
+which defaults to the host. Name endpoints whose paths contain ids, so
+the histograms stay few.
+"""
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency counts for one endpoint."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.errors = 0
+
+    def observe(self, elapsed_ms, failed=False):
+        self.counts[bisect.bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+        self.total_ms += elapsed_ms
+        if failed:
+            self.errors += 1
+
+    def stats(self):
+        calls = sum(self.counts)
+        buckets = {f"le_{bound}": count for bound, count in zip(BUCKETS_MS, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "calls": calls,
+            "errors": self.errors,
+            "mean_ms": self.total_ms / calls if calls else 0.0,
+            "buckets": buckets,
+        }
+
+
+class HttpClient:
+    """Process-wide pooled session with default timeouts and per-endpoint histograms."""
+
+    def __init__(self, timeout=(3.05, 30), max_per_host=10, max_hosts=10):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_per_host, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self._observe(endpoint or urlsplit(url).netloc, (time.perf_counter() - start) * 1000, failed)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _observe(self, endpoint, elapsed_ms, failed):
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = LatencyHistogram()
+            histogram.observe(elapsed_ms, failed)
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: histogram.stats() for endpoint, histogram in sorted(self._histograms.items())}
+
+
+class AsyncHttpClient:
+    """Awaitable front for an HttpClient, on a bounded thread pool of its own."""
+
+    def __init__(self, client, max_workers=16):
+        self.client = client
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="outbound-http")
+        return self._executor
+
+    async def request(self, method, url, **kwargs):
+        call = functools.partial(self.client.request, method, url, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), call)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+
+http_client = HttpClient(
+    timeout=getattr(settings, 'OUTBOUND_HTTP_TIMEOUT', (3.05, 30)),
+    max_per_host=getattr(settings, 'OUTBOUND_HTTP_MAX_PER_HOST', 10),
+    max_hosts=getattr(settings, 'OUTBOUND_HTTP_MAX_HOSTS', 10),
+)
+async_http_client = AsyncHttpClient(http_client, max_workers=getattr(settings, 'OUTBOUND_HTTP_MAX_WORKERS', 16))
@@ -0,0 +1,40 @@
+import logging
+
+from neo.dht_module import initialize_dht, shutdown_dht
+from neo.presence_writer import flush_presence_writes
+from neo.scan_jobs import stop_scan_pool
+
+logger = logging.getLogger(__name__)
+
+
+class LifespanApp:
+    """
+    ASGI lifespan handler.
+
+    Starts long-lived services on the server's event loop when the worker
+    boots and stops them on shutdown. Servers that don't speak the lifespan
+    protocol (e.g. Daphne) never call this; the services then start lazily
+    on first use instead.
+    """
+
+    startup_hooks = [initialize_dht]
+    shutdown_hooks = [stop_scan_pool, flush_presence_writes, shutdown_dht]
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self._run(self.startup_hooks)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._run(self.shutdown_hooks)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _run(self, hooks):
+        for hook in hooks:
+            try:
+                await hook()
+            except Exception as e:
+                # A missing service must not keep the worker from serving HTTP
+                logger.error(f"Lifespan hook {hook.__name__} failed: {e}")
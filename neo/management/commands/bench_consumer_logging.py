@@ -0,0 +1,82 @@
+import asyncio
+import io
+import json
+import logging
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from neo import consumers
+from neo.hotlog import HotPathLog
+
+
+class LegacyFileTransferConsumer(consumers.FileTransferConsumer):
+    """The pre-budget handler, kept here only as the benchmark baseline."""
+
+    async def webrtc_message(self, event):
+        message = event['message']
+        consumers.logger.info(f"[FileTransferConsumer] Forwarding message to user {self.user_id}: {message}")
+        await self.send(text_data=json.dumps({'type': 'webrtc_message', 'message': message}))
+
+
+def make_offer(size, rng):
+    """An SDP-sized offer: `size` bytes of a=... lines."""
+    lines, total = [], 0
+    while total < size:
+        line = "a=" + "".join(rng.choices(string.ascii_letters + string.digits, k=70))
+        lines.append(line)
+        total += len(line) + 2
+    return {'action': 'webrtc_offer', 'sender_id': '1', 'receiver_id': '2', 'target_id': None,
+            'offer': {'type': 'offer', 'sdp': "\r\n".join(lines)}}
+
+
+class Command(BaseCommand):
+    help = "Measure FileTransferConsumer.webrtc_message throughput with legacy and budgeted logging."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=20000, help="Messages delivered per run")
+        parser.add_argument("--sdp-bytes", type=int, default=4000, help="Size of each offer's SDP")
+        parser.add_argument("--levels", default="INFO,DEBUG", help="Comma-separated logger levels to run at")
+        parser.add_argument("--sample-rate", type=float, default=1.0)
+        parser.add_argument("--max-per-second", type=int, default=20)
+
+    def handle(self, *args, **options):
+        event = {'type': 'webrtc_message', 'message': make_offer(options["sdp_bytes"], random.Random(7))}
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+        logger = consumers.logger
+        saved_handlers, saved_level, saved_propagate = logger.handlers[:], logger.level, logger.propagate
+        logger.handlers[:] = [handler]
+        logger.propagate = False
+        try:
+            self.stdout.write(f"{'level':>6} {'path':>9} {'msgs/s':>10} {'log MB':>8}")
+            for level in options["levels"].split(","):
+                logger.setLevel(level)
+                for path in ("legacy", "budgeted"):
+                    stream.seek(0)
+                    stream.truncate()
+                    rate = asyncio.run(self.run_one(path, event, options))
+                    self.stdout.write(f"{level:>6} {path:>9} {rate:>10.0f} {stream.tell() / 1e6:>8.2f}")
+        finally:
+            logger.handlers[:] = saved_handlers
+            logger.setLevel(saved_level)
+            logger.propagate = saved_propagate
+
+    async def run_one(self, path, event, options):
+        consumer = (LegacyFileTransferConsumer if path == "legacy" else consumers.FileTransferConsumer)()
+        consumer.user_id = "2"
+        consumer.log = HotPathLog(
+            consumers.logger, sample_rate=options["sample_rate"], max_per_second=options["max_per_second"]
+        )
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            pass
+
+        consumer.send = send
+        start = time.perf_counter()
+        for _ in range(options["messages"]):
+            await consumer.webrtc_message(event)
+        return options["messages"] / (time.perf_counter() - start)
@@ -0,0 +1,55 @@
+import json
+import random
+import string
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from neo.dht_codec import BinaryCodec, PickleCodec
+
+
+def make_room(members, rng):
+    """A room record shaped like DHTManager.store_room() output."""
+    def username():
+        # Mix of plain signups and Google-derived names (email local part + uid suffix)
+        local = "".join(rng.choices(string.ascii_lowercase + ".", k=rng.randint(5, 14))).strip(".") or "user"
+        return local if rng.random() < 0.5 else f"{local}_{rng.randint(1000, 9999)}"
+
+    admin = username()
+    return {
+        "admin": admin,
+        "members": [admin] + [username() for _ in range(members - 1)],
+        "created_at": str(rng.uniform(1000, 100000)),
+        "status": "active",
+    }
+
+
+class JSONCodec:
+    def encode(self, value):
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class Command(BaseCommand):
+    help = "Compare encode/decode time and wire size of DHT value codecs for room records."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1,10,50,100,500", help="Comma-separated member counts")
+        parser.add_argument("--number", type=int, default=2000, help="Iterations per measurement")
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        codecs = [("pickle", PickleCodec()), ("json", JSONCodec()), ("binary", BinaryCodec())]
+        number = options["number"]
+
+        self.stdout.write(f"{'members':>7}  {'codec':<7} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+        for size in (int(s) for s in options["sizes"].split(",")):
+            room = make_room(size, rng)
+            for name, codec in codecs:
+                encoded = codec.encode(room)
+                assert codec.decode(encoded) == room
+                encode_us = min(timeit.repeat(lambda: codec.encode(room), number=number, repeat=3)) / number * 1e6
+                decode_us = min(timeit.repeat(lambda: codec.decode(encoded), number=number, repeat=3)) / number * 1e6
+                self.stdout.write(f"{size:>7}  {name:<7} {len(encoded):>7} {encode_us:>10.2f} {decode_us:>10.2f}")
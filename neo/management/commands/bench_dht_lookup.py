@@ -0,0 +1,51 @@
+import asyncio
+import logging
+
+from django.core.management.base import BaseCommand
+
+from neo.dht_harness import DHTCluster
+
+
+class Command(BaseCommand):
+    help = (
+        "Spin up N loopback DHT nodes, load M rooms and report latency and hop counts of single "
+        "room-record lookups and of full get_room() calls with the room cache bypassed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nodes", default="4,16,32", help="Comma-separated cluster sizes")
+        parser.add_argument("--rooms", default="100,500", help="Comma-separated room counts")
+        parser.add_argument("--samples", type=int, default=200, help="Lookups per configuration and path")
+        parser.add_argument("--joins", type=int, default=2, help="Membership log joins appended to each room")
+        parser.add_argument("--ksize", type=int, default=20)
+        parser.add_argument("--alpha", type=int, default=3)
+        parser.add_argument("--base-port", type=int, default=9500)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        # Kademlia logs every datagram at DEBUG; that would dominate the timings.
+        for name in ("kademlia", "rpcudp", "neo", "asyncio"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+        self.stdout.write(
+            f"{'nodes':>5} {'rooms':>6} {'path':>8} {'p50 ms':>8} {'p99 ms':>8} {'rounds':>7} {'p99 rnd':>7} {'rpcs':>6} {'miss':>5}"
+        )
+        for nodes in (int(n) for n in options["nodes"].split(",")):
+            for rooms in (int(r) for r in options["rooms"].split(",")):
+                for path, row in asyncio.run(self.run_one(nodes, rooms, options)):
+                    self.stdout.write(
+                        f"{row['nodes']:>5} {row['rooms']:>6} {path:>8} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+                        f"{row['mean_rounds']:>7.2f} {row['p99_rounds']:>7} {row['mean_rpcs']:>6.1f} {row['misses']:>5}"
+                    )
+
+    async def run_one(self, nodes, rooms, options):
+        cluster = DHTCluster(
+            nodes, base_port=options["base_port"], ksize=options["ksize"], alpha=options["alpha"], seed=options["seed"]
+        )
+        async with cluster:
+            await cluster.load_rooms(rooms, joins=options["joins"])
+            # "record" is one room:{code} lookup; "get_room" is what a request pays on a cache miss.
+            return [
+                ("record", await cluster.measure_room_lookup(options["samples"])),
+                ("get_room", await cluster.measure_room_get(options["samples"])),
+            ]
@@ -0,0 +1,93 @@
+import collections
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from neo.prefilter import BloomFilter, Prefilter
+from neo.utils import hash_file
+
+# kind -> (weight, first bytes); the rest of each file is random or text filler
+CORPUS = {
+    "png": (20, b"\x89PNG\r\n\x1a\n"),
+    "jpeg": (20, b"\xff\xd8\xff\xe0"),
+    "text": (15, None),
+    "mp4": (5, b"\x00\x00\x00\x18ftypmp42"),
+    "pdf": (10, b"%PDF-1.7\n"),
+    "zip": (10, b"PK\x03\x04"),
+    "pe_as_pdf": (5, b"MZ\x90\x00" + b"\x00" * 56 + (0x40).to_bytes(4, "little") + b"PE\x00\x00"),
+    "mz_text": (3, b"MZ,Zambia,Lusaka\n"),
+    "elf": (3, b"\x7fELF\x02\x01\x01"),
+    "script": (2, b"#!/bin/sh\n"),
+    "unknown": (5, b"\x00\x01\x02\x03"),
+    "known_bad": (5, b"\x00KNOWNBAD"),
+}
+
+
+class Command(BaseCommand):
+    help = "Run the local scan prefilter over a mixed corpus and report throughput and how many files it blocks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=2000)
+        parser.add_argument("--size", type=int, default=64 * 1024, help="Bytes per file")
+        parser.add_argument("--bad-hashes", type=int, default=100000, help="Entries in the known-bad Bloom filter")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        kinds = list(CORPUS)
+        weights = [CORPUS[kind][0] for kind in kinds]
+        bloom = BloomFilter(options["bad_hashes"] + options["files"])
+        for i in range(options["bad_hashes"]):
+            bloom.add(hashlib.sha256(f"bad{i}".encode()).hexdigest())
+
+        with tempfile.TemporaryDirectory(prefix="bench-prefilter-") as corpus_dir:
+            corpus = []
+            for i in range(options["files"]):
+                kind = rng.choices(kinds, weights)[0]
+                magic = CORPUS[kind][1]
+                if magic is None:
+                    body = " ".join(rng.choice(("lorem", "ipsum", "dolor", "sit", "amet")) for _ in range(options["size"] // 6))
+                    content = body.encode()
+                else:
+                    content = magic + os.urandom(options["size"] - len(magic))
+                path = os.path.join(corpus_dir, f"{i}.bin")
+                with open(path, "wb") as f:
+                    f.write(content)
+                file_hash = hashlib.sha256(content).hexdigest()
+                if kind == "known_bad":
+                    bloom.add(file_hash)
+                corpus.append((kind, path, file_hash))
+
+            prefilter = Prefilter(bad_hashes=bloom)
+            outcomes = collections.defaultdict(collections.Counter)
+            start = time.perf_counter()
+            for kind, path, file_hash in corpus:
+                verdict = prefilter.check(path, file_hash)
+                outcomes[kind]["remote" if verdict is None else "blocked"] += 1
+            check_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for kind, path, _ in corpus:
+                prefilter.check(path, hash_file(path))
+            hashed_seconds = time.perf_counter() - start
+
+        self.stdout.write(f"{'kind':>10} {'files':>6} {'blocked':>8} {'remote':>7}")
+        for kind in kinds:
+            counts = outcomes[kind]
+            self.stdout.write(
+                f"{kind:>10} {sum(counts.values()):>6} {counts['blocked']:>8} {counts['remote']:>7}"
+            )
+        total = len(corpus)
+        remote = sum(counts["remote"] for counts in outcomes.values())
+        # The prefilter only blocks, so "decided locally" is the block rate.
+        self.stdout.write(
+            f"decided locally (blocked): {(total - remote) / total:.1%}; {remote} of {total} files need the remote scan"
+        )
+        self.stdout.write(
+            f"check: {total / check_seconds:,.0f} files/s ({check_seconds / total * 1e6:.1f} us/file); "
+            f"hash + check: {total / hashed_seconds:,.0f} files/s at {options['size'] // 1024} KiB"
+        )
@@ -0,0 +1,62 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from neo.dht_harness import percentile
+from neo.models import Room
+from neo.views import join_room_records
+
+
+def legacy_join(user, room_code):
+    """The pre-member_count join path, kept here only as the benchmark baseline."""
+    room = Room.objects.get(code=room_code)
+    if user not in room.users.all():
+        room.users.add(user)
+    [u.username for u in room.users.all()]
+
+
+class Command(BaseCommand):
+    help = "Time join_room's database work against rooms of growing size, with the legacy path as a baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10,100,1000,5000", help="Comma-separated existing member counts")
+        parser.add_argument("--samples", type=int, default=50, help="Joins timed per room size and path")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write(f"{'members':>8} {'path':>7} {'p50 ms':>8} {'p99 ms':>8} {'queries':>8}")
+            for size in (int(s) for s in options["sizes"].split(",")):
+                for path, join in (("legacy", legacy_join), ("indexed", join_room_records)):
+                    row = self.run_one(size, path, join, options["samples"])
+                    self.stdout.write(
+                        f"{size:>8} {path:>7} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['queries']:>8.1f}"
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run_one(self, size, path, join, samples):
+        prefix = f"{path}{size}_"
+        members = User.objects.bulk_create(User(username=f"{prefix}{i}") for i in range(size))
+        room = Room.objects.create(code=f"{path[0]}{size}"[:10], admin=members[0], member_count=size)
+        Room.users.through.objects.bulk_create(Room.users.through(room_id=room.pk, user_id=u.pk) for u in members)
+
+        joiners = [User.objects.create_user(f"{prefix}j{i}") for i in range(samples)]
+        latencies = []
+        queries = 0
+        for user in joiners:
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                join(user, room.code)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries += len(captured)
+        return {
+            "p50_ms": percentile(latencies, 50),
+            "p99_ms": percentile(latencies, 99),
+            "queries": queries / samples,
+        }
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from neo.dht_harness import DHTCluster, percentile
+from neo.dht_module import DHTManager
+
+
+class Command(BaseCommand):
+    help = "Fire concurrent create_room / join_room requests through the ASGI stack and report throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100, help="Users; each creates one room and joins another")
+        parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated in-flight request limits")
+        parser.add_argument("--dht-nodes", type=int, default=3, help="Loopback DHT peers the view's node joins")
+        parser.add_argument("--base-port", type=int, default=9600)
+
+    def handle(self, *args, **options):
+        for name in ("kademlia", "rpcudp", "neo", "asyncio", "django.request"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(
+                CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+                DHT_PORT=options["base_port"] + options["dht_nodes"],
+                DHT_BOOTSTRAP_NODES=[("127.0.0.1", options["base_port"])],
+            ):
+                self.stdout.write(f"{'phase':>6} {'conc':>5} {'reqs':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+                for concurrency in (int(c) for c in options["concurrency"].split(",")):
+                    for row in asyncio.run(self.run_one(concurrency, options)):
+                        self.stdout.write(
+                            f"{row['phase']:>6} {row['concurrency']:>5} {row['requests']:>5} {row['rps']:>8.1f} "
+                            f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['errors']:>6}"
+                        )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    async def run_one(self, concurrency, options):
+        cluster = DHTCluster(options["dht_nodes"], base_port=options["base_port"])
+        async with cluster:
+            dht = await DHTManager.get_instance()
+            await dht.wait_ready(timeout=10)
+            try:
+                clients = await self.make_clients(options["users"], concurrency)
+                created = await self.measure("create", concurrency, clients, lambda c, i: c.post(reverse("create_room")))
+                codes = [code for code in created["codes"] if code]
+                joined = await self.measure(
+                    "join", concurrency, clients,
+                    lambda c, i: c.post(reverse("join_room"), {"room_code": codes[(i + 1) % len(codes)]}),
+                ) if codes else None
+            finally:
+                await dht.shutdown()
+                DHTManager._instance = None
+        return [created, joined] if joined else [created]
+
+    async def make_clients(self, count, tag):
+        clients = []
+        for i in range(count):
+            user = await sync_to_async(User.objects.create_user)(f"bench{tag}_{i}", password="x")
+            client = AsyncClient()
+            await client.aforce_login(user)
+            clients.append(client)
+        return clients
+
+    async def measure(self, phase, concurrency, clients, request):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        codes = []
+        errors = 0
+
+        async def one(index, client):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await request(client, index)
+                latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                errors += 1
+            codes.append(response.json().get("room_code"))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i, c) for i, c in enumerate(clients)))
+        elapsed = time.perf_counter() - started
+        return {
+            "phase": phase,
+            "concurrency": concurrency,
+            "requests": len(clients),
+            "rps": len(clients) / elapsed,
+            "p50_ms": percentile(latencies, 50),
+            "p99_ms": percentile(latencies, 99),
+            "errors": errors,
+            "codes": codes,
+        }
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.db.backends.signals import connection_created
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from neo import presence
+from neo.consumers import DashboardConsumer
+from neo.models import Room
+
+
+class QueryCounter:
+    """Counts queries on every connection, including ones opened by sync_to_async worker threads."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def _install(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection.execute_wrappers.append(self)
+        connection_created.connect(self._install)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self._install)
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+
+
+class Command(BaseCommand):
+    help = "Fill one room with N dashboard sockets and count roster bytes and DB queries, against the full-list baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=500, help="Members joining the room one after another")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(
+                CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer", "CONFIG": {"capacity": 10000}}},
+                PRESENCE_BACKEND="neo.presence.LocalPresenceStore",
+            ):
+                presence._store = None
+                with QueryCounter() as captured:
+                    result = async_to_sync(self.fill_room)(options["users"], captured)
+                presence._store = None
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        users = options["users"]
+        self.stdout.write(f"{'protocol':>10} {'messages':>9} {'bytes':>12} {'queries':>8} {'seconds':>8}")
+        self.stdout.write(
+            f"{'delta':>10} {result['messages']:>9} {result['bytes']:>12} {result['queries']:>8} {result['seconds']:>8.2f}"
+        )
+        self.stdout.write(
+            f"{'full-list':>10} {result['legacy_messages']:>9} {result['legacy_bytes']:>12} {3 * users:>8} {'-':>8}"
+        )
+        self.stdout.write(
+            "full-list is computed: every connect re-sent the whole list to every member and ran 3 queries."
+        )
+
+    async def fill_room(self, count, captured):
+        users = await sync_to_async(self.make_users)(count)
+        room = await sync_to_async(Room.objects.create)(code="BENCH1", admin=users[0], member_count=count)
+        cards = [
+            {"id": u.id, "username": u.username, "is_google_user": False, "join_time": u.date_joined.strftime("%Y-%m-%d %H:%M:%S")}
+            for u in users
+        ]
+
+        sockets = []
+        started = time.perf_counter()
+        queries_before = captured.count
+        for user, card in zip(users, cards):
+            await presence.announce_join(room.code, card)
+            communicator = WebsocketCommunicator(DashboardConsumer.as_asgi(), f"/ws/dashboard/{room.code}/")
+            communicator.scope["user"] = user
+            communicator.scope["url_route"] = {"kwargs": {"room_code": room.code}}
+            connected, _ = await communicator.connect()
+            assert connected
+            sockets.append(communicator)
+        queries = captured.count - queries_before
+
+        # Socket i gets its snapshot plus one delta for every later join.
+        expected = sum(1 + (count - 1 - i) for i in range(count))
+        while sum(s.output_queue.qsize() for s in sockets) < expected:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        messages = sent = 0
+        for communicator in sockets:
+            while not communicator.output_queue.empty():
+                message = communicator.output_queue.get_nowait()
+                messages += 1
+                sent += len(message.get("text", "").encode())
+            await communicator.disconnect()
+
+        legacy_messages = legacy_bytes = 0
+        for k in range(1, count + 1):
+            payload = json.dumps({"type": "users_update", "users": presence.roster_view(cards[:k], cards[k - 1]["id"], users[0].id)})
+            legacy_messages += k
+            legacy_bytes += k * len(payload.encode())
+
+        return {
+            "messages": messages,
+            "bytes": sent,
+            "seconds": elapsed,
+            "queries": queries,
+            "legacy_messages": legacy_messages,
+            "legacy_bytes": legacy_bytes,
+        }
+
+    def make_users(self, count):
+        return [User.objects.create_user(f"roster{i}") for i in range(count)]
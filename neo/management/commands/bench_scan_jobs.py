@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from neo import scan_cache
+from neo.dht_harness import percentile
+from neo.fake_scanner import FakeMetaDefender
+from neo.scan_jobs import ScanPool
+from neo.utils import scan_file_metadefender, spool_upload, verdict_from_result
+
+
+def legacy_scan(api_url, content, file_name, poll_interval):
+    """The pre-pipeline scan: upload, then poll with time.sleep, all on the request thread."""
+    headers = {"apikey": "bench", "Content-Type": "application/octet-stream", "filename": file_name}
+    data_id = requests.post(f"{api_url}/file", headers=headers, data=content).json()["data_id"]
+    for _ in range(5):
+        result = requests.get(f"{api_url}/file/{data_id}", headers=headers).json()
+        if result["scan_results"]["progress_percentage"] == 100:
+            break
+        time.sleep(poll_interval)
+    return verdict_from_result(result)
+
+
+class TimedScanPool(ScanPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.done_at = {}
+
+    async def _run(self, job):
+        await super()._run(job)
+        self.done_at[job.id] = time.perf_counter()
+
+
+class Command(BaseCommand):
+    help = "Compare request-thread hold time and time-to-verdict of blocking scans and the background scan pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=20, help="Concurrent scan requests")
+        parser.add_argument("--size", type=int, default=256 * 1024, help="Bytes per file")
+        parser.add_argument("--scan-seconds", type=float, default=0.5, help="Fake scanner time per upload")
+        parser.add_argument("--poll-interval", type=float, default=0.2)
+        parser.add_argument("--workers", type=int, default=4)
+
+    def handle(self, *args, **options):
+        with FakeMetaDefender(scan_seconds=options["scan_seconds"]) as fake, override_settings(
+            METADEFENDER_API_URL=fake.url,
+            METADEFENDER_POLL_INTERVAL=options["poll_interval"],
+            SCAN_VERDICT_BACKEND="neo.scan_cache.LocalVerdictStore",
+            CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+        ):
+            scan_cache._cache = None
+            files = [(f"bench{i}.bin", os.urandom(options["size"])) for i in range(options["files"])]
+            self.stdout.write(f"{'path':>8} {'hold p50':>9} {'hold p99':>9} {'verdict p50':>12} {'verdict p99':>12}")
+            for path, run in (("blocking", self.run_blocking), ("pool", self.run_pool)):
+                hold, verdict = asyncio.run(run(fake.url, files, options))
+                self.stdout.write(
+                    f"{path:>8} {percentile(hold, 50):>9.1f} {percentile(hold, 99):>9.1f} "
+                    f"{percentile(verdict, 50):>12.1f} {percentile(verdict, 99):>12.1f}"
+                )
+            scan_cache._cache = None
+            self.stdout.write("ms; hold = time the request worker is busy, verdict = submit to verdict")
+
+    async def run_blocking(self, api_url, files, options):
+        # Sync views under ASGI share one thread, so concurrent scans queue behind each other.
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1) as view_thread:
+            async def request(name, content):
+                start = time.perf_counter()
+                await loop.run_in_executor(view_thread, legacy_scan, api_url, content, name, options["poll_interval"])
+                elapsed = (time.perf_counter() - start) * 1000
+                return elapsed, elapsed
+
+            results = await asyncio.gather(*(request(name, content) for name, content in files))
+        return [hold for hold, _ in results], [verdict for _, verdict in results]
+
+    async def run_pool(self, api_url, files, options):
+        pool = TimedScanPool(workers=options["workers"], queue_size=len(files), scan=scan_file_metadefender)
+        submitted, hold = {}, []
+        for name, content in files:
+            start = time.perf_counter()
+            file_path, file_hash = await asyncio.to_thread(spool_upload, SimpleUploadedFile(name, content))
+            job_id = pool.submit(1, name, file_path, file_hash)
+            submitted[job_id] = start
+            hold.append((time.perf_counter() - start) * 1000)
+        await pool.shutdown(timeout=None)
+        return hold, [(pool.done_at[job_id] - start) * 1000 for job_id, start in submitted.items()]
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import requests
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from neo import scan_cache
+from neo.fake_scanner import FakeMetaDefender
+from neo.utils import SCAN_CHUNK_SIZE, scan_file_metadefender, spool_upload
+
+
+class BenchUpload:
+    """
+    Stands in for Django's TemporaryUploadedFile: reads a shared source
+    file from disk behind a unique first chunk, so every upload hashes
+    differently and reaches the scanner.
+    """
+
+    def __init__(self, name, source_path):
+        self.name = name
+        self.source_path = source_path
+        self.header = os.urandom(64)
+
+    def chunks(self, chunk_size=SCAN_CHUNK_SIZE):
+        yield self.header
+        with open(self.source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def read(self):
+        return b"".join(self.chunks())
+
+
+def legacy_scan(api_url, upload):
+    """The pre-streaming path: read the whole upload, hash it, post the bytes."""
+    content = upload.read()
+    hashlib.sha256(content).hexdigest()
+    headers = {"apikey": "bench", "Content-Type": "application/octet-stream", "filename": upload.name}
+    requests.post(f"{api_url}/file", headers=headers, data=content)
+
+
+async def streaming_scan(upload):
+    file_path, file_hash = await asyncio.to_thread(spool_upload, upload)
+    try:
+        await scan_file_metadefender(file_path, upload.name, file_hash)
+    finally:
+        os.remove(file_path)
+
+
+class Command(BaseCommand):
+    help = "Measure peak memory of concurrent large scans, streaming path vs whole-file reads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=1024 ** 3, help="Bytes per upload (default 1 GiB)")
+        parser.add_argument("--concurrency", type=int, default=4, help="Uploads scanned at the same time")
+        parser.add_argument(
+            "--legacy", action="store_true",
+            help="Also run the whole-file baseline; needs about concurrency x size x 2 of free memory",
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix="bench-scan-") as spool_dir, \
+                FakeMetaDefender(scan_seconds=0) as fake, override_settings(
+                    METADEFENDER_API_URL=fake.url,
+                    METADEFENDER_POLL_INTERVAL=0.05,
+                    SCAN_SPOOL_DIR=spool_dir,
+                    SCAN_VERDICT_BACKEND="neo.scan_cache.LocalVerdictStore",
+                ):
+            scan_cache._cache = None
+            source = os.path.join(spool_dir, "source.bin")
+            with open(source, "wb") as f:
+                block = os.urandom(SCAN_CHUNK_SIZE)
+                for _ in range(options["size"] // SCAN_CHUNK_SIZE):
+                    f.write(block)
+                f.write(block[:options["size"] % SCAN_CHUNK_SIZE])
+
+            self.stdout.write(f"{'path':>9} {'uploads':>8} {'MB each':>8} {'peak MB':>8} {'maxrss MB':>10} {'seconds':>8}")
+            paths = [("streaming", self.run_streaming)]
+            if options["legacy"]:
+                paths.append(("legacy", self.run_legacy))
+            for path, run in paths:
+                uploads = [BenchUpload(f"bench{i}.bin", source) for i in range(options["concurrency"])]
+                tracemalloc.start()
+                start = time.perf_counter()
+                asyncio.run(run(fake.url, uploads))
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                self.stdout.write(
+                    f"{path:>9} {len(uploads):>8} {options['size'] / 1e6:>8.0f} {peak / 1e6:>8.1f} "
+                    f"{maxrss:>10.0f} {elapsed:>8.1f}"
+                )
+            scan_cache._cache = None
+            self.stdout.write("peak = Python allocations (tracemalloc); maxrss is process-wide and never goes down")
+
+    async def run_streaming(self, api_url, uploads):
+        await asyncio.gather(*(streaming_scan(upload) for upload in uploads))
+
+    async def run_legacy(self, api_url, uploads):
+        await asyncio.gather(*(asyncio.to_thread(legacy_scan, api_url, upload) for upload in uploads))
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+
+from neo.dht_harness import percentile
+from neo.signaling import LocalChannelRegistry, RedisChannelRegistry
+
+
+class Command(BaseCommand):
+    help = "Time signaling round trips between two users over group_send (baseline) and registry-addressed send."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=1000, help="Round trips timed per path")
+        parser.add_argument("--tabs", type=int, default=1, help="Sockets each user has open")
+        parser.add_argument("--registry", choices=("redis", "local"), default="redis")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'path':>7} {'tabs':>5} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+        for path in ("group", "direct"):
+            row = asyncio.run(self.run_one(path, options))
+            self.stdout.write(
+                f"{path:>7} {options['tabs']:>5} {row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f} {row['mean_ms']:>8.3f}"
+            )
+
+    async def run_one(self, path, options):
+        layer = get_channel_layer()
+        registry = LocalChannelRegistry() if options["registry"] == "local" else RedisChannelRegistry()
+        users = {"bench-a": [], "bench-b": []}
+        for user_id, channels in users.items():
+            for _ in range(options["tabs"]):
+                channel = await layer.new_channel()
+                channels.append(channel)
+                await layer.group_add(f"user_{user_id}_notifications", channel)
+                await registry.register(user_id, channel)
+
+        async def forward(target_id, message):
+            # Mirrors FileTransferConsumer.forward for each path.
+            event = {"type": "webrtc_message", "message": message}
+            if path == "direct":
+                channels = await registry.channels(target_id)
+                if len(channels) == 1:
+                    await layer.send(channels[0], event)
+                    return
+            await layer.group_send(f"user_{target_id}_notifications", event)
+
+        async def drain(channels):
+            return await asyncio.gather(*(layer.receive(channel) for channel in channels))
+
+        latencies = []
+        try:
+            for i in range(options["samples"]):
+                start = time.perf_counter()
+                await forward("bench-b", {"action": "webrtc_offer", "seq": i})
+                await drain(users["bench-b"])
+                await forward("bench-a", {"action": "webrtc_answer", "seq": i})
+                await drain(users["bench-a"])
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            for user_id, channels in users.items():
+                for channel in channels:
+                    await layer.group_discard(f"user_{user_id}_notifications", channel)
+                    await registry.unregister(user_id, channel)
+
+        return {
+            "p50_ms": percentile(latencies, 50),
+            "p99_ms": percentile(latencies, 99),
+            "mean_ms": sum(latencies) / len(latencies),
+        }
@@ -0,0 +1,53 @@
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so nothing is already imported or cached.
+# django.setup() imports every app's models (neo.models pulls in the DHT
+# module), so it is timed too and reported next to the views import.
+PROBE = """
+import os, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "neo_share.settings")
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter()
+import neo.views
+print((setup - start) * 1000, (time.perf_counter() - setup) * 1000)
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure how long django.setup() and importing neo.views take in a fresh worker process."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Number of cold imports to time")
+        parser.add_argument("--timeout", type=float, default=60.0, help="Seconds before a single run is aborted")
+
+    def handle(self, *args, **options):
+        timings = {"django.setup()": [], "import neo.views": [], "total": []}
+        for _ in range(options["runs"]):
+            result = subprocess.run(
+                [sys.executable, "-c", PROBE],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                timeout=options["timeout"],
+            )
+            if result.returncode != 0:
+                self.stderr.write(result.stderr)
+                raise SystemExit(result.returncode)
+            setup_ms, views_ms = (float(v) for v in result.stdout.strip().splitlines()[-1].split())
+            timings["django.setup()"].append(setup_ms)
+            timings["import neo.views"].append(views_ms)
+            timings["total"].append(setup_ms + views_ms)
+
+        for name, values in timings.items():
+            self.stdout.write(
+                f"{name}: min {min(values):.1f} ms, "
+                f"median {statistics.median(values):.1f} ms, "
+                f"max {max(values):.1f} ms over {len(values)} runs"
+            )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from neo.fake_scanner import FakeMetaDefender
+
+
+class Command(BaseCommand):
+    help = "Serve a local fake of the MetaDefender Cloud v4 API for offline scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8099)
+        parser.add_argument("--scan-seconds", type=float, default=0.5, help="Time before an upload's report completes")
+
+    def handle(self, *args, **options):
+        fake = FakeMetaDefender(options["host"], options["port"], scan_seconds=options["scan_seconds"])
+        self.stdout.write(f"Fake MetaDefender at {fake.url}; set METADEFENDER_API_URL to use it")
+        try:
+            fake.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            fake.stop()
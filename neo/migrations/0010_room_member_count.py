@@ -0,0 +1,32 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_member_count(apps, schema_editor):
+    Room = apps.get_model('neo', 'Room')
+    Membership = Room.users.through
+    counts = (
+        Membership.objects.filter(room_id=OuterRef('pk'))
+        .order_by()
+        .values('room_id')
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    Room.objects.update(member_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('neo', '0009_remove_room_is_expired_remove_room_max_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_member_count, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,11 @@
 from django.db import models  # Import Django's models module for defining database models
+from django.db.models import F  # Import F expressions for in-database counter updates
 from django.contrib.auth.models import User  # Import Django's built-in User model
-from django.db.models.signals import post_save  # Import post_save signal for automatic actions after saving
+from django.db.models.signals import post_save, post_delete  # Import signals for automatic actions after saving/deleting
 from django.dispatch import receiver  # Import receiver decorator for signal handling
 from django.utils.timezone import now  # Import now function for current timestamp with timezone
 from datetime import timedelta  # Import timedelta for calculating time differences
+from neo.dht_module import DHTManager  # Import DHTManager to keep its room cache in sync with the database
 
 def default_expiry():  # Define a function to set the default OTP expiry time
     return now() + timedelta(days=7)  # Return current time plus 7 days
@@ -45,10 +47,32 @@ class Room(models.Model):  # Define Room model for managing chat/file-sharing ro
     users = models.ManyToManyField(User, related_name='joined_rooms')  # Many-to-many relation for users in the room
     created_at = models.DateTimeField(auto_now_add=True)  # Timestamp of room creation, set automatically
     status = models.CharField(max_length=10, default='active')  # Room status, defaults to 'active'
+    member_count = models.PositiveIntegerField(default=0)  # Cached size of `users`; maintained by add_member/remove_member
 
     def __str__(self):  # String representation of the Room
         return f"Room {self.code} (Admin: {self.admin.username if self.admin else 'None'})"  # Return room code and admin username
 
+    def has_member(self, user):  # Indexed existence check instead of loading every member
+        return Room.users.through.objects.filter(room_id=self.pk, user_id=user.pk).exists()  # Single lookup on the (room, user) unique index
+
+    def add_member(self, user):  # Idempotently add a user and bump the cached count; returns True if newly added
+        _, created = Room.users.through.objects.get_or_create(room_id=self.pk, user_id=user.pk)  # Unique (room, user) index makes this race-safe
+        if created:  # Only count real inserts
+            Room.objects.filter(pk=self.pk).update(member_count=F('member_count') + 1)  # Atomic increment in the database
+        return created  # Tell the caller whether membership changed
+
+    def remove_member(self, user):  # Remove a user and decrement the cached count; returns True if they were a member
+        deleted, _ = Room.users.through.objects.filter(room_id=self.pk, user_id=user.pk).delete()  # Single indexed delete
+        if deleted:  # Only count real removals
+            Room.objects.filter(pk=self.pk, member_count__gt=0).update(member_count=F('member_count') - 1)  # Atomic decrement, never below zero
+        return bool(deleted)  # Tell the caller whether membership changed
+
+@receiver(post_save, sender=Room)  # Signal receiver for post-save on Room model
+@receiver(post_delete, sender=Room)  # Signal receiver for post-delete on Room model
+def invalidate_room_cache(sender, instance, **kwargs):  # Drop the cached DHT copy when a room changes status or goes away
+    if DHTManager._instance:  # Only if the DHT node runs in this process
+        DHTManager._instance.invalidate_room(instance.code)  # Next read goes back to the DHT
+
 class FileTransfer(models.Model):  # Define FileTransfer model for tracking file exchanges
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_files')  # Foreign key to User who sent the file
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_files')  # Foreign key to User who received the file
@@ -0,0 +1,189 @@
+"""
+Local first pass in front of the remote malware scan.
+
+The extension blocklist only sees the name, so an executable renamed to
+.pdf used to go to MetaDefender like any other file. A Prefilter looks at
+the spooled upload itself and, in order:
+
+1. Blocks the file if its SHA-256 is in a Bloom filter of known-bad hashes.
+2. Blocks it if its first bytes are an executable format (PE, ELF,
+   Mach-O, Windows shortcut), whatever its extension.
+3. Blocks it if an optional YARA rule set matches.
+
+The prefilter only ever blocks. Everything else goes to the remote scan:
+a file's first bytes say nothing about what follows them. For example, a
+ZIP holding an executable can be prefixed with a JPEG marker or with
+plain text and still open as a ZIP. Decisions depend on local
+configuration, so they are not written to the shared verdict cache.
+
+Signatures must not match ordinary files, since a match blocks outright.
+"MZ" alone also starts text and CSV files, so a PE is only recognised when
+e_lfanew points at a "PE\0\0" header. Shebang scripts are plain text that
+many users share on purpose (.py, .sh), so they go to the remote scan.
+
+The Bloom filter answers "maybe bad" with false-positive rate
+SCAN_BAD_HASHES_FP_RATE. A false positive blocks a harmless file. It never
+lets a bad file through. YARA needs the optional yara-python package.
+Without it, SCAN_YARA_RULES is ignored and a warning is logged.
+"""
+import hashlib
+import logging
+import math
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SNIFF_BYTES = 4096
+
+# Executable formats: (type name, offset, magic); first match wins. PE is checked separately.
+SIGNATURES = (
+    ("elf", 0, b"\x7fELF"),
+    ("macho", 0, b"\xfe\xed\xfa\xce"),
+    ("macho", 0, b"\xfe\xed\xfa\xcf"),
+    ("macho", 0, b"\xce\xfa\xed\xfe"),
+    ("macho", 0, b"\xcf\xfa\xed\xfe"),
+    ("macho", 0, b"\xca\xfe\xba\xbe"),
+    ("lnk", 0, b"L\x00\x00\x00\x01\x14\x02\x00"),
+)
+
+
+def is_pe(header):
+    """True for a DOS header whose e_lfanew points at a PE signature within `header`."""
+    if header[:2] != b"MZ" or len(header) < 0x40:
+        return False
+    e_lfanew = int.from_bytes(header[0x3c:0x40], "little")
+    return e_lfanew >= 0x40 and header[e_lfanew:e_lfanew + 4] == b"PE\0\0"
+
+
+def sniff(header):
+    """Executable type name for the first bytes of a file, or None."""
+    if is_pe(header):
+        return "pe"
+    for name, offset, magic in SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            return name
+    return None
+
+
+class BloomFilter:
+    """Bit-array set of SHA-256 digests; the k probe positions are drawn from a BLAKE2b stream of the digest."""
+
+    def __init__(self, capacity, fp_rate=1e-6):
+        self.size = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / max(capacity, 1) * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        # Plain double hashing (h1 + i*h2) measured well above the target
+        # false-positive rate at these sizes, so each probe gets its own bits.
+        positions, block = [], 0
+        per_block = max(1, 512 // self.size.bit_length())
+        while len(positions) < self.hashes:
+            x = int.from_bytes(hashlib.blake2b(digest, salt=block.to_bytes(16, "big")).digest(), "big")
+            for _ in range(min(per_block, self.hashes - len(positions))):
+                x, position = divmod(x, self.size)
+                positions.append(position)
+            block += 1
+        return positions
+
+    def add(self, file_hash):
+        for position in self._positions(bytes.fromhex(file_hash)):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, file_hash):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(bytes.fromhex(file_hash)))
+
+    @classmethod
+    def from_file(cls, path, fp_rate=1e-6):
+        """One hex SHA-256 per line; blank lines and # comments are skipped."""
+        with open(path) as f:
+            hashes = [line.split("#")[0].strip().lower() for line in f]
+        hashes = [h for h in hashes if h]
+        bloom = cls(len(hashes), fp_rate)
+        for file_hash in hashes:
+            bloom.add(file_hash)
+        return bloom
+
+
+class YaraRules:
+    """Compiled YARA rules, or a no-op when yara-python is missing."""
+
+    def __init__(self, path):
+        try:
+            import yara
+        except ImportError:
+            logger.warning(f"SCAN_YARA_RULES is set but yara-python is not installed; ignoring {path}")
+            self.rules = None
+            return
+        self.rules = yara.compile(filepath=path)
+
+    def match(self, file_path):
+        if self.rules is None:
+            return []
+        return [match.rule for match in self.rules.match(file_path, timeout=10)]
+
+
+class Prefilter:
+    def __init__(self, bad_hashes=None, rules=None):
+        self.bad_hashes = bad_hashes
+        self.rules = rules
+        self._lock = threading.Lock()
+        self.counts = {"known_bad": 0, "executable": 0, "rule_match": 0, "remote": 0}
+
+    def check(self, file_path, file_hash):
+        """(False, info) when the file is blocked locally, None when it needs the remote scan."""
+        if self.bad_hashes is not None and file_hash in self.bad_hashes:
+            self._count("known_bad")
+            return False, "File matches a known malicious file"
+
+        with open(file_path, "rb") as f:
+            header = f.read(SNIFF_BYTES)
+        kind = sniff(header)
+        if kind is not None:
+            self._count("executable")
+            return False, f"File content is an executable ({kind}) and is not allowed for security reasons"
+
+        if self.rules is not None:
+            matched = self.rules.match(file_path)
+            if matched:
+                self._count("rule_match")
+                return False, "File matches malware rules: " + ", ".join(matched[:2])
+
+        self._count("remote")
+        return None
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            blocked = sum(self.counts.values()) - self.counts["remote"]
+            total = sum(self.counts.values())
+            return {
+                **self.counts,
+                "block_rate": blocked / total if total else 0.0,
+                "bad_hashes": self.bad_hashes.count if self.bad_hashes is not None else 0,
+                "yara": bool(self.rules is not None and self.rules.rules is not None),
+            }
+
+
+_prefilter = None
+
+
+def get_prefilter():
+    global _prefilter
+    if _prefilter is None:
+        bad_hashes_file = getattr(settings, 'SCAN_BAD_HASHES_FILE', None)
+        rules_file = getattr(settings, 'SCAN_YARA_RULES', None)
+        _prefilter = Prefilter(
+            bad_hashes=BloomFilter.from_file(
+                bad_hashes_file, getattr(settings, 'SCAN_BAD_HASHES_FP_RATE', 1e-6)
+            ) if bad_hashes_file else None,
+            rules=YaraRules(rules_file) if rules_file else None,
+        )
+    return _prefilter
@@ -0,0 +1,546 @@
+"""
+Presence index: who is in which room right now, and who is live site-wide.
+
+Roster reads used to filter UserProfile on the unindexed room_code and
+is_online columns. The store keeps a small "card" per member instead, so a
+roster read is O(room size) and never touches the table. Postgres stays
+the source of truth. A room the store has not seen yet, e.g. after a
+restart, is loaded from the table once.
+
+Every roster change bumps a per-room version. Dashboards receive a
+snapshot when they connect and versioned join/leave/update deltas after
+that, instead of the whole list on every change.
+
+A member stays in the roster while one of their dashboards is open. The
+worker serving a room's dashboards heartbeats those members and drops the
+rest once PRESENCE_TTL passes without a heartbeat, publishing a leave for
+each. Opening a dashboard again puts the member back.
+
+Site-wide "live" presence is counted per connection, so a user with two
+tabs stays live until the last one closes. Each worker heartbeats its own
+sockets. Connections whose worker stopped heartbeating expire after
+PRESENCE_LIVE_TTL. Reading the live list checks a version counter and only
+refetches the list when it changed.
+
+RedisPresenceStore is shared by every worker. LocalPresenceStore is the
+per-process stand-in for development and benchmarks.
+"""
+import asyncio
+import json
+import logging
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .broadcast import live_users_broadcaster
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+def profile_card(profile, user):
+    """The viewer-independent part of a roster entry."""
+    return {
+        'id': user.id,
+        'username': profile.google_name or user.username,
+        'is_google_user': bool(profile.google_name),
+        'join_time': user.date_joined.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def roster_view(cards, viewer_id, admin_id):
+    """Add the per-viewer flags the dashboard expects to each card."""
+    return [
+        dict(card, is_current_user=card['id'] == viewer_id, is_super_user=card['id'] == admin_id)
+        for card in cards
+    ]
+
+
+class PresenceStore:
+    """
+    Backend interface.
+
+    Each room member has a card and a last-seen time. Members not seen for
+    `ttl` seconds are left out of roster() and removed by the next sweep().
+    Each join or leave bumps the room's version. roster() returns (version, cards), or None for a room the store
+    has never been told about, so the caller can load it.
+    """
+
+    def __init__(self, ttl=60, live_ttl=60):
+        self.ttl = ttl
+        self.live_ttl = live_ttl
+
+    async def join(self, room_code, card):
+        """Add or replace a member's card; returns (version, newly_added)."""
+        raise NotImplementedError
+
+    async def leave(self, room_code, user_id):
+        """Remove a member; returns the new version, or None if they weren't in the room."""
+        raise NotImplementedError
+
+    async def sweep(self, room_code, user_ids):
+        """
+        Refresh last-seen for those of `user_ids` who are members, then
+        remove members not seen within ttl.
+
+        Returns (version, user_id) for each member removed.
+        """
+        raise NotImplementedError
+
+    async def roster(self, room_code):
+        raise NotImplementedError
+
+    async def load(self, room_code, cards):
+        """Seed a room's roster, e.g. from the database after a restart."""
+        raise NotImplementedError
+
+    async def live_connect(self, username, connection):
+        """Register one socket; True if this made the user live."""
+        raise NotImplementedError
+
+    async def live_disconnect(self, username, connection):
+        """Drop one socket; True if it was the user's last."""
+        raise NotImplementedError
+
+    async def live_heartbeat(self, connections):
+        """
+        Refresh (username, connection) pairs.
+
+        Returns the users this made live again, i.e. whose connections had
+        already expired.
+        """
+        raise NotImplementedError
+
+    async def live_expire(self):
+        """Drop connections not heartbeaten within live_ttl; returns users who went offline."""
+        raise NotImplementedError
+
+    async def live_users(self):
+        raise NotImplementedError
+
+
+class LocalPresenceStore(PresenceStore):
+    """In-process store; only correct with a single worker."""
+
+    def __init__(self, ttl=60, live_ttl=60):
+        super().__init__(ttl, live_ttl)
+        self.rooms = {}
+        self.versions = {}
+        self.connections = {}
+        self.live = {}
+
+    def _bump(self, room_code):
+        version = self.versions[room_code] = self.versions.get(room_code, 0) + 1
+        return version
+
+    async def join(self, room_code, card):
+        members = self.rooms.setdefault(room_code, {})
+        added = card['id'] not in members
+        members[card['id']] = (time.time(), card)
+        return self._bump(room_code), added
+
+    async def leave(self, room_code, user_id):
+        if self.rooms.get(room_code, {}).pop(user_id, None) is None:
+            return None
+        return self._bump(room_code)
+
+    async def sweep(self, room_code, user_ids):
+        members = self.rooms.get(room_code)
+        if not members:
+            return []
+        now = time.time()
+        for user_id in user_ids:
+            if user_id in members:
+                members[user_id] = (now, members[user_id][1])
+        cutoff = now - self.ttl
+        gone = [uid for uid, (seen, _) in members.items() if seen < cutoff]
+        return [(await self.leave(room_code, user_id), user_id) for user_id in gone]
+
+    async def roster(self, room_code):
+        members = self.rooms.get(room_code)
+        if members is None:
+            return None
+        cutoff = time.time() - self.ttl
+        return self.versions.get(room_code, 0), [card for seen, card in members.values() if seen >= cutoff]
+
+    async def load(self, room_code, cards):
+        now = time.time()
+        members = self.rooms.setdefault(room_code, {})
+        for card in cards:
+            members.setdefault(card['id'], (now, card))
+
+    async def live_connect(self, username, connection):
+        key = (username, connection)
+        added = key not in self.connections
+        self.connections[key] = time.time()
+        if not added:
+            return False
+        self.live[username] = self.live.get(username, 0) + 1
+        return self.live[username] == 1
+
+    async def live_disconnect(self, username, connection):
+        if self.connections.pop((username, connection), None) is None:
+            return False
+        self.live[username] -= 1
+        if self.live[username] > 0:
+            return False
+        del self.live[username]
+        return True
+
+    async def live_heartbeat(self, connections):
+        revived = []
+        for username, connection in connections:
+            if await self.live_connect(username, connection):
+                revived.append(username)
+        return revived
+
+    async def live_expire(self):
+        cutoff = time.time() - self.live_ttl
+        gone = []
+        for username, connection in [key for key, seen in self.connections.items() if seen < cutoff]:
+            if await self.live_disconnect(username, connection):
+                gone.append(username)
+        return gone
+
+    async def live_users(self):
+        return list(self.live)
+
+
+class RedisPresenceStore(PresenceStore):
+    """
+    Shared store. Per room:
+
+      presence:room:{code}           sorted set, user id -> last-seen timestamp
+      presence:room:{code}:cards     hash, user id -> JSON card
+      presence:room:{code}:version   roster version, bumped by every join/leave
+
+    and site-wide:
+
+      presence:live:conns     sorted set, "username\nconnection" -> last heartbeat
+      presence:live:counts    hash, username -> open connections
+      presence:live:users     set of usernames with at least one connection
+      presence:live:version   bumped whenever presence:live:users changes
+
+    Every change that touches more than one key is a Lua script, so it and
+    its version bump are atomic across workers.
+
+    All room keys expire after `ttl` seconds without writes, so abandoned
+    rooms clean themselves up.
+    """
+
+    LIVE_KEYS = ("presence:live:conns", "presence:live:counts", "presence:live:users", "presence:live:version")
+
+    SCRIPTS = {
+        "join": """
+            local added = redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+            redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+            local version = redis.call('INCR', KEYS[3])
+            for i = 1, 3 do redis.call('EXPIRE', KEYS[i], ARGV[4]) end
+            return {version, added}
+        """,
+        "leave": """
+            if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then return false end
+            redis.call('HDEL', KEYS[2], ARGV[1])
+            return redis.call('INCR', KEYS[3])
+        """,
+        # ARGV: now, cutoff, ttl, user ids to refresh. Returns {user id, version, ...} for each member removed.
+        "sweep": """
+            if redis.call('EXISTS', KEYS[3]) == 0 then return {} end
+            for i = 4, #ARGV do redis.call('ZADD', KEYS[1], 'XX', ARGV[1], ARGV[i]) end
+            local gone = {}
+            for _, uid in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[2])) do
+                redis.call('ZREM', KEYS[1], uid)
+                redis.call('HDEL', KEYS[2], uid)
+                table.insert(gone, uid)
+                table.insert(gone, redis.call('INCR', KEYS[3]))
+            end
+            for i = 1, 3 do redis.call('EXPIRE', KEYS[i], ARGV[3]) end
+            return gone
+        """,
+        # ARGV: member, username, now. Returns 1 if the user became live.
+        "live_connect": """
+            if redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1]) == 0 then return 0 end
+            if redis.call('HINCRBY', KEYS[2], ARGV[2], 1) > 1 then return 0 end
+            redis.call('SADD', KEYS[3], ARGV[2])
+            redis.call('INCR', KEYS[4])
+            return 1
+        """,
+        # ARGV: member, username. Returns 1 if it was the user's last connection.
+        "live_disconnect": """
+            if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then return 0 end
+            if redis.call('HINCRBY', KEYS[2], ARGV[2], -1) > 0 then return 0 end
+            redis.call('HDEL', KEYS[2], ARGV[2])
+            redis.call('SREM', KEYS[3], ARGV[2])
+            redis.call('INCR', KEYS[4])
+            return 1
+        """,
+        # ARGV: cutoff. Returns the users whose last connection expired.
+        "live_expire": """
+            local gone = {}
+            for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])) do
+                redis.call('ZREM', KEYS[1], member)
+                local username = string.match(member, '^(.-)\\n')
+                if redis.call('HINCRBY', KEYS[2], username, -1) <= 0 then
+                    redis.call('HDEL', KEYS[2], username)
+                    redis.call('SREM', KEYS[3], username)
+                    table.insert(gone, username)
+                end
+            end
+            if #gone > 0 then redis.call('INCR', KEYS[4]) end
+            return gone
+        """,
+    }
+
+    def __init__(self, ttl=60, live_ttl=60, url=None):
+        super().__init__(ttl, live_ttl)
+        self.url = url or getattr(settings, 'PRESENCE_REDIS_URL', 'redis://127.0.0.1:6379/1')
+        self._clients = weakref.WeakKeyDictionary()
+        self._live_cache = (None, [])
+
+    def _connect(self):
+        # redis.asyncio connections are bound to the loop that opened them.
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(loop)
+        if entry is None:
+            client = redis.Redis.from_url(self.url)
+            scripts = {name: client.register_script(source) for name, source in self.SCRIPTS.items()}
+            entry = self._clients[loop] = (client, scripts)
+        return entry
+
+    def _client(self):
+        return self._connect()[0]
+
+    def _script(self, name):
+        return self._connect()[1][name]
+
+    @staticmethod
+    def _keys(room_code):
+        key = f"presence:room:{room_code}"
+        return key, f"{key}:cards", f"{key}:version"
+
+    async def join(self, room_code, card):
+        version, added = await self._script("join")(
+            keys=self._keys(room_code), args=[time.time(), card['id'], json.dumps(card), self.ttl]
+        )
+        return int(version), bool(added)
+
+    async def leave(self, room_code, user_id):
+        version = await self._script("leave")(keys=self._keys(room_code), args=[user_id])
+        return int(version) if version is not None else None
+
+    async def sweep(self, room_code, user_ids):
+        now = time.time()
+        gone = await self._script("sweep")(
+            keys=self._keys(room_code), args=[now, now - self.ttl, self.ttl, *user_ids]
+        )
+        return [(int(version), int(uid)) for uid, version in zip(gone[::2], gone[1::2])]
+
+    async def roster(self, room_code):
+        # Read-only: stale members are left out here and removed by sweep(),
+        # which publishes their leave, so open dashboards hear about it.
+        seen_key, cards_key, version_key = self._keys(room_code)
+        cutoff = time.time() - self.ttl
+        async with self._client().pipeline(transaction=True) as pipe:
+            pipe.zrangebyscore(seen_key, cutoff, '+inf')
+            pipe.hgetall(cards_key)
+            pipe.get(version_key)
+            current, cards, version = await pipe.execute()
+        if not current and not cards and version is None:
+            return None
+        return int(version or 0), [json.loads(cards[uid]) for uid in current if uid in cards]
+
+    async def load(self, room_code, cards):
+        seen_key, cards_key, version_key = self._keys(room_code)
+        now = time.time()
+        async with self._client().pipeline(transaction=True) as pipe:
+            if cards:
+                pipe.zadd(seen_key, {card['id']: now for card in cards}, nx=True)
+                pipe.hset(cards_key, mapping={card['id']: json.dumps(card) for card in cards})
+                pipe.expire(seen_key, self.ttl)
+                pipe.expire(cards_key, self.ttl)
+            # Marks the room as known even when it's empty.
+            pipe.set(version_key, 0, nx=True, ex=self.ttl)
+            await pipe.execute()
+
+    async def live_connect(self, username, connection):
+        return bool(await self._script("live_connect")(
+            keys=self.LIVE_KEYS, args=[f"{username}\n{connection}", username, time.time()]
+        ))
+
+    async def live_disconnect(self, username, connection):
+        return bool(await self._script("live_disconnect")(
+            keys=self.LIVE_KEYS, args=[f"{username}\n{connection}", username]
+        ))
+
+    async def live_heartbeat(self, connections):
+        # Re-running live_connect refreshes the score of live entries and
+        # re-counts any that expired, e.g. while this worker's loop was stalled.
+        now = time.time()
+        script = self._script("live_connect")
+        async with self._client().pipeline(transaction=False) as pipe:
+            for username, connection in connections:
+                await script(keys=self.LIVE_KEYS, args=[f"{username}\n{connection}", username, now], client=pipe)
+            results = await pipe.execute()
+        return [username for (username, _), revived in zip(connections, results) if revived]
+
+    async def live_expire(self):
+        gone = await self._script("live_expire")(keys=self.LIVE_KEYS, args=[time.time() - self.live_ttl])
+        return [name.decode() for name in gone]
+
+    async def live_users(self):
+        client = self._client()
+        version = await client.get(self.LIVE_KEYS[3])
+        cached_version, cached = self._live_cache
+        if version is not None and version == cached_version:
+            return cached
+        users = [name.decode() for name in await client.smembers(self.LIVE_KEYS[2])]
+        self._live_cache = (version, users)
+        return users
+
+
+_store = None
+
+
+def get_presence_store():
+    global _store
+    if _store is None:
+        backend = import_string(getattr(settings, 'PRESENCE_BACKEND', 'neo.presence.RedisPresenceStore'))
+        _store = backend(ttl=getattr(settings, 'PRESENCE_TTL', 60), live_ttl=getattr(settings, 'PRESENCE_LIVE_TTL', 60))
+    return _store
+
+
+class LiveHeartbeat:
+    """
+    Keeps this worker's live sockets fresh in the store and sweeps expired ones.
+
+    The loop runs only while this worker has sockets. Each beat refreshes all
+    of them in one round trip and expires connections left behind by workers
+    that died. The resulting joins and leaves go to the live_users broadcaster.
+    """
+
+    def __init__(self, interval=20):
+        self.interval = interval
+        self.connections = {}
+        self._task = None
+
+    def add(self, connection, username):
+        self.connections[connection] = username
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def discard(self, connection):
+        self.connections.pop(connection, None)
+
+    async def _run(self):
+        while self.connections:
+            await asyncio.sleep(self.interval)
+            await self.beat()
+
+    async def beat(self):
+        store = get_presence_store()
+        try:
+            revived = await store.live_heartbeat([(username, conn) for conn, username in self.connections.items()])
+            for username in revived:
+                live_users_broadcaster.join(username)
+            for username in await store.live_expire():
+                live_users_broadcaster.leave(username)
+        except Exception as e:
+            logger.error(f"Live presence heartbeat failed: {e}")
+
+
+live_heartbeat = LiveHeartbeat(interval=getattr(settings, 'PRESENCE_LIVE_HEARTBEAT', 20))
+
+
+class RoomHeartbeat:
+    """
+    Keeps the members whose dashboards this worker serves in their rooms' rosters.
+
+    A room's dashboards all connect to the worker that owns it (see
+    neo.affinity), so that worker knows who is still looking at it. Each
+    beat refreshes those members in one call per room and drops members not
+    seen within PRESENCE_TTL, e.g. after their last dashboard closed or
+    their worker died, publishing a leave delta for each.
+    """
+
+    def __init__(self, interval=20):
+        self.interval = interval
+        self.sockets = {}
+        self._task = None
+
+    def add(self, connection, room_code, user_id):
+        self.sockets[connection] = (room_code, user_id)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def discard(self, connection):
+        self.sockets.pop(connection, None)
+
+    async def _run(self):
+        while self.sockets:
+            await asyncio.sleep(self.interval)
+            await self.beat()
+
+    async def beat(self):
+        rooms = {}
+        for room_code, user_id in self.sockets.values():
+            rooms.setdefault(room_code, set()).add(user_id)
+        store = get_presence_store()
+        for room_code, user_ids in rooms.items():
+            try:
+                for version, user_id in await store.sweep(room_code, sorted(user_ids)):
+                    await _publish(room_code, {'version': version, 'op': 'leave', 'user_id': user_id})
+            except Exception as e:
+                logger.error(f"Roster heartbeat for room {room_code} failed: {e}")
+
+
+room_heartbeat = RoomHeartbeat(interval=getattr(settings, 'PRESENCE_ROOM_HEARTBEAT', 20))
+
+
+def _cards_from_db(room_code):
+    profiles = UserProfile.objects.filter(room_code=room_code, is_online=True).select_related('user')
+    return [profile_card(profile, profile.user) for profile in profiles]
+
+
+async def room_roster(room_code):
+    """(version, cards) for the room, loading it from the database the first time it's seen."""
+    store = get_presence_store()
+    roster = await store.roster(room_code)
+    if roster is None:
+        cards = await sync_to_async(_cards_from_db)(room_code)
+        await store.load(room_code, cards)
+        roster = await store.roster(room_code) or (0, cards)
+    return roster
+
+
+async def _publish(room_code, delta):
+    await get_channel_layer().group_send(f"dashboard_{room_code}", {'type': 'roster_delta', **delta})
+
+
+async def announce_join(room_code, card):
+    """Record a member joining (or their card changing) and push the delta to the room's dashboards."""
+    version, added = await get_presence_store().join(room_code, card)
+    await _publish(room_code, {'version': version, 'op': 'join' if added else 'update', 'user': card})
+
+
+def _member_card(room_code, user):
+    profile = UserProfile.objects.filter(user=user, room_code=room_code).first()
+    return profile_card(profile, user) if profile else None
+
+
+async def announce_present(room_code, user):
+    """Put a room member whose dashboard just opened back in the roster; no-op for non-members."""
+    card = await sync_to_async(_member_card)(room_code, user)
+    if card is not None:
+        await announce_join(room_code, card)
+
+
+async def announce_leave(room_code, user_id):
+    version = await get_presence_store().leave(room_code, user_id)
+    if version is not None:
+        await _publish(room_code, {'version': version, 'op': 'leave', 'user_id': user_id})
@@ -0,0 +1,126 @@
+"""
+Write-behind for UserProfile.is_online / last_seen.
+
+Socket connects and disconnects used to do a get_or_create and a full-row
+save each. The writer instead keeps the latest (is_online, last_seen) per
+user in memory. Every PRESENCE_WRITE_INTERVAL seconds it writes them all
+with one UPDATE ... FROM (VALUES ...) per batch, touching only those two
+columns. A reconnect storm becomes a handful of statements per interval.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceWriter:
+    """
+    Per-process buffer of pending presence writes, keyed by user id.
+
+    A user's later record replaces their earlier one. The flush task runs
+    only while records are pending. A failed flush puts its rows back unless
+    a newer record for the same user arrived in the meantime.
+    """
+
+    def __init__(self, interval=1.0, batch_size=500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending = {}
+        self._task = None
+        self.records = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.statements = 0
+        self.rows = 0
+        self.failures = 0
+
+    def record(self, user_id, is_online, last_seen=None):
+        self.records += 1
+        if user_id in self._pending:
+            self.coalesced += 1
+        self._pending[user_id] = (is_online, last_seen or timezone.now())
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write everything recorded so far."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self.flushes += 1
+        try:
+            await database_sync_to_async(self._write)(list(pending.items()))
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Presence flush of {len(pending)} profiles failed: {e}")
+            for user_id, values in pending.items():
+                self._pending.setdefault(user_id, values)
+
+    def _write(self, rows):
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            if connection.vendor == 'postgresql':
+                self._update_from_values(batch)
+            else:
+                self._bulk_update(batch)
+            self.statements += 1
+            self.rows += len(batch)
+
+    def _update_from_values(self, batch):
+        meta = UserProfile._meta
+        quote = connection.ops.quote_name
+        user_col = quote(meta.get_field('user').column)
+        online_col = quote(meta.get_field('is_online').column)
+        seen_col = quote(meta.get_field('last_seen').column)
+        values = ", ".join(["(%s::integer, %s::boolean, %s::timestamptz)"] * len(batch))
+        sql = (
+            f"UPDATE {quote(meta.db_table)} AS p "
+            f"SET {online_col} = v.is_online, {seen_col} = v.last_seen "
+            f"FROM (VALUES {values}) AS v(user_id, is_online, last_seen) "
+            f"WHERE p.{user_col} = v.user_id"
+        )
+        params = [value for user_id, (is_online, last_seen) in batch for value in (user_id, is_online, last_seen)]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def _bulk_update(self, batch):
+        # Fallback for databases without UPDATE ... FROM; bulk_update still
+        # writes just the two columns, but needs the primary keys first.
+        updates = dict(batch)
+        profiles = list(UserProfile.objects.filter(user_id__in=updates).only('id', 'user_id'))
+        for profile in profiles:
+            profile.is_online, profile.last_seen = updates[profile.user_id]
+        UserProfile.objects.bulk_update(profiles, ['is_online', 'last_seen'])
+
+    def stats(self):
+        return {
+            "records": self.records,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "statements": self.statements,
+            "rows": self.rows,
+            "failures": self.failures,
+            "pending": len(self._pending),
+        }
+
+
+presence_writer = PresenceWriter(
+    interval=getattr(settings, 'PRESENCE_WRITE_INTERVAL', 1.0),
+    batch_size=getattr(settings, 'PRESENCE_WRITE_BATCH', 500),
+)
+
+
+async def flush_presence_writes():
+    await presence_writer.flush()
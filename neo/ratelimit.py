@@ -0,0 +1,127 @@
+"""
+Token-bucket rate limiting for websocket messages.
+
+A limit is (burst, per_seconds): a bucket holds up to `burst` tokens and
+refills at burst / per_seconds tokens a second, and each message spends one.
+Checking a message is O(1) in both backends.
+
+LocalRateLimiter keeps buckets in an LRU-bounded OrderedDict, so idle users
+age out and memory stays bounded. RedisRateLimiter enforces the limit
+across every worker with one Lua call per message.
+"""
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    'default': (10, 60),
+}
+
+
+class RateLimiter:
+    """Backend interface."""
+
+    async def allow(self, key, burst, per_seconds):
+        """Spend a token from `key`'s bucket; False if it is empty."""
+        raise NotImplementedError
+
+
+class LocalRateLimiter(RateLimiter):
+    """Per-process buckets, least recently used evicted past max_keys."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self.evictions = 0
+
+    async def allow(self, key, burst, per_seconds):
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * burst / per_seconds)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+        return allowed
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Cluster-wide buckets: one hash per key, updated atomically by a Lua
+    script that uses the server clock. Each key expires once its bucket
+    would be full again. Fails open if Redis is unreachable.
+    """
+
+    SCRIPT = """
+        local burst = tonumber(ARGV[1])
+        local rate = burst / tonumber(ARGV[2])
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or burst
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + (now - updated) * rate)
+        local allowed = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+        return allowed
+    """
+
+    def __init__(self, url=None):
+        self.url = url or getattr(settings, 'RATE_LIMIT_REDIS_URL', 'redis://127.0.0.1:6379/1')
+        self._scripts = weakref.WeakKeyDictionary()
+
+    def _script(self):
+        # redis.asyncio connections are bound to the loop that opened them.
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        script = self._scripts.get(loop)
+        if script is None:
+            script = self._scripts[loop] = redis.Redis.from_url(self.url).register_script(self.SCRIPT)
+        return script
+
+    async def allow(self, key, burst, per_seconds):
+        try:
+            return bool(await self._script()(keys=[f"ratelimit:{key}"], args=[burst, per_seconds]))
+        except Exception as e:
+            logger.error(f"Rate limiter unavailable, allowing {key}: {e}")
+            return True
+
+
+class ActionRateLimits:
+    """Per-action limits from a settings dict; unknown actions share the 'default' bucket."""
+
+    def __init__(self, limiter, limits):
+        self.limiter = limiter
+        self.limits = {**DEFAULT_LIMITS, **limits}
+
+    async def allow(self, subject, action):
+        bucket = action if action in self.limits else 'default'
+        burst, per_seconds = self.limits[bucket]
+        return await self.limiter.allow(f"{subject}:{bucket}", burst, per_seconds)
+
+
+_signaling_limits = None
+
+
+def get_signaling_limits():
+    global _signaling_limits
+    if _signaling_limits is None:
+        backend = import_string(getattr(settings, 'RATE_LIMIT_BACKEND', 'neo.ratelimit.RedisRateLimiter'))
+        _signaling_limits = ActionRateLimits(backend(), getattr(settings, 'SIGNALING_RATE_LIMITS', {}))
+    return _signaling_limits
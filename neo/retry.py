@@ -0,0 +1,206 @@
+"""
+Retry, deadline and circuit-breaker helpers for calls to flaky backends.
+
+A RetryPolicy retries an async call with capped exponential backoff and
+full jitter, but never past the caller's Deadline; a CircuitBreaker shared
+by all callers of one backend skips it entirely while it's known to be down.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The caller's time budget ran out before the call succeeded."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The backend is known to be down; the call was not attempted."""
+
+
+class Deadline:
+    """An absolute point in time that a whole operation must finish by.
+
+    Pass the same Deadline down through nested calls so retries and
+    fan-out share one budget instead of each starting a fresh timeout.
+    """
+
+    def __init__(self, expires_at=None):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds):
+        """Deadline `seconds` from now, or an unbounded one for None."""
+        return cls(None if seconds is None else time.monotonic() + seconds)
+
+    def remaining(self):
+        """Seconds left (never negative), or None if unbounded."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def cap(self, timeout):
+        """The smaller of `timeout` and the time left; None means no limit."""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures.
+
+    While open every call is refused; after `reset_timeout` seconds one trial
+    call is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may go ahead now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """Give up a call without an outcome, e.g. when it was cancelled.
+
+        A cancelled call says nothing about the backend, so nothing is
+        counted; a half-open trial is handed to the next caller instead of
+        blocking every later one.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    logger.warning(f"Circuit {self.name} opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+class RetryPolicy:
+    """Capped exponential backoff with full jitter and per-attempt timeouts."""
+
+    def __init__(self, attempts=3, base_delay=0.05, max_delay=1.0, multiplier=2.0, attempt_timeout=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.attempt_timeout = attempt_timeout
+
+    def backoff(self, attempt):
+        """Delay before retry number `attempt` (0-based), fully jittered."""
+        ceiling = min(self.max_delay, self.base_delay * (self.multiplier ** attempt))
+        return random.uniform(0, ceiling)
+
+    async def run(self, func, deadline=None, breaker=None, description="call"):
+        """Await `func()` until it succeeds, attempts run out or the deadline passes.
+
+        Raises CircuitOpenError without calling `func` while `breaker` is
+        open, DeadlineExceeded when the budget is spent, and otherwise the
+        last exception raised by `func`.
+
+        An attempt cut short by the caller's deadline, not by
+        attempt_timeout, is not a backend failure and isn't counted
+        against `breaker`.
+        """
+        deadline = deadline or Deadline()
+        for attempt in range(self.attempts):
+            if deadline.expired:
+                raise DeadlineExceeded(f"{description}: deadline exceeded before attempt {attempt + 1}")
+            if breaker and not breaker.allow():
+                raise CircuitOpenError(f"{description}: circuit {breaker.name} is open")
+            timeout = deadline.cap(self.attempt_timeout)
+            capped = timeout is not None and (self.attempt_timeout is None or timeout < self.attempt_timeout)
+            try:
+                result = await asyncio.wait_for(func(), timeout)
+            except asyncio.CancelledError:
+                if breaker:
+                    breaker.release()
+                raise
+            except asyncio.TimeoutError as e:
+                if not capped:
+                    if breaker:
+                        breaker.record_failure()
+                    if attempt == self.attempts - 1:
+                        raise
+                    await self._pause(attempt, deadline, description, e)
+                    continue
+                # The caller's budget ran out, not the backend's time
+                if breaker:
+                    breaker.release()
+                raise DeadlineExceeded(f"{description}: deadline exceeded during attempt {attempt + 1}") from e
+            except Exception as e:
+                if breaker:
+                    breaker.record_failure()
+                if attempt == self.attempts - 1:
+                    raise
+                await self._pause(attempt, deadline, description, e)
+            else:
+                if breaker:
+                    breaker.record_success()
+                return result
+
+    async def _pause(self, attempt, deadline, description, error):
+        """Back off before the next attempt, or raise DeadlineExceeded if the budget can't cover it."""
+        delay = self.backoff(attempt)
+        remaining = deadline.remaining()
+        if remaining is not None and delay >= remaining:
+            raise DeadlineExceeded(f"{description}: no time left to retry after {error!r}") from error
+        logger.warning(f"Attempt {attempt + 1} of {description} failed: {error!r}; retrying in {delay:.3f}s")
+        await asyncio.sleep(delay)
@@ -0,0 +1,58 @@
+import secrets
+import threading
+from collections import deque
+
+from django.conf import settings
+
+from .models import Room
+
+ROOM_CODE_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+class RoomCodeAllocator:
+    """
+    Hands out room codes from a pool that was checked against the Room table.
+
+    Codes come from the OS CSPRNG. The pool is refilled in bulk when it runs
+    low: one indexed `code IN (...)` query removes the taken codes from a
+    whole batch. Issuing a code is a deque pop, no matter how many rooms
+    exist. Another process can still take the same code in the meantime, so
+    callers treat an IntegrityError as "take the next one".
+    """
+
+    def __init__(self, length=6, pool_size=256, low_water=32, alphabet=ROOM_CODE_ALPHABET):
+        self.length = length
+        self.pool_size = pool_size
+        self.low_water = low_water
+        self.alphabet = alphabet
+        self._pool = deque()
+        self._lock = threading.Lock()
+        self.refills = 0
+        self.rejected = 0
+
+    def _random_code(self):
+        return ''.join(secrets.choice(self.alphabet) for _ in range(self.length))
+
+    def refill(self):
+        """Top the pool up to pool_size with codes not present in the Room table."""
+        candidates = set()
+        while len(candidates) < self.pool_size - len(self._pool):
+            candidates.add(self._random_code())
+        candidates.difference_update(self._pool)
+        taken = set(Room.objects.filter(code__in=candidates).values_list('code', flat=True))
+        self.rejected += len(taken)
+        self._pool.extend(candidates - taken)
+        self.refills += 1
+
+    def allocate(self):
+        """Return a room code that was free when the pool was last refilled."""
+        with self._lock:
+            if len(self._pool) <= self.low_water:
+                self.refill()
+            return self._pool.popleft()
+
+    def stats(self):
+        return {"pool": len(self._pool), "refills": self.refills, "rejected": self.rejected}
+
+
+room_code_allocator = RoomCodeAllocator(pool_size=getattr(settings, 'ROOM_CODE_POOL_SIZE', 256))
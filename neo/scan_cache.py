@@ -0,0 +1,176 @@
+"""
+Malware-scan verdicts keyed by the file's SHA-256.
+
+A VerdictCache answers from an in-process TTL/LRU map first, then from a
+shared store, and only then lets the caller go to the scanning service.
+Only definitive verdicts are cached. "Service unavailable, proceeding with
+caution" results are never cached, so an outage doesn't mark a file safe
+for the whole TTL.
+
+LocalVerdictStore keeps nothing beyond the process. RedisVerdictStore
+persists verdicts across workers and restarts. Entries expire after the
+TTL, and Redis evicts under its own maxmemory policy. Store errors count
+as misses.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class VerdictStore:
+    """Backend interface. A verdict is (is_safe, info)."""
+
+    def get(self, file_hash):
+        raise NotImplementedError
+
+    def put(self, file_hash, verdict, ttl):
+        raise NotImplementedError
+
+
+class LocalVerdictStore(VerdictStore):
+    """Per-process map with per-entry expiry, least recently used evicted past maxsize."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, file_hash):
+        with self._lock:
+            entry = self._entries.get(file_hash)
+            if entry is None:
+                return None
+            expires_at, verdict = entry
+            if expires_at <= time.monotonic():
+                del self._entries[file_hash]
+                return None
+            self._entries.move_to_end(file_hash)
+            return verdict
+
+    def put(self, file_hash, verdict, ttl):
+        with self._lock:
+            self._entries[file_hash] = (time.monotonic() + ttl, verdict)
+            self._entries.move_to_end(file_hash)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisVerdictStore(VerdictStore):
+    """One key per hash, scan:verdict:{sha256}, holding [is_safe, info] as JSON."""
+
+    def __init__(self, url=None):
+        self.url = url or getattr(settings, 'SCAN_VERDICT_REDIS_URL', 'redis://127.0.0.1:6379/1')
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def get(self, file_hash):
+        try:
+            raw = self.client().get(f"scan:verdict:{file_hash}")
+        except Exception as e:
+            logger.error(f"Verdict store unavailable for {file_hash}: {e}")
+            return None
+        if raw is None:
+            return None
+        is_safe, info = json.loads(raw)
+        return bool(is_safe), info
+
+    def put(self, file_hash, verdict, ttl):
+        try:
+            self.client().set(f"scan:verdict:{file_hash}", json.dumps(list(verdict)), ex=int(ttl))
+        except Exception as e:
+            logger.error(f"Could not store verdict for {file_hash}: {e}")
+
+
+class VerdictCache:
+    """In-process front over a shared VerdictStore, with hit counters per tier."""
+
+    def __init__(self, store, ttl=86400, memory_size=4096):
+        self.store = store
+        self.ttl = ttl
+        self.memory = LocalVerdictStore(memory_size)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.hash_lookup_hits = 0
+        self.uploads = 0
+        self.misses = 0
+
+    def get(self, file_hash):
+        verdict = self.memory.get(file_hash)
+        if verdict is not None:
+            self._count('memory_hits')
+            return verdict
+        verdict = self.store.get(file_hash)
+        if verdict is not None:
+            self._count('store_hits')
+            self.memory.put(file_hash, verdict, self.ttl)
+            return verdict
+        self._count('misses')
+        return None
+
+    def peek(self, file_hash):
+        """Memory tier only; never does I/O, so it is safe to call on the event loop."""
+        verdict = self.memory.get(file_hash)
+        if verdict is not None:
+            self._count('memory_hits')
+        return verdict
+
+    def put(self, file_hash, verdict):
+        self.memory.put(file_hash, verdict, self.ttl)
+        self.store.put(file_hash, verdict, self.ttl)
+
+    def record(self, source):
+        """Count how a cache miss was resolved: 'hash_lookup_hits' or 'uploads'."""
+        self._count(source)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.store_hits + self.misses
+            return {
+                "memory_size": len(self.memory),
+                "memory_evictions": self.memory.evictions,
+                "ttl": self.ttl,
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.store_hits) / lookups if lookups else 0.0,
+                "hash_lookup_hits": self.hash_lookup_hits,
+                "uploads": self.uploads,
+            }
+
+
+_cache = None
+
+
+def get_verdict_cache():
+    global _cache
+    if _cache is None:
+        backend = import_string(getattr(settings, 'SCAN_VERDICT_BACKEND', 'neo.scan_cache.RedisVerdictStore'))
+        _cache = VerdictCache(
+            backend(),
+            ttl=getattr(settings, 'SCAN_VERDICT_TTL', 86400),
+            memory_size=getattr(settings, 'SCAN_VERDICT_MEMORY_SIZE', 4096),
+        )
+    return _cache
@@ -0,0 +1,181 @@
+"""
+Background malware scans.
+
+A scan used to hold a request worker for the whole MetaDefender exchange:
+an upload and then up to five polls two seconds apart. Now the scan_file
+view queues a ScanJob and returns its id at once. A fixed number of worker
+tasks on the server event loop run the jobs. Each verdict is pushed to the
+submitting user's user_{id}_notifications group as a scan_result message.
+
+The queue is bounded. When it is full, submit() raises ScanQueueFull and
+the view answers 503 instead of spooling more uploads to disk. A job owns
+its spool file and removes it once the scan is done.
+
+A scan that runs past job_timeout is cut off, and like other scanner
+failures it fails open. That bounds how long a queued job can wait, and
+verdict_timeout() tells the client how long to wait for its scan_result.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+import uuid
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .utils import scan_file_metadefender
+
+logger = logging.getLogger(__name__)
+
+
+class ScanQueueFull(Exception):
+    pass
+
+
+class ScanJob:
+    def __init__(self, user_id, file_name, file_path, file_hash):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.file_name = file_name
+        self.file_path = file_path
+        self.file_hash = file_hash
+        self.submitted_at = time.monotonic()
+
+
+class ScanPool:
+    """
+    Per-process queue and workers.
+
+    Workers start on the first submit(), on the loop that called it, and
+    exit when shutdown() is awaited. `scan` is the coroutine that turns
+    (file_path, file_name, file_hash) into (is_safe, info).
+    """
+
+    def __init__(self, workers=4, queue_size=64, scan=scan_file_metadefender, job_timeout=60.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.scan = scan
+        self.job_timeout = job_timeout
+        self._queue = None
+        self._tasks = []
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.total_scan = 0.0
+
+    def submit(self, user_id, file_name, file_path, file_hash):
+        """
+        Queue a scan and return its job id; must be called on the event loop.
+        The pool takes over file_path unless ScanQueueFull is raised.
+        """
+        self._start()
+        job = ScanJob(user_id, file_name, file_path, file_hash)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ScanQueueFull()
+        self.submitted += 1
+        return job.id
+
+    def verdict_timeout(self):
+        """
+        Seconds within which a job submitted just now gets its verdict: the
+        jobs queued ahead of it run `workers` at a time, after the ones
+        already running, and none runs longer than job_timeout.
+        """
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return (math.ceil(queued / self.workers) + 1) * self.job_timeout
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [task for task in self._tasks if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker()))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        started = time.monotonic()
+        self.total_wait += started - job.submitted_at
+        try:
+            is_safe, message = await asyncio.wait_for(
+                self.scan(job.file_path, job.file_name, job.file_hash), self.job_timeout
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"Scan job {job.id} ran past {self.job_timeout}s")
+            is_safe, message = True, "File scan timed out, proceeding with caution"
+        except Exception as e:
+            # scan_file_metadefender fails open itself; this only catches bugs
+            self.failures += 1
+            logger.error(f"Scan job {job.id} failed: {e}")
+            is_safe, message = True, "File scan failed, proceeding with caution"
+        finally:
+            try:
+                os.remove(job.file_path)
+            except OSError as e:
+                logger.warning(f"Could not remove scan spool file {job.file_path}: {e}")
+        self.total_scan += time.monotonic() - started
+        self.completed += 1
+        try:
+            await get_channel_layer().group_send(f"user_{job.user_id}_notifications", {
+                "type": "scan_result",
+                "job_id": job.id,
+                "file_name": job.file_name,
+                "safe": is_safe,
+                "message": message,
+            })
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Could not deliver scan result {job.id} to user {job.user_id}: {e}")
+
+    async def shutdown(self, timeout=5.0):
+        """Give queued jobs `timeout` seconds to finish, then stop the workers."""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Stopping scan workers with {self._queue.qsize()} jobs queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return {
+            "workers": len([task for task in self._tasks if not task.done()]),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "mean_wait": self.total_wait / self.completed if self.completed else 0.0,
+            "mean_scan": self.total_scan / self.completed if self.completed else 0.0,
+        }
+
+
+scan_pool = ScanPool(
+    workers=getattr(settings, 'SCAN_WORKERS', 4),
+    queue_size=getattr(settings, 'SCAN_QUEUE_SIZE', 64),
+    job_timeout=getattr(settings, 'SCAN_JOB_TIMEOUT', 60.0),
+)
+
+
+async def stop_scan_pool():
+    await scan_pool.shutdown()
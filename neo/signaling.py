@@ -0,0 +1,224 @@
+"""
+ICE candidate batching for the signaling socket.
+
+Connection setup produces dozens of candidates in quick succession. Each
+one used to be its own group_send. A CandidateBatcher holds a sender's
+candidates for each target for a short window. It then forwards them as a
+single webrtc_ice_candidates message, so setup costs a few channel-layer
+messages instead of one per candidate.
+
+The ChannelRegistry lets one-recipient signaling skip group fan-out.
+"""
+import asyncio
+import logging
+import time
+import weakref
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+MAX_CANDIDATES_PER_MESSAGE = 64
+
+
+class CandidateBatcher:
+    """
+    Per-socket buffer of outgoing candidates, keyed by target user.
+
+    The first candidate for a target starts a `window`-second timer. A
+    batch is forwarded when the timer fires or when it reaches
+    `max_batch`, whichever comes first. `forward(target_id, message)` does
+    the actual delivery.
+    """
+
+    def __init__(self, sender_id, forward, window=0.02, max_batch=32):
+        self.sender_id = sender_id
+        self.forward = forward
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        self._timers = {}
+        self._flushing = set()
+        self.candidates = 0
+        self.batches = 0
+
+    def add(self, target_id, candidates):
+        batch = self._pending.setdefault(target_id, [])
+        batch.extend(candidates)
+        if len(batch) >= self.max_batch:
+            self._flush_soon(target_id)
+        elif target_id not in self._timers:
+            self._timers[target_id] = asyncio.get_running_loop().call_later(self.window, self._flush_soon, target_id)
+
+    def _flush_soon(self, target_id):
+        task = asyncio.get_running_loop().create_task(self.flush(target_id))
+        # The loop only keeps a weak reference to tasks.
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def flush(self, target_id):
+        timer = self._timers.pop(target_id, None)
+        if timer:
+            timer.cancel()
+        candidates = self._pending.pop(target_id, None)
+        if not candidates:
+            return
+        self.candidates += len(candidates)
+        self.batches += 1
+        try:
+            await self.forward(target_id, {
+                'action': 'webrtc_ice_candidates',
+                'sender_id': self.sender_id,
+                'target_id': target_id,
+                'candidates': candidates,
+            })
+        except Exception as e:
+            logger.error(f"Failed to forward {len(candidates)} ICE candidates to {target_id}: {e}")
+
+    async def close(self):
+        """Forward whatever is still buffered and wait for flushes already running, e.g. when the socket closes."""
+        for target_id in list(self._pending):
+            await self.flush(target_id)
+        if self._flushing:
+            await asyncio.gather(*self._flushing)
+
+
+def make_candidate_batcher(sender_id, forward):
+    return CandidateBatcher(
+        sender_id,
+        forward,
+        window=getattr(settings, 'SIGNALING_ICE_BATCH_WINDOW', 0.02),
+        max_batch=getattr(settings, 'SIGNALING_ICE_BATCH_MAX', 32),
+    )
+
+
+class ChannelRegistry:
+    """
+    Maps a user id to the channel names of their open signaling sockets.
+
+    Lets a one-recipient message go straight to its channel with
+    channel_layer.send and skip the group lookup and fan-out. The registry
+    is only an optimization. Senders fall back to the user's group whenever
+    it reports zero or several channels or fails, so a missing or expired
+    entry costs a group_send, never a lost message.
+
+    Only lookups that lead to the group are cached. A cached single
+    channel could outlive its socket on another worker and send into a
+    dead channel, so single-channel lookups always ask the backend.
+    """
+
+    def __init__(self, cache_ttl=1.0):
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def register(self, user_id, channel_name):
+        self._cache.pop(user_id, None)
+        await self._register(user_id, channel_name)
+
+    async def unregister(self, user_id, channel_name):
+        self._cache.pop(user_id, None)
+        await self._unregister(user_id, channel_name)
+
+    def invalidate(self, user_id):
+        """Forget the cached lookup for the user, e.g. after a direct send failed."""
+        self._cache.pop(user_id, None)
+
+    async def channels(self, user_id):
+        """Channel names for the user; zero- and multi-channel answers come from a short-lived local cache."""
+        now = time.monotonic()
+        cached = self._cache.get(user_id)
+        if cached and cached[0] > now:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        channels = await self._channels(user_id)
+        if len(channels) != 1:
+            self._cache[user_id] = (now + self.cache_ttl, channels)
+            if len(self._cache) > 10000:
+                self._cache.clear()
+        else:
+            self._cache.pop(user_id, None)
+        return channels
+
+    async def _register(self, user_id, channel_name):
+        raise NotImplementedError
+
+    async def _unregister(self, user_id, channel_name):
+        raise NotImplementedError
+
+    async def _channels(self, user_id):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"cache_hits": self.hits, "cache_misses": self.misses, "cached_users": len(self._cache)}
+
+
+class LocalChannelRegistry(ChannelRegistry):
+    """In-process registry; only correct with a single worker."""
+
+    def __init__(self, cache_ttl=1.0):
+        super().__init__(cache_ttl)
+        self._users = {}
+
+    async def _register(self, user_id, channel_name):
+        self._users.setdefault(user_id, set()).add(channel_name)
+
+    async def _unregister(self, user_id, channel_name):
+        channels = self._users.get(user_id)
+        if channels is not None:
+            channels.discard(channel_name)
+            if not channels:
+                del self._users[user_id]
+
+    async def _channels(self, user_id):
+        return sorted(self._users.get(user_id, ()))
+
+
+class RedisChannelRegistry(ChannelRegistry):
+    """
+    One set per user, signaling:user:{id}. It expires `ttl` seconds after
+    the user's last connect. Sockets open longer than that fall back to
+    group delivery.
+    """
+
+    def __init__(self, cache_ttl=1.0, ttl=3600, url=None):
+        super().__init__(cache_ttl)
+        self.ttl = ttl
+        self.url = url or getattr(settings, 'SIGNALING_REGISTRY_REDIS_URL', 'redis://127.0.0.1:6379/1')
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        # redis.asyncio connections are bound to the loop that opened them.
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.Redis.from_url(self.url)
+        return client
+
+    async def _register(self, user_id, channel_name):
+        async with self._client().pipeline(transaction=True) as pipe:
+            pipe.sadd(f"signaling:user:{user_id}", channel_name)
+            pipe.expire(f"signaling:user:{user_id}", self.ttl)
+            await pipe.execute()
+
+    async def _unregister(self, user_id, channel_name):
+        await self._client().srem(f"signaling:user:{user_id}", channel_name)
+
+    async def _channels(self, user_id):
+        return sorted(name.decode() for name in await self._client().smembers(f"signaling:user:{user_id}"))
+
+
+_registry = None
+
+
+def get_channel_registry():
+    global _registry
+    if _registry is None:
+        backend = import_string(getattr(settings, 'SIGNALING_REGISTRY_BACKEND', 'neo.signaling.RedisChannelRegistry'))
+        _registry = backend(cache_ttl=getattr(settings, 'SIGNALING_REGISTRY_CACHE_TTL', 1.0))
+    return _registry
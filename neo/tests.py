@@ -1,3 +1,684 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import zipfile
+from unittest import mock
 
-# Create your tests here.
\ No newline at end of file
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from neo import scan_cache
+from neo.consumers import DashboardConsumer
+from neo.dht_codec import FORMAT_JSON, FORMAT_ROOM, BinaryCodec, CodecError
+from neo.dht_membership import MembershipLog
+from neo.dht_module import BatchResult, DHTManager, RoomCache
+from neo.fake_scanner import EICAR, FakeMetaDefender
+from neo.models import Room, UserProfile
+from neo.prefilter import BloomFilter, Prefilter
+from neo.presence import LocalPresenceStore, room_heartbeat
+from neo.presence_writer import PresenceWriter
+from neo.ratelimit import ActionRateLimits, LocalRateLimiter
+from neo.retry import CircuitBreaker, Deadline, DeadlineExceeded, RetryPolicy
+from neo.room_codes import RoomCodeAllocator
+from neo.scan_jobs import ScanPool, ScanQueueFull
+from neo.signaling import CandidateBatcher, LocalChannelRegistry
+from neo.utils import scan_file_metadefender
+from neo.views import create_room_records
+
+
+def write_temp(testcase, content):
+    f = tempfile.NamedTemporaryFile(delete=False)
+    with f:
+        f.write(content)
+    testcase.addCleanup(remove_if_exists, f.name)
+    return f.name
+
+
+def remove_if_exists(path):
+    # Scan jobs remove their own spool files
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def pe_header():
+    # DOS header whose e_lfanew (offset 0x3c) points at the PE signature right after it
+    return b"MZ\x90\x00" + b"\x00" * 56 + (0x40).to_bytes(4, "little") + b"PE\x00\x00"
+
+
+def zip_with_exe():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("evil.exe", pe_header() + b"\x00" * 256)
+    return buffer.getvalue()
+
+
+class PrefilterTests(SimpleTestCase):
+    def check(self, content, prefilter=None):
+        path = write_temp(self, content)
+        return (prefilter or Prefilter()).check(path, hashlib.sha256(content).hexdigest())
+
+    def test_disguised_executables_are_blocked(self):
+        for content in (pe_header() + os.urandom(64), b"\x7fELF\x02\x01\x01"):
+            is_safe, _ = self.check(content)
+            self.assertFalse(is_safe)
+
+    def test_look_alikes_go_to_the_remote_scan(self):
+        for content in (
+            b"MZ,Zambia,Lusaka\n",  # CSV row
+            b"MZ\x90\x00" + os.urandom(64),  # DOS header without a PE signature
+            b"#!/usr/bin/env python3\nprint('hi')\n",  # Scripts are scanned, not blocked
+        ):
+            self.assertIsNone(self.check(content))
+
+    def test_known_bad_hash_is_blocked(self):
+        content = b"\x89PNG\r\n\x1a\n" + os.urandom(64)
+        bloom = BloomFilter(10)
+        bloom.add(hashlib.sha256(content).hexdigest())
+        self.assertEqual(self.check(content, Prefilter(bad_hashes=bloom)), (False, "File matches a known malicious file"))
+
+    def test_polyglots_go_to_the_remote_scan(self):
+        payload = zip_with_exe()
+        polyglots = [
+            b"\xff\xd8\xff\xe0" + payload,  # JPEG marker in front of a ZIP
+            b"A" * 4096 + payload,  # Text-looking first block
+            b"\x89PNG\r\n\x1a\n" + payload,
+            b"ID3" + payload,
+            b"\x00\x00\x00\x18ftypmp42" + payload,
+        ]
+        for content in polyglots:
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                self.assertEqual(archive.namelist(), ["evil.exe"])
+            self.assertIsNone(self.check(content))
+
+    def test_plain_content_is_never_passed_locally(self):
+        for content in (b"<html><script>alert(1)</script></html>", b"hello world\n", b"\xff\xd8\xff\xe0" + os.urandom(64)):
+            self.assertIsNone(self.check(content))
+
+
+class BinaryCodecTests(SimpleTestCase):
+    room = {"admin": "alice", "members": ["alice", "bob", "carol"], "created_at": "1234.5", "status": "active"}
+
+    def test_room_round_trip(self):
+        codec = BinaryCodec()
+        data = codec.encode(self.room)
+        self.assertEqual(data[0], FORMAT_ROOM)
+        self.assertEqual(codec.decode(data), self.room)
+
+    def test_other_values_fall_back_to_json(self):
+        codec = BinaryCodec()
+        for value in ({**self.room, "topic": "x"}, {"a": {"bob": ["w:1"]}, "t": [], "w": {"w": 1}}, 3):
+            data = codec.encode(value)
+            self.assertEqual(data[0], FORMAT_JSON)
+            self.assertEqual(codec.decode(data), value)
+
+    def test_reads_legacy_pickle(self):
+        self.assertEqual(BinaryCodec().decode(pickle.dumps(self.room)), self.room)
+
+    def test_refuses_pickled_globals(self):
+        with self.assertRaisesMessage(CodecError, "Refusing to unpickle global"):
+            BinaryCodec().decode(pickle.dumps(os.system))
+
+    def test_truncated_input_raises_codec_error(self):
+        codec = BinaryCodec()
+        for data in (codec.encode(self.room), codec.encode([1, 2]), pickle.dumps(self.room)):
+            with self.assertRaises(CodecError):
+                codec.decode(data[:-2])
+
+
+class RoomCacheTests(SimpleTestCase):
+    room = {"admin": "alice", "members": ["alice"], "created_at": "1.0", "status": "active"}
+
+    def test_callers_get_copies(self):
+        cache = RoomCache()
+        room = {**self.room, "members": ["alice"]}
+        cache.put("R1", room)
+        room["members"].append("eve")
+        cache.get("R1")["members"].append("mallory")
+        self.assertEqual(cache.get("R1")["members"], ["alice"])
+
+    def test_entries_expire_after_ttl(self):
+        cache = RoomCache(ttl=0)
+        cache.put("R1", self.room)
+        self.assertIsNone(cache.get("R1"))
+        self.assertEqual((cache.stats()["expirations"], cache.stats()["size"]), (1, 0))
+
+    def test_least_recently_used_room_is_evicted(self):
+        cache = RoomCache(maxsize=2)
+        cache.put("R1", self.room)
+        cache.put("R2", self.room)
+        cache.get("R1")
+        cache.put("R3", self.room)
+        self.assertIsNone(cache.get("R2"))
+        self.assertIsNotNone(cache.get("R1"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"], stats["hit_rate"]), (2, 1, 1, 2 / 3))
+
+
+class RoomCacheSignalTests(TestCase):
+    def test_saving_or_deleting_a_room_invalidates_it(self):
+        node = DHTManager()
+        self.addCleanup(setattr, DHTManager, "_instance", DHTManager._instance)
+        DHTManager._instance = node
+        room = Room.objects.create(code="R1", admin=User.objects.create_user("alice"))
+        node.room_cache.put("R1", RoomCacheTests.room)
+        room.status = "closed"
+        room.save()
+        saved = node.room_cache.get("R1")
+        node.room_cache.put("R1", RoomCacheTests.room)
+        room.delete()
+        self.assertEqual((saved, node.room_cache.get("R1"), node.room_cache.invalidations), (None, None, 2))
+
+
+class FakeDHT:
+    """In-memory stand-in for DHTManager; every call yields so concurrent writers interleave."""
+
+    def __init__(self):
+        self.values = {}
+        self.misses = []
+
+    def decode(self, key, raw):
+        return raw
+
+    async def _get_raw(self, key, deadline=None):
+        await asyncio.sleep(0)
+        if key not in self.values:
+            self.misses.append(key)
+        return self.values.get(key)
+
+    async def _set_raw(self, key, value, deadline=None):
+        await asyncio.sleep(0)
+        self.values[key] = value
+
+    async def get_many(self, keys, deadline=None):
+        result = BatchResult()
+        for key in keys:
+            value = await self._get_raw(key)
+            if value is None:
+                result.missing.append(key)
+            else:
+                result.values[key] = value
+        return result
+
+    async def set_many(self, items, deadline=None):
+        result = BatchResult()
+        for key, value in items.items():
+            await self._set_raw(key, value)
+            result.values[key] = True
+        return result
+
+
+def fake_room(dht, code, members):
+    dht.values[f"room:{code}"] = {"admin": members[0], "members": members}
+    dht.values[f"room:{code}:snapshot"] = MembershipLog.initial_snapshot(members)
+
+
+class MembershipLogTests(SimpleTestCase):
+    def test_concurrent_writers_converge(self):
+        async def run():
+            dht = FakeDHT()
+            fake_room(dht, "R1", ["admin"])
+            a, b = MembershipLog(dht, "node-a"), MembershipLog(dht, "node-b")
+            # Both writers race to register in the same snapshot.
+            await asyncio.gather(
+                *(a.add("R1", f"a{i}") for i in range(5)),
+                *(b.add("R1", f"b{i}") for i in range(5)),
+            )
+            await asyncio.gather(a.remove("R1", "a0"), b.remove("R1", "b0"))
+            reader = MembershipLog(dht, "node-c")
+            return await reader.members("R1"), await a.members("R1"), await b.members("R1")
+
+        expected = {"admin", *(f"a{i}" for i in range(1, 5)), *(f"b{i}" for i in range(1, 5))}
+        for members in asyncio.run(run()):
+            self.assertEqual(set(members), expected)
+
+    def test_readers_only_look_up_existing_keys(self):
+        async def run():
+            dht = FakeDHT()
+            fake_room(dht, "R1", ["admin"])
+            await MembershipLog(dht, "node-a").add("R1", "alice")
+            dht.misses.clear()
+            members = await MembershipLog(dht, "node-b").members("R1")
+            return dht, members
+
+        dht, members = asyncio.run(run())
+        self.assertEqual(set(members), {"admin", "alice"})
+        self.assertEqual(dht.misses, [])
+
+    def test_remove_cancels_adds_made_through_other_nodes(self):
+        async def run():
+            dht = FakeDHT()
+            fake_room(dht, "R1", ["admin"])
+            a, b = MembershipLog(dht, "node-a"), MembershipLog(dht, "node-b")
+            await a.members("R1")
+            await b.add("R1", "alice")
+            await a.add("R1", "alice")
+            await a.remove("R1", "alice")
+            return await b.members("R1")
+
+        self.assertEqual(asyncio.run(run()), ["admin"])
+
+    def test_restarted_writer_resumes_its_sequence(self):
+        async def run():
+            dht = FakeDHT()
+            fake_room(dht, "R1", ["admin"])
+            await MembershipLog(dht, "node-a").add("R1", "alice")
+            await MembershipLog(dht, "node-a").add("R1", "bob")
+            return dht, await MembershipLog(dht, "node-b").members("R1")
+
+        dht, members = asyncio.run(run())
+        self.assertEqual(set(members), {"admin", "alice", "bob"})
+        self.assertEqual(dht.values["room:R1:head:node-a"], 2)
+
+    def test_compaction_keeps_writers_registered_meanwhile(self):
+        async def run():
+            dht = FakeDHT()
+            fake_room(dht, "R1", ["admin"])
+            writers = [MembershipLog(dht, f"node-{i}") for i in range(3)]
+            for i, log in enumerate(writers[:2]):
+                await log.add("R1", f"user{i}")
+            # node-2 registers while node-0 is folding.
+            await asyncio.gather(writers[0].compact("R1"), writers[2].add("R1", "user2"))
+            await writers[1].add("R1", "late")
+            return dht.values["room:R1:snapshot"]["w"], await MembershipLog(dht, "node-x").members("R1")
+
+        watermarks, members = asyncio.run(run())
+        self.assertIn("node-2", watermarks)
+        self.assertEqual(set(members), {"admin", "user0", "user1", "user2", "late"})
+
+
+class RetryPolicyTests(SimpleTestCase):
+    def test_cancelled_half_open_trial_frees_the_breaker(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        policy = RetryPolicy(attempts=1)
+
+        async def ok():
+            return "ok"
+
+        async def run():
+            trial = asyncio.ensure_future(policy.run(lambda: asyncio.sleep(60), breaker=breaker))
+            await asyncio.sleep(0.01)
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            trial.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await trial
+            return await policy.run(ok, breaker=breaker)
+
+        self.assertEqual(asyncio.run(run()), "ok")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_deadline_capped_timeouts_are_not_backend_failures(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        policy = RetryPolicy(attempts=3, attempt_timeout=2.0)
+
+        async def slow_but_healthy():
+            await asyncio.sleep(0.1)
+            return "ok"
+
+        async def run():
+            # Several lookups share a budget shorter than the backend's answer time
+            deadline = Deadline.after(0.02)
+            results = await asyncio.gather(
+                *(policy.run(slow_but_healthy, deadline=deadline, breaker=breaker) for _ in range(5)),
+                return_exceptions=True,
+            )
+            return results, await policy.run(slow_but_healthy, breaker=breaker)
+
+        results, after = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, DeadlineExceeded) for result in results))
+        self.assertEqual(after, "ok")
+        self.assertEqual(breaker.stats()["trips"], 0)
+
+    def test_attempt_timeouts_count_against_the_breaker(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+        policy = RetryPolicy(attempts=1, attempt_timeout=0.01)
+
+        async def hung():
+            await asyncio.sleep(1)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(policy.run(hung, breaker=breaker))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class RosterPresenceTests(SimpleTestCase):
+    def test_sweep_drops_members_without_an_open_dashboard(self):
+        async def run():
+            store = LocalPresenceStore(ttl=60)
+            await store.join("R1", {"id": 1})
+            await store.join("R1", {"id": 2})
+            # Both last seen two minutes ago; only user 1 still has a dashboard open.
+            for user_id, (seen, card) in store.rooms["R1"].items():
+                store.rooms["R1"][user_id] = (seen - 120, card)
+            stale_roster = await store.roster("R1")
+            gone = await store.sweep("R1", [1, 3])
+            return stale_roster, gone, await store.roster("R1")
+
+        stale_roster, gone, roster = asyncio.run(run())
+        self.assertEqual(stale_roster, (2, []))
+        self.assertEqual(gone, [(3, 2)])
+        self.assertEqual(roster, (3, [{"id": 1}]))
+
+    def test_anonymous_dashboard_is_closed_before_joining_the_roster(self):
+        async def run():
+            communicator = WebsocketCommunicator(DashboardConsumer.as_asgi(), "/ws/dashboard/R1/")
+            communicator.scope["user"] = AnonymousUser()
+            communicator.scope["url_route"] = {"kwargs": {"room_code": "R1"}}
+            connected, _ = await communicator.connect()
+            await communicator.disconnect()
+            return connected
+
+        self.assertFalse(asyncio.run(run()))
+        self.assertNotIn("R1", [room for room, _ in room_heartbeat.sockets.values()])
+
+
+class RecordingPresenceWriter(PresenceWriter):
+    """PresenceWriter that hands its rows to the test instead of the database."""
+
+    def __init__(self, fail=None):
+        super().__init__(interval=60)
+        self.written = []
+        self.fail = fail
+
+    def _write(self, rows):
+        if self.fail:
+            self.fail(self)
+            raise RuntimeError("database unavailable")
+        self.written.append(dict(rows))
+
+
+class PresenceWriterTests(SimpleTestCase):
+    def test_records_for_one_user_are_coalesced(self):
+        async def run():
+            writer = RecordingPresenceWriter()
+            writer.record(1, True, "t1")
+            writer.record(2, True, "t1")
+            writer.record(1, False, "t2")
+            await writer.flush()
+            return writer
+
+        writer = asyncio.run(run())
+        self.assertEqual(writer.written, [{1: (False, "t2"), 2: (True, "t1")}])
+        self.assertEqual((writer.records, writer.coalesced, writer.stats()["pending"]), (3, 1, 0))
+
+    def test_failed_flush_does_not_overwrite_newer_records(self):
+        def reconnect_during_flush(writer):
+            # User 1 comes back while the failing write is in flight.
+            writer._pending[1] = (True, "t3")
+
+        async def run():
+            writer = RecordingPresenceWriter(fail=reconnect_during_flush)
+            writer.record(1, False, "t2")
+            writer.record(2, False, "t2")
+            await writer.flush()
+            return writer
+
+        writer = asyncio.run(run())
+        self.assertEqual(writer._pending, {1: (True, "t3"), 2: (False, "t2")})
+        self.assertEqual(writer.failures, 1)
+
+
+class PresenceWriterDatabaseTests(TestCase):
+    def test_bulk_update_fallback_writes_both_columns(self):
+        alice, bob = User.objects.create_user("alice"), User.objects.create_user("bob")
+        seen = timezone.now()
+        with self.assertNumQueries(2):
+            PresenceWriter()._bulk_update([(alice.id, (True, seen)), (bob.id, (False, seen))])
+        profiles = {p.user_id: (p.is_online, p.last_seen) for p in UserProfile.objects.filter(user__in=[alice, bob])}
+        self.assertEqual(profiles, {alice.id: (True, seen), bob.id: (False, seen)})
+
+
+class RoomMembershipTests(TestCase):
+    def test_add_and_remove_are_idempotent(self):
+        admin, bob = User.objects.create_user("admin"), User.objects.create_user("bob")
+        room = Room.objects.create(code="R1", admin=admin)
+        added = [room.add_member(bob), room.add_member(bob)]
+        room.refresh_from_db()
+        after_add = (room.member_count, room.has_member(bob))
+        removed = [room.remove_member(bob), room.remove_member(bob)]
+        room.refresh_from_db()
+        self.assertEqual((added, after_add), ([True, False], (1, True)))
+        self.assertEqual((removed, room.member_count, room.has_member(bob)), ([True, False], 0, False))
+
+
+class RateLimitTests(SimpleTestCase):
+    def test_burst_is_spent_then_refilled(self):
+        async def run():
+            limiter = LocalRateLimiter()
+            burst = [await limiter.allow("u1", 3, 60) for _ in range(4)]
+            # Rewind the bucket 40 seconds: 2 of 3 tokens refilled at 3 per minute.
+            tokens, updated = limiter._buckets["u1"]
+            limiter._buckets["u1"] = (tokens, updated - 40)
+            refilled = [await limiter.allow("u1", 3, 60) for _ in range(3)]
+            return burst, refilled
+
+        self.assertEqual(asyncio.run(run()), ([True, True, True, False], [True, True, False]))
+
+    def test_actions_have_their_own_buckets_and_unknown_ones_share_default(self):
+        async def run():
+            limits = ActionRateLimits(LocalRateLimiter(), {"offer": (1, 60), "default": (2, 60)})
+            return [
+                await limits.allow("u1", "offer"),
+                await limits.allow("u1", "offer"),
+                await limits.allow("u2", "offer"),  # Other user, other bucket
+                await limits.allow("u1", "chat"),
+                await limits.allow("u1", "typing"),
+                await limits.allow("u1", "chat"),  # Third default-bucket message
+            ], sorted(limits.limiter._buckets)
+
+        allowed, buckets = asyncio.run(run())
+        self.assertEqual(allowed, [True, False, True, True, True, False])
+        self.assertEqual(buckets, ["u1:default", "u1:offer", "u2:offer"])
+
+    def test_least_recently_used_buckets_are_evicted(self):
+        async def run():
+            limiter = LocalRateLimiter(max_keys=2)
+            await limiter.allow("a", 1, 60)
+            await limiter.allow("b", 1, 60)
+            await limiter.allow("a", 1, 60)  # "b" is now least recently used
+            await limiter.allow("c", 1, 60)
+            # "a" keeps its empty bucket; "b" starts over with a full one.
+            return list(limiter._buckets), limiter.evictions, await limiter.allow("a", 1, 60), await limiter.allow("b", 1, 60)
+
+        self.assertEqual(asyncio.run(run()), (["a", "c"], 1, False, True))
+
+
+class RoomCodeTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin")
+
+    def test_refill_skips_taken_codes(self):
+        Room.objects.create(code="A", admin=self.admin)
+        allocator = RoomCodeAllocator(length=1, pool_size=2, low_water=0, alphabet="AB")
+        allocator.refill()
+        self.assertEqual((list(allocator._pool), allocator.rejected), (["B"], 1))
+
+    def test_pool_is_refilled_at_low_water(self):
+        allocator = RoomCodeAllocator(pool_size=4, low_water=2)
+        codes = [allocator.allocate() for _ in range(3)]
+        self.assertEqual(len(set(codes)), 3)
+        # Refilled on the first call (empty pool) and on the third (pool down to low_water)
+        self.assertEqual((allocator.refills, len(allocator._pool)), (2, 3))
+
+    def test_create_room_retries_a_code_taken_concurrently(self):
+        Room.objects.create(code="TAKEN1", admin=self.admin)
+        with mock.patch("neo.views.generate_room_code", side_effect=["TAKEN1", "FREE01"]):
+            room, profile = create_room_records(self.admin)
+        self.assertEqual((room.code, profile.room_code), ("FREE01", "FREE01"))
+        self.assertTrue(room.has_member(self.admin))
+
+
+class ChannelRegistryTests(SimpleTestCase):
+    def test_single_channel_lookups_are_not_cached(self):
+        async def run():
+            registry = LocalChannelRegistry(cache_ttl=60)
+            await registry.register("7", "old")
+            first = await registry.channels("7")
+            # The user reconnects through another worker, which this worker's cache never hears about.
+            await registry._unregister("7", "old")
+            await registry._register("7", "new")
+            return first, await registry.channels("7")
+
+        self.assertEqual(asyncio.run(run()), (["old"], ["new"]))
+
+    def test_multi_channel_lookups_are_cached(self):
+        async def run():
+            registry = LocalChannelRegistry(cache_ttl=60)
+            await registry.register("7", "a")
+            await registry.register("7", "b")
+            first = await registry.channels("7")
+            await registry._unregister("7", "b")
+            return first, await registry.channels("7"), registry.hits
+
+        self.assertEqual(asyncio.run(run()), (["a", "b"], ["a", "b"], 1))
+
+
+class CandidateBatcherTests(SimpleTestCase):
+    def run_batcher(self, steps, window=0.01, max_batch=3):
+        forwarded = []
+
+        async def forward(target_id, message):
+            await asyncio.sleep(0.01)
+            forwarded.append((target_id, message["candidates"]))
+
+        async def run():
+            batcher = CandidateBatcher("1", forward, window=window, max_batch=max_batch)
+            await steps(batcher, forwarded)
+            return batcher
+
+        return asyncio.run(run()), forwarded
+
+    def test_window_flushes_a_partial_batch(self):
+        async def steps(batcher, forwarded):
+            batcher.add("2", ["c1"])
+            batcher.add("2", ["c2"])
+            self.assertEqual(forwarded, [])
+            await asyncio.sleep(0.1)
+
+        batcher, forwarded = self.run_batcher(steps)
+        self.assertEqual(forwarded, [("2", ["c1", "c2"])])
+        self.assertEqual((batcher.candidates, batcher.batches), (2, 1))
+
+    def test_full_batch_is_flushed_before_the_window(self):
+        async def steps(batcher, forwarded):
+            batcher.add("2", ["c1", "c2", "c3"])
+            await asyncio.sleep(0.05)
+            self.assertEqual(forwarded, [("2", ["c1", "c2", "c3"])])
+
+        self.run_batcher(steps, window=60)
+
+    def test_close_flushes_pending_and_running_batches(self):
+        async def steps(batcher, forwarded):
+            batcher.add("2", ["c1", "c2", "c3"])
+            await asyncio.sleep(0)  # The flush task has taken the batch and is forwarding it
+            await batcher.close()
+            self.assertEqual(forwarded, [("2", ["c1", "c2", "c3"])])
+            batcher.add("3", ["c4"])  # Waiting for its window
+            await batcher.close()
+            self.assertEqual(forwarded[1:], [("3", ["c4"])])
+
+        self.run_batcher(steps, window=60)
+
+
+class ScanPipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeMetaDefender(scan_seconds=0).start()
+        self.addCleanup(self.fake.stop)
+        settings = override_settings(
+            METADEFENDER_API_URL=self.fake.url,
+            METADEFENDER_POLL_INTERVAL=0.01,
+            SCAN_VERDICT_BACKEND="neo.scan_cache.LocalVerdictStore",
+            CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        scan_cache._cache = None
+        self.addCleanup(setattr, scan_cache, "_cache", None)
+
+    def scan(self, content, name="file.txt"):
+        return asyncio.run(scan_file_metadefender(write_temp(self, content), name))
+
+    def test_clean_file(self):
+        self.assertEqual(self.scan(b"hello world\n"), (True, "File appears safe"))
+        self.assertEqual(self.fake.calls["upload"], 1)
+
+    def test_eicar_is_detected(self):
+        is_safe, message = self.scan(b"prefix " + EICAR + b" suffix")
+        self.assertFalse(is_safe)
+        self.assertIn("EICAR-Test-File", message)
+
+    def test_known_hash_skips_the_upload(self):
+        self.scan(EICAR)
+        # A fresh verdict cache, as on another worker: only MetaDefender knows the file.
+        scan_cache._cache = None
+        is_safe, _ = self.scan(EICAR)
+        self.assertFalse(is_safe)
+        self.assertEqual(self.fake.calls["upload"], 1)
+        self.assertEqual(self.fake.calls["hash"], 2)
+
+    def test_pool_pushes_verdicts_to_the_user(self):
+        async def run():
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            await layer.group_add("user_7_notifications", channel)
+            pool = ScanPool(workers=2, queue_size=4)
+            clean = pool.submit(7, "clean.txt", write_temp(self, b"clean"), None)
+            infected = pool.submit(7, "eicar.txt", write_temp(self, EICAR), None)
+            results = {}
+            for _ in range(2):
+                message = await layer.receive(channel)
+                results[message["job_id"]] = message["safe"]
+            await pool.shutdown()
+            return results, {clean: True, infected: False}
+
+        results, expected = asyncio.run(run())
+        self.assertEqual(results, expected)
+
+    def test_full_queue_is_rejected(self):
+        async def run():
+            release = asyncio.Event()
+
+            async def slow_scan(file_path, file_name, file_hash):
+                await release.wait()
+                return True, "File appears safe"
+
+            pool = ScanPool(workers=1, queue_size=1, scan=slow_scan, job_timeout=5)
+            pool.submit(7, "a.txt", write_temp(self, b"a"), None)
+            await asyncio.sleep(0)  # The worker takes the first job off the queue
+            pool.submit(7, "b.txt", write_temp(self, b"b"), None)
+            timeout = pool.verdict_timeout()
+            with self.assertRaises(ScanQueueFull):
+                pool.submit(7, "c.txt", write_temp(self, b"c"), None)
+            release.set()
+            await pool.shutdown()
+            return timeout, pool.stats()
+
+        timeout, stats = asyncio.run(run())
+        self.assertEqual(timeout, 10)
+        self.assertEqual((stats["rejected"], stats["completed"]), (1, 2))
+
+    def test_slow_scan_is_cut_off(self):
+        async def run():
+            async def hung_scan(file_path, file_name, file_hash):
+                await asyncio.sleep(60)
+
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            await layer.group_add("user_7_notifications", channel)
+            pool = ScanPool(workers=1, queue_size=1, scan=hung_scan, job_timeout=0.05)
+            pool.submit(7, "a.txt", write_temp(self, b"a"), None)
+            message = await layer.receive(channel)
+            await pool.shutdown()
+            return message, pool.stats()["timeouts"]
+
+        message, timeouts = asyncio.run(run())
+        self.assertEqual(message["message"], "File scan timed out, proceeding with caution")
+        self.assertEqual(timeouts, 1)
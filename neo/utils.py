@@ -1,10 +1,13 @@
+import asyncio
 import requests
 import hashlib
-import time
 import os
 from django.conf import settings
 import logging
 import json
+import tempfile
+from .http_client import async_http_client
+from .scan_cache import get_verdict_cache
 
 logger = logging.getLogger(__name__)
 
@@ -23,33 +26,131 @@ def is_dangerous_file(filename):
     ext = os.path.splitext(filename.lower())[1]
     return ext in BLOCKED_EXTENSIONS
 
-def scan_file_metadefender(file_content, file_name):
+def blocked_file_verdict(filename):
+    """Verdict for a file refused by extension alone"""
+    return False, f"File type {os.path.splitext(filename)[1]} is not allowed for security reasons"
+
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+def spool_upload(uploaded_file):
+    """
+    Copy an uploaded file to a scan spool file chunk by chunk, hashing as it goes
+    Memory stays at one chunk whatever the file size
+    Returns: (path, sha256 hex digest); the caller owns and removes the file
+    """
+    file_hash = hashlib.sha256()
+    spool = tempfile.NamedTemporaryFile(
+        prefix="scan-", dir=getattr(settings, 'SCAN_SPOOL_DIR', None), delete=False
+    )
+    try:
+        with spool:
+            for chunk in uploaded_file.chunks(SCAN_CHUNK_SIZE):
+                file_hash.update(chunk)
+                spool.write(chunk)
+    except Exception:
+        os.remove(spool.name)
+        raise
+    return spool.name, file_hash.hexdigest()
+
+def hash_file(file_path):
+    """SHA-256 of a file on disk, read one chunk at a time"""
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(SCAN_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def verdict_from_result(result):
+    """
+    Turn a finished MetaDefender report into (is_safe, threat_info)
+    """
+    scan_results = result.get("scan_results", {})
+    scan_details = scan_results.get("scan_details", {})
+
+    logger.debug("Final scan results: %s", json.dumps(scan_results, indent=2))
+
+    # Count actual threats found
+    threats = []
+    for engine, details in scan_details.items():
+        threat_found = details.get("threat_found", "")
+        scan_result_i = details.get("scan_result_i", 0)
+
+        # Only count as threat if both threat_found exists and scan_result_i > 0
+        if threat_found and scan_result_i > 0:
+            threats.append(f"{engine}: {threat_found}")
+
+    # If less than 2 engines detect a threat, consider it safe
+    if len(threats) < 2:
+        return True, "File appears safe"
+    else:
+        threat_info = "Multiple threats detected: " + "; ".join(threats[:2])
+        return False, threat_info
+
+def is_complete(result):
+    return result.get("scan_results", {}).get("progress_percentage", 0) == 100
+
+async def lookup_hash_metadefender(file_hash, api_url, headers):
+    """
+    Ask MetaDefender for an existing report on this SHA-256
+    Returns the finished report, or None if the file is unknown
     """
-    Scan a file using MetaDefender Cloud API
+    try:
+        response = await async_http_client.get(
+            f"{api_url}/hash/{file_hash}", endpoint="metadefender.hash", headers={"apikey": headers["apikey"]}
+        )
+    except requests.RequestException as e:
+        logger.warning(f"Hash lookup failed, uploading instead: {e}")
+        return None
+    if response.status_code != 200:
+        return None
+    result = response.json()
+    return result if is_complete(result) else None
+
+async def scan_file_metadefender(file_path, file_name, file_hash=None):
+    """
+    Scan a file on disk using MetaDefender Cloud API
+    The file is hashed and uploaded in chunks, never loaded whole
+    Checks the verdict cache, then a hash lookup, and uploads only unknown files
+    HTTP calls go through the pooled async client and polling sleeps on the event loop,
+    so a scan occupies no request worker while it waits
     Returns: (is_safe: bool, threat_info: str)
     """
     try:
         # First check file extension
         if is_dangerous_file(file_name):
-            return False, f"File type {os.path.splitext(file_name)[1]} is not allowed for security reasons"
+            return blocked_file_verdict(file_name)
 
         # Calculate file hash
-        file_hash = hashlib.sha256(file_content).hexdigest()
+        file_hash = file_hash or await asyncio.to_thread(hash_file, file_path)
+
+        # Same bytes scanned before: no upload
+        cache = get_verdict_cache()
+        verdict = await asyncio.to_thread(cache.get, file_hash)
+        if verdict is not None:
+            return verdict
         
         # MetaDefender Cloud API endpoint
-        api_url = "https://api.metadefender.com/v4"
+        api_url = getattr(settings, 'METADEFENDER_API_URL', "https://api.metadefender.com/v4")
         headers = {
             "apikey": settings.METADEFENDER_API_KEY,
             "Content-Type": "application/octet-stream",
             "filename": file_name
         }
 
+        # Known to MetaDefender already: reuse its report instead of uploading
+        result = await lookup_hash_metadefender(file_hash, api_url, headers)
+        if result is not None:
+            verdict = verdict_from_result(result)
+            cache.record("hash_lookup_hits")
+            await asyncio.to_thread(cache.put, file_hash, verdict)
+            return verdict
+
         # Upload file for scanning
-        scan_response = requests.post(
-            f"{api_url}/file",
-            headers=headers,
-            data=file_content
-        )
+        cache.record("uploads")
+        with open(file_path, "rb") as f:  # requests streams an open file instead of reading it whole
+            scan_response = await async_http_client.post(
+                f"{api_url}/file", endpoint="metadefender.upload", headers=headers, data=f
+            )
         
         if scan_response.status_code != 200:
             logger.warning(f"Scan upload failed: {scan_response.text}")
@@ -57,21 +158,23 @@ def scan_file_metadefender(file_content, file_name):
             return True, "File scan service unavailable, proceeding with caution"
         
         scan_result = scan_response.json()
-        logger.debug(f"Scan upload response: {json.dumps(scan_result, indent=2)}")
+        logger.debug("Scan upload response: %s", json.dumps(scan_result, indent=2))
         
         data_id = scan_result.get("data_id")
         if not data_id:
             # Allow file if we can't get scan ID
             return True, "File scan incomplete, proceeding with caution"
 
-        # Wait for scan to complete (up to 10 seconds)
-        max_retries = 5
+        # Wait for scan to complete (up to 10 seconds by default)
+        max_retries = getattr(settings, 'METADEFENDER_POLL_ATTEMPTS', 5)
+        poll_interval = getattr(settings, 'METADEFENDER_POLL_INTERVAL', 2.0)
         result = None
         
         for attempt in range(max_retries):
             logger.debug(f"Checking scan status (attempt {attempt + 1}/{max_retries})")
-            result_response = requests.get(
+            result_response = await async_http_client.get(
                 f"{api_url}/file/{data_id}",
+                endpoint="metadefender.report",
                 headers=headers
             )
             
@@ -79,42 +182,25 @@ def scan_file_metadefender(file_content, file_name):
                 continue
                 
             result = result_response.json()
-            logger.debug(f"Scan status response: {json.dumps(result, indent=2)}")
+            logger.debug("Scan status response: %s", json.dumps(result, indent=2))
             
             # Check if scan is complete
-            if result.get("scan_results", {}).get("progress_percentage", 0) == 100:
+            if is_complete(result):
                 break
                 
-            time.sleep(2)  # Wait 2 seconds before checking again
+            await asyncio.sleep(poll_interval)  # Wait before checking again
 
         if not result:
             # Allow file if scan results unavailable
             return True, "File scan results unavailable, proceeding with caution"
 
-        # Get scan details
-        scan_results = result.get("scan_results", {})
-        scan_details = scan_results.get("scan_details", {})
-        
-        logger.debug(f"Final scan results: {json.dumps(scan_results, indent=2)}")
-        
-        # Count actual threats found
-        threats = []
-        for engine, details in scan_details.items():
-            threat_found = details.get("threat_found", "")
-            scan_result_i = details.get("scan_result_i", 0)
-            
-            # Only count as threat if both threat_found exists and scan_result_i > 0
-            if threat_found and scan_result_i > 0:
-                threats.append(f"{engine}: {threat_found}")
-        
-        # If less than 2 engines detect a threat, consider it safe
-        if len(threats) < 2:
-            return True, "File appears safe"
-        else:
-            threat_info = "Multiple threats detected: " + "; ".join(threats[:2])
-            return False, threat_info
+        verdict = verdict_from_result(result)
+        if is_complete(result):
+            # Only finished reports are cached; a partial one may be missing engines
+            await asyncio.to_thread(cache.put, file_hash, verdict)
+        return verdict
 
     except Exception as e:
         logger.error(f"Scan error: {str(e)}")
         # Allow file if scan fails
-        return True, "File scan failed, proceeding with caution"
\ No newline at end of file
+        return True, "File scan failed, proceeding with caution"
@@ -10,45 +10,49 @@ from .models import OTP, Room, Notification, UserProfile, FileTransfer
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from functools import wraps
 import json
 from django.conf import settings
+from django.db import IntegrityError, transaction
 import logging
 import random
 import asyncio
+import os
 import re
-from neo.dht_module import Server, DHTManager
+import requests
+from neo.dht_module import DHTManager
 from allauth.socialaccount.models import SocialAccount
 from django.contrib.auth.tokens import default_token_generator
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from channels.layers import get_channel_layer
 from django.urls import reverse
 from django.contrib.sites.shortcuts import get_current_site
 from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
-from .utils import scan_file_metadefender
+from .utils import blocked_file_verdict, is_dangerous_file, spool_upload
+from .scan_jobs import ScanQueueFull, scan_pool
+from .affinity import get_router
+from .room_codes import room_code_allocator
+from .broadcast import live_users_broadcaster
+from .presence_writer import presence_writer
+from .signaling import get_channel_registry
+from . import hotlog
+from .scan_cache import get_verdict_cache
+from .http_client import http_client
+from .prefilter import get_prefilter
+from .presence import announce_join, announce_leave, profile_card, room_roster, roster_view
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Global DHT Server Instance
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-dht_server = Server()
-
-async def start_dht():
-    await dht_server.listen(9000)
-    await dht_server.bootstrap([("127.0.0.1", 9000)])
-
-loop.run_until_complete(start_dht())
-
 # Helper Functions
-async def get_room(code):
-    return await dht_server.get(code)
-
+# The DHT node is started lazily by DHTManager.get_instance() on the server's
+# event loop (or at boot by neo.lifespan), never at import time.
 async def store_room(code, admin_username):
     try:
         dht_manager = await DHTManager.get_instance()
-        success = await dht_manager.store_room(code, admin_username)
+        success = await dht_manager.store_room(code, admin_username, timeout=settings.DHT_STORE_TIMEOUT)
         if success:
             logger.info(f"Room {code} stored successfully in DHT")
         return success
@@ -59,15 +63,110 @@ async def store_room(code, admin_username):
 async def get_room_from_dht(code):
     try:
         dht_manager = await DHTManager.get_instance()
-        return await dht_manager.get_room(code)
+        return await dht_manager.get_room(code, timeout=settings.DHT_LOOKUP_TIMEOUT)
     except Exception as e:
         logger.error(f"Failed to retrieve room from DHT: {e}")
         return None
 
-def generate_room_code(length=6):
-    return ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=length))
+async def record_membership(code, username, joined):
+    """Append a join/leave delta to the room's DHT membership log."""
+    try:
+        dht_manager = await DHTManager.get_instance()
+        if joined:
+            return await dht_manager.add_member(code, username, timeout=settings.DHT_STORE_TIMEOUT)
+        return await dht_manager.remove_member(code, username, timeout=settings.DHT_STORE_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Failed to record membership change in DHT: {e}")
+        return False
+
+def async_login_required(login_url=None):
+    """
+    login_required for async views.
+
+    Django's async path calls backend.aget_user(), which the social-auth
+    backends don't implement, so resolve request.user in a thread instead.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not await sync_to_async(lambda: request.user.is_authenticated)():
+                return redirect_to_login(request.get_full_path(), login_url)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+ROOM_CODE_ATTEMPTS = 3
+
+class RoomCodeUnavailable(Exception):
+    pass
+
+def generate_room_code():
+    return room_code_allocator.allocate()
+
+def create_room_records(admin):
+    """Create the room, add its admin and point the admin's profile at it in one transaction."""
+    for _ in range(ROOM_CODE_ATTEMPTS):
+        room_code = generate_room_code()
+        try:
+            with transaction.atomic():
+                room = Room.objects.create(code=room_code, admin=admin)
+                room.add_member(admin)
+                user_profile = UserProfile.objects.select_for_update().get(user=admin)
+                user_profile.room_code = room_code
+                user_profile.is_online = True
+                user_profile.save(update_fields=['room_code', 'is_online'])
+            return room, user_profile
+        except IntegrityError:
+            logger.warning(f"Room code {room_code} was taken concurrently, retrying")
+    raise RoomCodeUnavailable()
+
+def join_room_records(user, room_code):
+    """Add the user to the room and point their profile at it in one transaction.
+
+    Returns (user_profile, previous_room, added); added is False when the
+    user already was a member.
+    """
+    with transaction.atomic():
+        room = Room.objects.get(code=room_code)
+        added = room.add_member(user)
+        user_profile, _ = UserProfile.objects.select_for_update().get_or_create(user=user)
+        previous_room = user_profile.room_code
+        user_profile.room_code = room_code
+        user_profile.is_online = True
+        user_profile.save(update_fields=['room_code', 'is_online'])
+    return user_profile, previous_room, added
+
+async def notify_room(room_code, message, user_id):
+    try:
+        await get_channel_layer().group_send(
+            f"dashboard_{room_code}",
+            {
+                'type': 'user_notification',
+                'message': message,
+                'user_id': user_id
+            }
+        )
+    except Exception as e:
+        logger.error(f"Failed to notify room {room_code}: {e}")
 
 
+def verify_recaptcha(recaptcha_response, remote_ip):
+    """Check a reCAPTCHA token with Google; an unreachable or failing service counts as not verified."""
+    try:
+        response = http_client.post(
+            'https://www.google.com/recaptcha/api/siteverify',
+            endpoint='recaptcha.siteverify',
+            data={
+                'secret': settings.RECAPTCHA_PRIVATE_KEY,
+                'response': recaptcha_response,
+                'remoteip': remote_ip
+            }
+        )
+        return bool(response.json().get('success'))
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"reCAPTCHA verification failed: {e}")
+        return False
+
 def is_strong_password(password):
     """Check if the password meets the strength criteria."""
     pattern = r"^(?=.*[A-Z])(?=.*[a-z])(?=.*\d)(?=.*[@#$%^&*()!])[A-Za-z\d@#$%^&*()!]{8,}$"
@@ -166,17 +265,7 @@ def login_view(request):
             })
 
         # Verify reCAPTCHA with Google
-        import requests
-        response = requests.post(
-            'https://www.google.com/recaptcha/api/siteverify',
-            data={
-                'secret': settings.RECAPTCHA_PRIVATE_KEY,
-                'response': recaptcha_response,
-                'remoteip': request.META.get('REMOTE_ADDR')
-            }
-        )
-        result = response.json()
-        if not result.get('success'):
+        if not verify_recaptcha(recaptcha_response, request.META.get('REMOTE_ADDR')):
             messages.error(request, "reCAPTCHA verification failed. Please try again.")
             return render(request, 'login.html', {
                 'RECAPTCHA_PUBLIC_KEY': settings.RECAPTCHA_PUBLIC_KEY
@@ -231,17 +320,7 @@ def google_login_with_recaptcha(request):
             })
 
         # Verify reCAPTCHA with Google
-        import requests
-        response = requests.post(
-            'https://www.google.com/recaptcha/api/siteverify',
-            data={
-                'secret': settings.RECAPTCHA_PRIVATE_KEY,
-                'response': recaptcha_response,
-                'remoteip': request.META.get('REMOTE_ADDR')
-            }
-        )
-        result = response.json()
-        if not result.get('success'):
+        if not verify_recaptcha(recaptcha_response, request.META.get('REMOTE_ADDR')):
             messages.error(request, "reCAPTCHA verification failed for Google login. Please try again.")
             return render(request, 'login.html', {
                 'RECAPTCHA_PUBLIC_KEY': settings.RECAPTCHA_PUBLIC_KEY
@@ -384,83 +463,60 @@ def room_view(request):
     }
     return render(request, "room.html", context)
 
-@login_required(login_url='login')
+@async_login_required(login_url='login')
 @require_http_methods(["POST"])
-def create_room(request):
+async def create_room(request):
     admin = request.user
-    room_code = generate_room_code()
-    
     try:
-        room = Room.objects.create(code=room_code, admin=admin)
-        room.users.add(admin)
-        
-        user_profile = UserProfile.objects.get(user=admin)
-        user_profile.room_code = room_code
-        user_profile.is_online = True
-        user_profile.save()
-        
-        request.session['room_code'] = room_code
-        dht_success = async_to_sync(store_room)(room_code, admin.username)
-        if not dht_success:
-            room.delete()
-            return JsonResponse({"status": "error", "message": "Failed to create room in DHT"}, status=500)
-        
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"dashboard_{room_code}",
-            {
-                'type': 'user_notification',
-                'message': f"{user_profile.google_name or admin.username} has created the room",
-                'user_id': admin.id
-            }
-        )
-        
-        return JsonResponse({"status": "success", "room_code": room_code})
+        room, user_profile = await sync_to_async(create_room_records)(admin)
+    except RoomCodeUnavailable:
+        return JsonResponse({"status": "error", "message": "Could not allocate a room code"}, status=503)
     except Exception as e:
         logger.error(f"Failed to create room: {e}")
-        Room.objects.filter(code=room_code).delete()
         return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
-@login_required(login_url='login')
+    room_code = room.code
+    await request.session.aset('room_code', room_code)
+    # Nothing is announced until the room exists in the DHT; a failed store deletes it again
+    if not await store_room(room_code, admin.username):
+        await sync_to_async(room.delete)()
+        return JsonResponse({"status": "error", "message": "Failed to create room in DHT"}, status=500)
+    await asyncio.gather(
+        announce_join(room_code, profile_card(user_profile, admin)),
+        notify_room(room_code, f"{user_profile.google_name or admin.username} has created the room", admin.id),
+    )
+
+    return JsonResponse({"status": "success", "room_code": room_code})
+
+@async_login_required(login_url='login')
 @require_http_methods(["POST"])
 @csrf_exempt
-def join_room(request):
+async def join_room(request):
     room_code = request.POST.get("room_code", "").strip()
     if not room_code:
         return JsonResponse({"error": "Room code is required"}, status=400)
 
-    print(f"Received room code: {room_code}")
+    user = request.user
     try:
-        room = Room.objects.get(code=room_code)
-        user = request.user
-        if user not in room.users.all():
-            room.users.add(user)
-        
-        user_profile, created = UserProfile.objects.get_or_create(user=user)
-        user_profile.room_code = room_code
-        user_profile.is_online = True
-        user_profile.save()
-
-        request.session['room_code'] = room_code
-        logger.info(f"User {user.username} joined room {room_code}. Online users: {[u.username for u in room.users.all()]}")
-
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"dashboard_{room_code}",
-            {
-                'type': 'user_notification',
-                'message': f"{user_profile.google_name or user.username} has joined the room",
-                'user_id': user.id
-            }
-        )
-        
-        return JsonResponse({"message": "Room joined successfully", "room_code": room_code})
+        user_profile, previous_room, added = await sync_to_async(join_room_records)(user, room_code)
     except Room.DoesNotExist:
         return JsonResponse({"error": "Room not found"}, status=404)
     except Exception as e:
         logger.error(f"Error joining room: {e}")
         return JsonResponse({"error": str(e)}, status=500)
 
+    await request.session.aset('room_code', room_code)
+    logger.info(f"User {user.username} joined room {room_code}")
+    if previous_room and previous_room != room_code:
+        await announce_leave(previous_room, user.id)
+    await asyncio.gather(
+        # A rejoin would only append another add tag that a later leave has to cancel
+        record_membership(room_code, user.username, True) if added else asyncio.sleep(0),
+        announce_join(room_code, profile_card(user_profile, user)),
+        notify_room(room_code, f"{user_profile.google_name or user.username} has joined the room", user.id),
+    )
+    return JsonResponse({"message": "Room joined successfully", "room_code": room_code})
+
 @login_required(login_url='login')
 def dashboard_view(request):
     user_profile = UserProfile.objects.get(user=request.user)
@@ -469,19 +525,8 @@ def dashboard_view(request):
     
     seven_days_ago = timezone.now() - timedelta(days=7)
     room = Room.objects.get(code=user_profile.room_code)
-    room_users = UserProfile.objects.filter(room_code=user_profile.room_code, is_online=True).select_related('user')
-    
-    users_data = [
-        {
-            'id': profile.user.id,
-            'username': profile.google_name or profile.user.username,
-            'is_google_user': bool(profile.google_name),
-            'join_time': profile.user.date_joined.strftime('%Y-%m-%d %H:%M:%S'),
-            'is_current_user': profile.user == request.user,
-            'is_super_user': profile.user == room.admin
-        }
-        for profile in room_users
-    ]
+    roster_version, cards = async_to_sync(room_roster)(room.code)
+    users_data = roster_view(cards, request.user.id, room.admin_id)
 
     logger.info(f"Rendering dashboard for {request.user.username} with users_data: {users_data}")
     context = {
@@ -489,7 +534,10 @@ def dashboard_view(request):
         'files_received': FileTransfer.objects.filter(receiver=request.user, timestamp__gte=seven_days_ago).count(),
         'notifications': Notification.objects.filter(user=request.user, is_read=False)[:5],
         'room_code': user_profile.room_code,
-        'users_data': json.dumps(users_data)
+        'dashboard_ws_base': get_router().ws_base(user_profile.room_code),
+        'users_data': json.dumps(users_data),
+        'roster_version': roster_version,
+        'room_admin_id': room.admin_id
     }
     return render(request, 'dashboard.html', context)
 
@@ -514,6 +562,8 @@ def logout_view(request):
         user_profile.is_online = False
         user_profile.room_code = None
         user_profile.save()
+        if room_code:
+            async_to_sync(announce_leave)(room_code, request.user.id)
         
         logout(request)
         request.session.flush()
@@ -532,7 +582,9 @@ def leave_room(request):
             
             if room_code:
                 room = Room.objects.get(code=room_code)
-                room.users.remove(request.user)
+                if room.remove_member(request.user):
+                    async_to_sync(record_membership)(room_code, request.user.username, False)
+                async_to_sync(announce_leave)(room_code, request.user.id)
                 
                 user_profile.room_code = None
                 user_profile.is_online = False
@@ -575,7 +627,9 @@ def room_detail(request, room_code):
             'room': room,
             'dht_data': dht_room,
             'is_admin': request.user == room.admin,
-            'room_members': room.users.all(),
+            # Names come from dht_data; the database only answers count and membership
+            'member_count': room.member_count,
+            'is_member': room.has_member(request.user),
         }
         
         return render(request, 'room_detail.html', context)
@@ -584,27 +638,71 @@ def room_detail(request, room_code):
         return redirect('room')
 
 @login_required(login_url='login')
+def metrics_view(request):
+    """Per-process cache and pipeline counters, for staff only."""
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    return JsonResponse({
+        "dht_room_cache": DHTManager.cache_stats(),
+        "dht_breaker": DHTManager.breaker_stats(),
+        "live_users_broadcast": live_users_broadcaster.stats(),
+        "presence_writer": presence_writer.stats(),
+        "signaling_registry": get_channel_registry().stats(),
+        "consumer_logging": hotlog.stats(),
+        "scan_verdicts": get_verdict_cache().stats(),
+        "scan_jobs": scan_pool.stats(),
+        "outbound_http": http_client.stats(),
+        "scan_prefilter": get_prefilter().stats(),
+    })
+
+@async_login_required(login_url='login')
 @require_http_methods(["POST"])
-def scan_file(request):
-    """Endpoint to scan a file before transfer"""
+async def scan_file(request):
+    """
+    Endpoint to scan a file before transfer.
+
+    Blocked extensions, files the local prefilter blocks and recently seen
+    files are answered at once with {"safe", "message"}. Anything else
+    is queued and answered with {"job_id", "timeout"} (202); the verdict
+    arrives on the signaling socket as a scan_result message carrying the
+    same job_id, within "timeout" seconds.
+    """
     try:
-        file = request.FILES.get('file')
+        # Parsing the multipart body writes large files to disk; keep it off the event loop
+        file = await asyncio.to_thread(lambda: request.FILES.get('file'))
         if not file:
             return JsonResponse({"error": "No file provided"}, status=400)
-            
-        # Read file content
-        file_content = file.read()
-        
-        # Scan file
-        is_safe, message = scan_file_metadefender(file_content, file.name)
-        
-        return JsonResponse({
-            "safe": is_safe,
-            "message": message
-        })
+
+        if is_dangerous_file(file.name):
+            is_safe, message = blocked_file_verdict(file.name)
+            return JsonResponse({"safe": is_safe, "message": message})
+
+        # Stream the upload to a spool file, hashing it on the way
+        file_path, file_hash = await asyncio.to_thread(spool_upload, file)
+        # Executables and known-bad hashes are blocked here; nothing is passed locally
+        verdict = await asyncio.to_thread(get_prefilter().check, file_path, file_hash)
+        if verdict is not None:
+            os.remove(file_path)
+            is_safe, message = verdict
+            return JsonResponse({"safe": is_safe, "message": message})
+
+        # Same bytes scanned remotely before
+        verdict = get_verdict_cache().peek(file_hash)
+        if verdict is not None:
+            os.remove(file_path)
+            is_safe, message = verdict
+            return JsonResponse({"safe": is_safe, "message": message})
+
+        # Scan file in the background
+        try:
+            job_id = scan_pool.submit(request.user.id, file.name, file_path, file_hash)
+        except ScanQueueFull:
+            os.remove(file_path)
+            return JsonResponse({"error": "Scanner busy", "message": "Too many scans queued, try again shortly"}, status=503)
+        return JsonResponse({"job_id": job_id, "status": "queued", "timeout": scan_pool.verdict_timeout()}, status=202)
     except Exception as e:
         logger.error(f"Error scanning file: {e}")
         return JsonResponse({
             "error": "Failed to scan file",
             "message": str(e)
-        }, status=500)
\ No newline at end of file
+        }, status=500)
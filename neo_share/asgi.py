@@ -2,6 +2,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter  # Import routing cla
 from channels.auth import AuthMiddlewareStack  # Import middleware for WebSocket authentication
 from neo.routing import websocket_urlpatterns  # Import WebSocket URL patterns from neo.routing
 from django.core.asgi import get_asgi_application  # Import function to get the Django ASGI application
+from neo.lifespan import LifespanApp  # Import lifespan handler that starts/stops the DHT on the server loop
 
 application = ProtocolTypeRouter({  # Define the root ASGI application using ProtocolTypeRouter
     'http': get_asgi_application(),  # Route HTTP requests to the standard Django ASGI application
@@ -12,4 +13,6 @@ application = ProtocolTypeRouter({  # Define the root ASGI application using Pro
             websocket_urlpatterns  # Use patterns defined in neo/routing.py
         )
     ),  # AuthMiddlewareStack adds session and user authentication to WebSocket connections
+
+    'lifespan': LifespanApp(),  # Start the DHT node at worker boot on servers that send lifespan events
 })
\ No newline at end of file
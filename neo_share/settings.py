@@ -77,6 +77,78 @@ CHANNEL_LAYERS = {  # Configuration for Channels layer (for WebSocket communicat
     },
 }
 
+# Cluster layout for room affinity (see neo/affinity.py)
+NEO_NODE_NAME = os.environ.get('NEO_NODE_NAME', 'local')  # Name of this worker; its DHT node id is sha1(name)
+NEO_CLUSTER_NODES = {  # name -> {"ws_url": public websocket base URL}; empty or one entry = single-node mode
+    # "node-a": {"ws_url": "wss://a.example.com"},
+    # "node-b": {"ws_url": "wss://b.example.com"},
+}
+
+# Kademlia DHT node
+DHT_PORT = 8468  # UDP port this worker's DHT node listens on
+DHT_BOOTSTRAP_NODES = [("127.0.0.1", 8468), ("127.0.0.1", 9000)]  # Peers tried in order when joining the network
+DHT_KSIZE = 20  # Bucket size / replication factor
+DHT_ALPHA = 3  # Lookup parallelism
+
+# DHT room metadata cache (per worker process)
+DHT_ROOM_CACHE_SIZE = 1024  # Maximum number of rooms kept in memory before LRU eviction
+DHT_ROOM_CACHE_TTL = 300  # Seconds a cached room record is served before re-reading the DHT
+DHT_BATCH_CONCURRENCY = 16  # Max concurrent Kademlia lookups per get_many/set_many call
+DHT_RETRY_ATTEMPTS = 3  # Tries per DHT call
+DHT_RETRY_BASE_DELAY = 0.05  # Seconds; backoff ceiling doubles per retry, actual delay is fully jittered
+DHT_RETRY_MAX_DELAY = 1.0  # Seconds; largest backoff ceiling
+DHT_ATTEMPT_TIMEOUT = 2.0  # Seconds one Kademlia call may take when the caller has no tighter deadline
+DHT_LOOKUP_TIMEOUT = 0.2  # Seconds room_detail may spend reading a room from the DHT
+DHT_STORE_TIMEOUT = 1.0  # Seconds create_room may spend storing a room in the DHT
+DHT_BREAKER_FAILURES = 5  # Consecutive DHT failures before the circuit opens
+DHT_BREAKER_RESET = 10.0  # Seconds the circuit stays open before one trial call
+DHT_MEMBERSHIP_COMPACT_EVERY = 32  # Membership ops a node appends to a room before folding them into its snapshot
+DHT_MEMBERSHIP_TIMEOUT = 1.0  # Seconds get_room may spend folding a room's membership log after reading its record
+DHT_CODEC = 'neo.dht_codec.BinaryCodec'  # Value codec; BinaryCodec still reads records pickled by older nodes
+ROOM_CODE_POOL_SIZE = 256  # Pre-verified room codes kept in memory; refilled with one query when it runs low
+PRESENCE_BACKEND = 'neo.presence.RedisPresenceStore'  # Room roster / live-user index; LocalPresenceStore for a single process
+PRESENCE_REDIS_URL = 'redis://127.0.0.1:6379/1'  # Redis database for the presence index (channel layer uses db 0)
+PRESENCE_TTL = 60  # Seconds without an open dashboard before a member drops out of a roster (leave delta published)
+PRESENCE_ROOM_HEARTBEAT = 20  # Seconds between each worker's roster heartbeat of the members whose dashboards it serves
+LIVE_USERS_BROADCAST_TICK = 0.25  # Seconds between coalesced live_users deltas; at most one fan-out per tick per process
+PRESENCE_LIVE_TTL = 60  # Seconds a live-user connection survives without a heartbeat (covers crashed workers)
+PRESENCE_LIVE_HEARTBEAT = 20  # Seconds between each worker's batched heartbeat of its own sockets
+PRESENCE_WRITE_INTERVAL = 1.0  # Seconds between write-behind flushes of UserProfile.is_online / last_seen
+PRESENCE_WRITE_BATCH = 500  # Profiles per UPDATE ... FROM (VALUES ...) statement
+RATE_LIMIT_BACKEND = 'neo.ratelimit.RedisRateLimiter'  # Cluster-wide token buckets; LocalRateLimiter for a single process
+RATE_LIMIT_REDIS_URL = 'redis://127.0.0.1:6379/1'  # Redis database holding the token buckets
+SIGNALING_RATE_LIMITS = {  # Per-action (burst, per_seconds) token buckets for the signaling socket
+    'default': (10, 60),  # Anything not listed: 10 messages a minute
+    'file_transfer_request': (10, 60),  # Transfer requests: 10 a minute
+    'file_transfer_response': (10, 60),  # Accept/reject answers: 10 a minute
+    'webrtc_offer': (20, 60),  # SDP offers: 20 a minute
+    'webrtc_ice_candidate': (200, 10),  # ICE candidates come in bursts during connection setup
+    'webrtc_ice_candidates': (50, 10),  # Candidate arrays, up to 64 candidates each
+}
+SIGNALING_ICE_BATCH_WINDOW = 0.02  # Seconds outgoing ICE candidates for one target are held and coalesced
+SIGNALING_ICE_BATCH_MAX = 32  # Forward a candidate batch early once it reaches this size
+SIGNALING_DIRECT_SEND = True  # Send to a user's only signaling socket with channel_layer.send instead of group_send
+SIGNALING_REGISTRY_BACKEND = 'neo.signaling.RedisChannelRegistry'  # user id -> channel names; LocalChannelRegistry for one process
+SIGNALING_REGISTRY_REDIS_URL = 'redis://127.0.0.1:6379/1'  # Redis database for the channel registry
+SIGNALING_REGISTRY_CACHE_TTL = 1.0  # Seconds a worker reuses a registry lookup before asking Redis again
+CONSUMER_LOG_SAMPLE_RATE = 1.0  # Fraction of per-message consumer INFO/DEBUG records kept; warnings and errors are never sampled
+CONSUMER_LOG_MAX_PER_SECOND = 20  # Per-socket cap on per-message consumer log records
+SCAN_VERDICT_BACKEND = 'neo.scan_cache.RedisVerdictStore'  # Shared SHA-256 -> verdict store; LocalVerdictStore for a single process
+SCAN_VERDICT_REDIS_URL = 'redis://127.0.0.1:6379/1'  # Redis database for scan verdicts
+SCAN_VERDICT_TTL = 86400  # Seconds a verdict is reused before the file is looked up again
+SCAN_VERDICT_MEMORY_SIZE = 4096  # Verdicts each worker keeps in memory, least recently used evicted first
+SCAN_WORKERS = 4  # Scans each process runs at once in the background
+SCAN_QUEUE_SIZE = 64  # Scans waiting for a worker before scan_file answers 503
+SCAN_JOB_TIMEOUT = 60.0  # Seconds a background scan may run before it is cut off (fails open like other scan errors)
+SCAN_SPOOL_DIR = None  # Directory for queued uploads awaiting a scan; None uses the system temp dir
+OUTBOUND_HTTP_TIMEOUT = (3.05, 30)  # (connect, read) seconds for external API calls without their own timeout
+OUTBOUND_HTTP_MAX_PER_HOST = 10  # Keep-alive connections per external host; further calls wait for one
+OUTBOUND_HTTP_MAX_HOSTS = 10  # External hosts whose connection pools are kept
+OUTBOUND_HTTP_MAX_WORKERS = 16  # Threads serving async outbound calls
+SCAN_BAD_HASHES_FILE = None  # File of known-bad SHA-256 hashes, one per line, loaded into a Bloom filter
+SCAN_BAD_HASHES_FP_RATE = 1e-6  # Bloom filter false-positive rate; a false positive blocks a harmless file
+SCAN_YARA_RULES = None  # Optional YARA rules file; needs yara-python
+
 # Message settings
 from django.contrib.messages import constants as messages  # Import message constants
 MESSAGE_TAGS = {  # Map message levels to Bootstrap alert classes
@@ -239,7 +311,7 @@ LOGGING = {  # Logging configuration
     },
     'root': {  # Root logger configuration
         'handlers': ['console'],  # Use console handler
-        'level': 'DEBUG',  # Log DEBUG level and above
+        'level': os.environ.get('DJANGO_LOG_LEVEL', 'INFO'),  # DEBUG also logs signaling payload bodies
     },
 }
 
@@ -253,4 +325,7 @@ SOCIALACCOUNT_PROVIDERS = {  # Configuration for social providers
 }
 
 # MetaDefender Cloud API Key
-METADEFENDER_API_KEY = "df1a3063c93f86f422315e07a18ef559"  # Add your API key here
\ No newline at end of file
+METADEFENDER_API_KEY = "df1a3063c93f86f422315e07a18ef559"  # Add your API key here
+METADEFENDER_API_URL = os.environ.get('METADEFENDER_API_URL', 'https://api.metadefender.com/v4')  # Point at 'manage.py fake_metadefender' to work offline
+METADEFENDER_POLL_ATTEMPTS = 5  # Report polls after an upload before giving up
+METADEFENDER_POLL_INTERVAL = 2.0  # Seconds between report polls
\ No newline at end of file
@@ -77,4 +77,7 @@ urlpatterns = [  # List of URL patterns
 
     path('scan-file/', views.scan_file, name='scan_file'),  # URL for file scanning endpoint
     # Routes to scan_file view, named 'scan_file' for reverse URL resolution
+
+    path('metrics/', views.metrics_view, name='metrics'),  # URL for per-process cache/pipeline counters (staff only)
+    # Routes to metrics_view, named 'metrics' for reverse URL resolution
 ]
\ No newline at end of file